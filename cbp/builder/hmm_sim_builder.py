@@ -4,10 +4,19 @@ from .hmm_builder import HMMBuilder
 
 
 class HMMSimBuilder(HMMBuilder):
-    def __init__(self, length, simulator, policy,
-                 random_seed=1):
+    """HMM graph with the potentials and observations of a simulator
+
+    :param threshold: entries of the normalized transition and emission
+        potentials below it are dropped and the factors keep them sparse,
+        see :class:`~cbp.node.FactorNode`, defaults to None
+    :type threshold: float, optional
+    """
+
+    def __init__(self, length, simulator, policy,  # pylint: disable=too-many-arguments
+                 random_seed=1, threshold=None):
         super().__init__(length, simulator.record.state_num, policy, random_seed)
         self.simulator = simulator
+        self.threshold = threshold
         self.cnt_constrained_node = 0
 
     def fix_initpotential(self, potential=None):
@@ -36,7 +45,8 @@ class HMMSimBuilder(HMMBuilder):
             potential = self.simulator.get_emission_potential()
         else:
             potential = self.simulator.get_transition_potential()
-        factornode = FactorNode(name_list, potential)
+        factornode = FactorNode(name_list, potential,
+                                threshold=self.threshold)
         self.graph.add_factornode(factornode)
         return factornode
 
@@ -3,6 +3,22 @@ from dataclasses import dataclass
 
 @dataclass
 class BaseConfig:
+    #: emit a :class:`~cbp.graph.compiled_graph.CompiledGraph` during `bake`
+    #: and run the inference engines on it instead of the node objects
+    compiled: bool = False
+    #: run the compiled engine on log-values
+    #: (:class:`~cbp.graph.log_compiled_graph.LogCompiledGraph`), implies
+    #: `compiled`
+    log_domain: bool = False
+    #: with more than one worker ``parallel_message`` runs synchronous
+    #: sweeps on forked processes sharing the messages
+    #: (:class:`~cbp.graph.parallel_flooding.ParallelFlooding`), implies
+    #: `compiled`
+    num_worker: int = 1
+    #: allocates the messages of the compiled engine, e.g. a
+    #: :class:`~cbp.utils.message_store.MemmapStore` for graphs whose
+    #: messages do not fit in memory, in memory when None
+    message_store: object = None
 
     @staticmethod
     def itsbp_schedule(cnt, leaf_nodes):
@@ -1,9 +1,13 @@
 from .base_graph import BaseGraph
 from .graph_model import GraphModel
+from .compiled_graph import CompiledGraph
+from .log_compiled_graph import LogCompiledGraph
 from . import coef_policy
 
 __all__ = [
     "BaseGraph",
     "GraphModel",
+    "CompiledGraph",
+    "LogCompiledGraph",
     "coef_policy"
 ]
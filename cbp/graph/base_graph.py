@@ -9,7 +9,9 @@ from cbp.utils.np_utils import (nd_expand, nd_multiexpand,
                                 reduction_ndarray)
 from cbp.configs.base_config import baseconfig
 from .coef_policy import bp_policy
-from .graph_utils import cal_marginal_from_tensor
+from .graph_utils import cal_marginal_from_tensor, dfs_order
+from .tree_sinkhorn import TreeSinkhorn
+from .variable_elimination import JunctionTree
 try:
     import pygraphviz  # noqa
 except BaseException:
@@ -29,6 +31,9 @@ class BaseGraph():  # pylint: disable=too-many-instance-attributes
         self.cnt_varnode = 0
         self.cnt_factornode = 0
         self.cfg = config
+        self.compiled_graph = None
+        self._traversal = None
+        self.sinkhorn_joint = None
 
         # debug utils
         self.silent = silent
@@ -47,6 +52,7 @@ class BaseGraph():  # pylint: disable=too-many-instance-attributes
         node.format_name(varnode_name)
         self.varnode_recorder[varnode_name] = node
         self.node_recorder[varnode_name] = node
+        self._traversal = None
         if node.isconstrained:
             self.constrained_names.append(varnode_name)
 
@@ -74,6 +80,7 @@ class BaseGraph():  # pylint: disable=too-many-instance-attributes
 
         self.__register_connection(factornode)
         self.__set_parent(factornode)
+        self._traversal = None
 
         self.cnt_factornode += 1
         return factornode_name
@@ -101,24 +108,47 @@ class BaseGraph():  # pylint: disable=too-many-instance-attributes
         var_dim = [variable.rv_dim for variable in varnodes]
         assert len(var_dim) < 32, "max number of vars for brute_force is 32 \
             (numpy matrix dim limit)"
+        # the joint is the only joint-sized allocation, factors are
+        # multiplied in through broadcasting views
         joint_acc = np.ones(var_dim)
         for factor in self.factornode_recorder.values():
             which_dims = [varnode_names.index(v)
                           for v in factor.get_connections()]
-            factor_acc = np.ones(var_dim)
-
-            factor_acc = nd_multiexpand(factor.potential, var_dim, which_dims)
-
-            joint_acc *= factor_acc
-
-        joint_prob = joint_acc / np.sum(joint_acc)
-        return joint_prob
-
-    def exact_marginal(self):
+            joint_acc *= nd_multiexpand(factor.dense_potential, var_dim,
+                                        which_dims)
+
+        joint_acc /= np.sum(joint_acc)
+        return joint_acc
+
+    def exact_marginal(self, method="elimination", heuristic="min_fill"):
+        """exact marginals of the factor potentials, kept in
+        ``node.bfmarginal``
+
+        :param method: ``"elimination"`` calibrates a
+            :class:`~cbp.graph.variable_elimination.JunctionTree`, exponential
+            in the treewidth only, ``"brute_force"`` reduces :meth:`pmf`,
+            defaults to "elimination"
+        :type method: str, optional
+        :param heuristic: elimination order heuristic, see
+            :func:`~cbp.graph.variable_elimination.elimination_order`,
+            defaults to "min_fill"
+        :type heuristic: str, optional
+        """
         varnodes = list(self.varnode_recorder.values())
-        prob_tensor = self.pmf()
-
-        marginal_list = cal_marginal_from_tensor(prob_tensor, varnodes)
+        if method == "elimination":
+            varnode_names = list(self.varnode_recorder.keys())
+            factors = [([varnode_names.index(name)
+                         for name in factor.get_connections()],
+                        factor.dense_potential)
+                       for factor in self.factornode_recorder.values()]
+            junction_tree = JunctionTree(
+                [node.rv_dim for node in varnodes], factors, heuristic)
+            marginal_list = [junction_tree.marginal(idx)
+                             for idx in range(len(varnodes))]
+        elif method == "brute_force":
+            marginal_list = cal_marginal_from_tensor(self.pmf(), varnodes)
+        else:
+            raise ValueError(f"unknown exact marginal method {method}")
         for node, marginal in zip(varnodes, marginal_list):
             node.bfmarginal = marginal
 
@@ -143,6 +173,7 @@ class BaseGraph():  # pylint: disable=too-many-instance-attributes
                 another_node = another_graph.node_recorder[node.name]
                 node.message_inbox = another_node.message_inbox
                 node.latest_message = another_node.latest_message
+                node.message_index = another_node.message_index
             else:
                 raise f"{node.name} not in this graph"
 
@@ -158,6 +189,7 @@ class BaseGraph():  # pylint: disable=too-many-instance-attributes
             }
         for node in self.varnode_recorder.values():
             node.sinkhorn = np.ones(node.rv_dim) / node.rv_dim
+        self.sinkhorn_joint = None
 
     def __build_big_u(self):
         varnodes = list(self.varnode_recorder.values())
@@ -165,65 +197,123 @@ class BaseGraph():  # pylint: disable=too-many-instance-attributes
         joint_acc = np.ones(var_dim)
 
         for _, recoder in self.sinkhorn_node_coef.items():
-            constrained_acc = nd_expand(
+            joint_acc *= nd_expand(
                 recoder['u'], tuple(var_dim), recoder['index'])
-            joint_acc *= constrained_acc
 
         # log_joint_acc -= np.max(log_joint_acc)
-        return joint_acc / np.sum(joint_acc)
+        joint_acc /= np.sum(joint_acc)
+        return joint_acc
 
     # TODO this is a bug!!!!
-    def sinkhorn_update(self, tilde_c):
-        for _, recorder in self.sinkhorn_node_coef.items():
-            big_u = self.__build_big_u()
-            normalized_denominator = (big_u * tilde_c) / \
-                np.sum(big_u * tilde_c)
+    def sinkhorn_update(self, tilde_c, jacobi=False):
+        """one sweep of scaling over the constrained nodes
 
-            copy_denominator = reduction_ndarray(
-                normalized_denominator, recorder['index'])
-            copy_denominator = np.clip(copy_denominator, 1e-12, None)
-            recorder['u'] = recorder['u'] * recorder['mu'] / copy_denominator
+        ``sinkhorn_joint``, ``big_u * tilde_c`` up to a constant, is built
+        once and a scaling only multiplies in the ratio of the changed ``u``
+        along its axis.
 
+        :param jacobi: scale all constrained nodes from the marginals of the
+            same joint instead of one after another, defaults to False
+        :type jacobi: bool, optional
+        """
+        if self.sinkhorn_joint is None:
+            self.sinkhorn_joint = self.__build_big_u()
+            self.sinkhorn_joint *= tilde_c
+        joint = self.sinkhorn_joint
         varnodes = list(self.varnode_recorder.values())
-        marginal_list = cal_marginal_from_tensor(
-            normalized_denominator, varnodes)
+        last_name = list(self.sinkhorn_node_coef)[-1]
+        marginal_list = None
+        for name, recorder in self.sinkhorn_node_coef.items():
+            if jacobi or name == last_name:
+                if marginal_list is None:
+                    marginal_list = cal_marginal_from_tensor(joint, varnodes)
+                marginal = marginal_list[recorder['index']]
+            else:
+                marginal = reduction_ndarray(joint, recorder['index'])
+            total = np.sum(marginal)
+            copy_denominator = np.clip(marginal / total, 1e-12, None)
+            ratio = recorder['mu'] / copy_denominator
+            recorder['u'] = recorder['u'] * ratio
+            if not jacobi or name == last_name:
+                ratio = ratio / total
+            joint *= nd_expand(ratio, joint.shape, recorder['index'])
+
         for node, marginal in zip(varnodes, marginal_list):
-            node.sinkhorn = marginal
+            node.sinkhorn = marginal / np.sum(marginal)
 
     def __check_sinkhorn(self):
         if len(self.constrained_names) == 0:
             raise RuntimeError(
                 "There is no constrained nodes, use brutal force")
 
-    def sinkhorn(self, max_iter=5000000, tolerance=1e-5):
+    def sinkhorn(self, max_iter=5000000, tolerance=1e-5,  # pylint: disable=too-many-arguments
+                 method="dense", jacobi=False, deadline=None):
+        """multi-marginal sinkhorn, the scaled joint marginals are kept in
+        ``node.sinkhorn``
+
+        :param method: ``"dense"`` scales the joint tensor of :meth:`pmf`,
+            ``"tree"`` uses message passing on the tree, see
+            :class:`~cbp.graph.tree_sinkhorn.TreeSinkhorn`, defaults to
+            "dense"
+        :type method: str, optional
+        :param jacobi: scale all constrained nodes at once per sweep, see
+            :meth:`sinkhorn_update`, defaults to False
+        :type jacobi: bool, optional
+        :param deadline: wall-clock budget in seconds, defaults to None
+        :type deadline: float, optional
+        :return: distances, num of steps, timers. ``violation`` is the max L1
+            distance between ``node.sinkhorn`` and the constrained marginals
+        :rtype: ~cbp.utils.InferenceResult
+        """
         self.__check_sinkhorn()
-        tilde_c = self.pmf()
         self.__init_sinkhorn_node()
-
-        sinkhorn_func = partial(self.sinkhorn_update, tilde_c)
-        return engine_loop(engine_fun=sinkhorn_func,
-                           max_iter=max_iter,
-                           tolerance=tolerance,
-                           error_fun=diff_max_marginals,
-                           meassure_fun=self.export_sinkhorn,
-                           isoutput=False,
-                           silent=self.silent)
+        if method == "tree":
+            self.init_node_recorder()
+            sinkhorn_func = partial(TreeSinkhorn(self).update, jacobi)
+        elif method == "dense":
+            tilde_c = self.pmf()
+            sinkhorn_func = partial(self.sinkhorn_update, tilde_c, jacobi)
+        else:
+            raise ValueError(f"unknown sinkhorn method {method}")
+        result = engine_loop(engine_fun=sinkhorn_func,
+                             max_iter=max_iter,
+                             tolerance=tolerance,
+                             error_fun=diff_max_marginals,
+                             meassure_fun=self.export_sinkhorn,
+                             isoutput=False,
+                             silent=self.silent,
+                             deadline=deadline)
+        violation = max(
+            np.sum(np.abs(self.varnode_recorder[name].sinkhorn -
+                          self.varnode_recorder[name].constrained_marginal))
+            for name in self.constrained_names)
+        return result.replace(marginals=self.export_sinkhorn(),
+                              violation=float(violation))
 
     def bake(self):
         self.init_node_recorder()
-        for node in self.nodes:
-            if len(node.connections) == 1:
-                root = node
-        self.__cal_node_coef(root)
-
-    def __cal_node_coef(self, node):
-        node.is_traversed = True
-        for item in node.connections:
-            if not self.node_recorder[item].is_traversed:
-                self.__cal_node_coef(self.node_recorder[item])
-
-        node.auto_coef(self.node_recorder, self.coef_policy)
-        node.is_traversed = False
+        _, postorder = self.traversal_order()
+        for node, _ in postorder:
+            node.auto_coef(self.node_recorder, self.coef_policy)
+
+    def traversal_order(self):
+        """depth first order rooted at the last leaf of ``nodes``, computed
+        once and cached until nodes are added or deleted
+
+        :raises RuntimeError: no leaf node to root the traversal
+        :return: pre-order and post-order lists of ``(node, parent)``, see
+            :func:`~cbp.graph.graph_utils.dfs_order`
+        :rtype: tuple
+        """
+        if self._traversal is None:
+            root = None
+            for node in self.nodes:
+                if len(node.connections) == 1:
+                    root = node
+            if root is None:
+                raise RuntimeError("graph contains circle")
+            self._traversal = dfs_order(root, self.node_recorder)
+        return self._traversal
 
     def init_node_recorder(self):
         factors = list(self.factornode_recorder.values())
@@ -265,6 +355,7 @@ class BaseGraph():  # pylint: disable=too-many-instance-attributes
         """
         if name_str not in self.node_recorder:
             raise RuntimeError(f"{name_str} is illegal, not in this graph")
+        self._traversal = None
         target_node = self.node_recorder[name_str]
         if isinstance(target_node, VarNode):
             warnings.warn(f"Delete {name_str}, may have a suspend factor node")
@@ -288,7 +379,8 @@ class BaseGraph():  # pylint: disable=too-many-instance-attributes
         if node.name in self.constrained_names:
             self.constrained_names.remove(node.name)
 
-    def set_node(self, node_name, potential=None, isconstrained=None):
+    def set_node(self, node_name, potential=None, isconstrained=None,
+                 constrained_marginal=None):
         """change node property
         1. check whether or not in recorder
         2. change potential easily[this may a duplicate function]
@@ -300,6 +392,9 @@ class BaseGraph():  # pylint: disable=too-many-instance-attributes
         :type potential: [type], optional
         :param isconstrained: [description], defaults to None
         :type isconstrained: [type], optional
+        :param constrained_marginal: new fixed marginal of a variable node,
+            constrains the node, defaults to None
+        :type constrained_marginal: ndarray, optional
         :raises RuntimeError: [description]
         """
         if node_name not in self.node_recorder:
@@ -308,6 +403,10 @@ class BaseGraph():  # pylint: disable=too-many-instance-attributes
         if potential is not None:
             # TODO: make potential property check, when do set
             node.potential = potential
+        if constrained_marginal is not None:
+            node.set_constrained_marginal(constrained_marginal)
+            if node_name not in self.constrained_names:
+                self.constrained_names.append(node_name)
         if isconstrained is not None:
             if node.isconstrained != isconstrained:
                 node.isconstrained = isconstrained
@@ -322,6 +421,8 @@ class BaseGraph():  # pylint: disable=too-many-instance-attributes
         :return: {node.key:node.marginal}
         :rtype: dict
         """
+        if self.compiled_graph is not None:
+            return self.compiled_graph.export_marginals()
         return {
             n.name: n.marginal() for n in self.varnode_recorder.values()
         }
@@ -332,6 +433,8 @@ class BaseGraph():  # pylint: disable=too-many-instance-attributes
         :return: {node.key:node.marginal}
         :rtype: dict
         """
+        if self.compiled_graph is not None:
+            return self.compiled_graph.export_convergence_marginals()
         return {n.name: n.marginal() for n in self.nodes}
 
     def export_sinkhorn(self):
@@ -369,39 +472,33 @@ class BaseGraph():  # pylint: disable=too-many-instance-attributes
 
     def tree_bp(self):
         """run classical belief propagation on a tree graph, only need forward
-        and backward
+        and backward along the cached :meth:`traversal_order`
 
-            * add attr: is_send_forward: begin send forward false, after forward
-             before backward true, after backward false
         :raises RuntimeError: Only works for the tree graph, loopy graph does
         not work, root node not decided
         """
         assert len(self.constrained_names) == 0
         self.bake()
-        self.first_belief_propagation()
-        for node in self.nodes:
-            node.is_send_forward = False
+        preorder, postorder = self.traversal_order()
 
-        tree_root = None
-        for node in self.nodes:
-            if len(node.connections) == 1:
-                tree_root = node
-        if tree_root is None:
-            raise RuntimeError("graph contains circle")
-
-        self._send_forward(tree_root)
-        self._send_backward(tree_root)
-
-    def _send_forward(self, node):
-        node.is_send_forward = True
-        for cur_node in node.connected_nodes.values():
-            if not cur_node.is_send_forward:
-                self._send_forward(cur_node)
-                cur_node.send_message(node)
-
-    def _send_backward(self, node):
-        node.is_send_forward = False
-        for cur_node in node.connected_nodes.values():
-            if cur_node.is_send_forward:
-                node.send_message(cur_node)
-                self._send_backward(cur_node)
+        if self.compiled_graph is not None:
+            self.compiled_graph.init_messages()
+            self.compiled_graph.tree_bp(preorder[0][0].name)
+            self.compiled_graph.writeback(self)
+            return
+
+        self.first_belief_propagation()
+        self._send_forward(postorder)
+        self._send_backward(preorder)
+
+    @staticmethod
+    def _send_forward(postorder):
+        for node, parent in postorder:
+            if parent is not None:
+                node.send_message(parent)
+
+    @staticmethod
+    def _send_backward(preorder):
+        for node, parent in preorder:
+            if parent is not None:
+                parent.send_message(node)
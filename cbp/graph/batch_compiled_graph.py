@@ -0,0 +1,172 @@
+import numpy as np
+
+from .compiled_graph import CompiledGraph
+
+
+def batch_size(graph):
+    """number of evidence sets of a graph, the leading dim of the 2-D
+    constrained marginals, None when all of them are 1-D
+    """
+    sizes = {node.constrained_marginal.shape[0]
+             for node in graph.varnode_recorder.values()
+             if node.isconstrained and node.constrained_marginal.ndim == 2}
+    if not sizes:
+        return None
+    assert len(sizes) == 1, f"constrained marginals disagree on batch {sizes}"
+    return sizes.pop()
+
+
+def normalize_rows(val):
+    """in place, make every row of ``val`` sum to one, all axes but the first
+    one are summed
+    """
+    val /= np.sum(val, axis=tuple(range(1, val.ndim)), keepdims=True)
+    return val
+
+
+class BatchCompiledGraph(CompiledGraph):
+    """:class:`~cbp.graph.compiled_graph.CompiledGraph` solving ``B``
+    problems on the same graph at once
+
+    The problems share potentials and coefficients and differ by the
+    constrained marginals, which have shape ``(B, rv_dim)``, 1-D constrained
+    marginals are shared by all problems. Every message slot gets a leading
+    batch axis and one update runs on all problems with vectorised NumPy.
+    Problems are masked out with :meth:`set_active`, their messages are
+    frozen. Marginals are exported with shape ``(B, ...)``, the batched
+    messages are not written back into the nodes.
+    """
+
+    def __init__(self, graph):
+        self.batch_size = batch_size(graph)
+        super().__init__(graph)
+        self.active = np.ones(self.batch_size, dtype=bool)
+        self.rows = slice(None)
+        self.batch_step = np.zeros(self.batch_size, dtype=int)
+
+    def _batch_shape(self, graph):
+        return (self.batch_size,)
+
+    def set_active(self, active):
+        """only update the problems where ``active`` is True
+
+        :param active: mask of shape ``(B,)``
+        :type active: ndarray
+        """
+        self.active = np.asarray(active, dtype=bool)
+        self.rows = slice(None) if self.active.all() \
+            else np.flatnonzero(self.active)
+
+    def _v2f_term(self, edge, bank):
+        val = bank.v2f[edge][self.rows]
+        term = val.reshape((val.shape[0],) + self.edge_shape[edge])
+        if self.has_extra[edge]:
+            return term * np.power(self.last_inner(edge, bank)[self.rows],
+                                   self.extra_exponent[edge])
+        return term
+
+    def _factor_message(self, edge, src, dst):
+        factor = self.edge_factor[edge]
+        potential = self.factor_potential[factor]
+        edges = self.factor_edges(factor)
+        out = dst.f2v[edge]
+        num_row = len(self.active[self.rows])
+        if len(edges) == 1:
+            if self.has_extra[edge]:
+                self.last_inner(edge, dst)[self.rows] = potential
+            out[self.rows] = potential / np.sum(potential)
+            return
+
+        product_out = np.broadcast_to(
+            potential, (num_row,) + potential.shape)
+        for other in edges:
+            if other != edge:
+                product_out = product_out * self._v2f_term(other, src)
+        if self.has_extra[edge]:
+            self.last_inner(edge, dst)[self.rows] = product_out
+        self._sum_inner(edge, product_out, None, out)
+
+    def _sum_inner(self, edge, product_out, work, out):
+        hat_c_ialpha = self.hat_c_ialpha[edge]
+        axis = self.edge_axis[edge] + 1
+        with np.errstate(divide='raise'):
+            work = np.log(np.clip(product_out, 1e-12, None))
+            work *= 1.0 / hat_c_ialpha
+            np.exp(work, out=work)
+            message = np.power(
+                np.sum(work, axis=tuple(j for j in range(1, work.ndim)
+                                        if j != axis)),
+                hat_c_ialpha)
+        out[self.rows] = normalize_rows(message)
+
+    def _factor_messages(self, factor, src, dst):
+        for edge in self.factor_edges(factor):
+            self._factor_message(edge, src, dst)
+
+    def _log_numerator(self, var, bank):
+        if self.var_constrained[var]:
+            log_constrained = self.log_constrained[var]
+            if log_constrained.ndim == 2:
+                return log_constrained[self.rows]
+            return log_constrained
+        numerator = np.ones(self.var_dim[var])
+        for edge in self.var_edges(var):
+            numerator = numerator * bank.f2v[edge][self.rows]
+        with np.errstate(divide='raise'):
+            numerator = np.log(np.clip(numerator, 1e-12, None))
+        numerator += self.log_var_potential[var]
+        numerator *= 1.0 / self.hat_c_i[var]
+        return numerator
+
+    def _var_message(self, edge, src, dst, log_numerator=None):
+        var = self.edge_var[edge]
+        c_alpha = self.factor_coef[self.edge_factor[edge]]
+        if log_numerator is None:
+            log_numerator = self._log_numerator(var, src)
+        with np.errstate(divide='raise'):
+            log_base = np.log(np.clip(src.f2v[edge][self.rows], 1e-12, None))
+        log_base *= -1.0 / self.hat_c_ialpha[edge]
+        log_base += log_numerator
+        log_base *= c_alpha
+        dst.v2f[edge][self.rows] = normalize_rows(np.exp(log_base))
+
+    def flooding_message(self, run_constrained=True):
+        # masked problems keep their messages through the swap
+        self.arena.copy_front_to_back()
+        super().flooding_message(run_constrained)
+
+    def tree_bp(self, root):
+        raise NotImplementedError(
+            "tree_bp does not support constrained, batched graphs")
+
+    def var_marginal(self, var):
+        if self.var_constrained[var]:
+            return np.broadcast_to(self.constrained_marginal[var],
+                                   (self.batch_size, self.var_dim[var]))
+        prod = self.var_potential[var] * np.ones(
+            (self.batch_size, self.var_dim[var]))
+        for edge in self.var_edges(var):
+            prod *= self.f2v[edge]
+        return normalize_rows(np.power(prod, 1.0 / self.hat_c_i[var]))
+
+    def factor_marginal(self, factor):
+        rows, self.rows = self.rows, slice(None)
+        front = self.arena.front
+        product_out = self.factor_potential[factor]
+        for edge in self.factor_edges(factor):
+            product_out = product_out * self._v2f_term(edge, front)
+        self.rows = rows
+        return normalize_rows(
+            np.power(product_out, 1.0 / self.factor_coef[factor]))
+
+    def marginal_distance(self, mar_1, mar_2):
+        """per problem counterpart of
+        :func:`~cbp.utils.diff_max_marginals`, shape ``(B,)``
+        """
+        return np.max([np.sum(np.abs(mar_1[key] - mar_2[key]).reshape(
+            self.batch_size, -1), axis=1) for key in mar_1], axis=0)
+
+    def writeback(self, graph):
+        """no-op, node inboxes hold 1-D messages, read the batched results
+        with :meth:`export_marginals`
+        """
@@ -0,0 +1,478 @@
+import numpy as np
+from cbp.utils import ConvergenceMonitor, engine_loop
+from cbp.utils.message_store import MemoryStore
+
+from .chain_scan import chunked_scan
+
+
+def normalize_rows(array):
+    return array / np.sum(array, axis=-1, keepdims=True)
+
+
+class ChainEngine():  # pylint: disable=too-many-instance-attributes
+    """ITS-BP on the chain of :class:`~cbp.builder.HMMBuilder` graphs with
+    the messages of all time steps held as ``T x d`` arrays
+
+    Hidden variable ``h_t`` links to ``h_{t+1}`` by a transition factor and
+    to the constrained observation ``o_t`` by an emission factor. A sweep
+    sends the emission messages of all time steps at once as one matrix
+    product, runs the forward and backward recursions along the hidden
+    chain, and scales every observation to its constrained marginal. It
+    reaches the belief propagation fixed point of
+    :meth:`~cbp.graph.GraphModel.run_bp`, the coefficients of the graph are
+    not used. Potentials shared by all time steps, as the ones of
+    :class:`~cbp.builder.HMMSimBuilder`, are stored once.
+
+    :param transition: ``(d, d)`` potential of ``(h_t, h_{t+1})``, or
+        ``(T-1, d, d)`` one per time step
+    :type transition: ndarray
+    :param emission: ``(d, k)`` potential of ``(h_t, o_t)``, or
+        ``(T, d, k)``
+    :type emission: ndarray
+    :param constrained_marginal: ``(T, k)`` marginals of the observations
+    :type constrained_marginal: ndarray
+    :param potential: ``(d,)`` potential of ``h_0``, or ``(T, d)`` of all
+        hidden variables, defaults to None
+    :type potential: ndarray, optional
+    :param store: storage of the ``T x d`` and ``T x k`` arrays, e.g. a
+        :class:`~cbp.utils.message_store.MemmapStore` for chains that do not
+        fit in memory, the rows are then swept a window at a time, defaults
+        to a :class:`~cbp.utils.message_store.MemoryStore`
+    :type store: MemoryStore, optional
+    """
+
+    def __init__(self, transition, emission, constrained_marginal,  # pylint: disable=too-many-arguments
+                 potential=None, store=None):
+        self.store = MemoryStore() if store is None else store
+        self.length, obser_num = np.shape(constrained_marginal)
+        self.obser_num = obser_num
+        self.transition = np.asarray(transition, dtype=float)
+        self.emission = np.asarray(emission, dtype=float)
+        self.state_num = self.emission.shape[-2]
+        assert self.transition.shape[-2:] == (self.state_num,) * 2
+        assert self.transition.ndim == 2 or \
+            self.transition.shape[0] == self.length - 1
+        assert self.emission.shape[-1] == obser_num
+        assert self.emission.ndim == 2 or \
+            self.emission.shape[0] == self.length
+
+        self.potential = np.ones((0, self.state_num))
+        if potential is not None:
+            self.potential = np.asarray(potential, dtype=float).reshape(
+                (-1, self.state_num))
+            assert len(self.potential) in (1, self.length)
+        self.names = None
+        self.offset = 0
+
+        shape = (self.length, self.state_num)
+        self.fwd = self.store.full(shape, 1.0 / self.state_num)
+        self.bwd = self.store.full(shape, 1.0 / self.state_num)
+        self.up = self.store.full(shape, 1.0 / self.state_num)
+        self.hidden_marginal = self.store.full(shape, 1.0 / self.state_num)
+        self.obser2emission = self.store.full((self.length, obser_num),
+                                              1.0 / obser_num)
+        self.mu = self.store.empty((self.length, obser_num))
+        for low, high in self.blocks():
+            self.mu[low:high] = normalize_rows(
+                np.clip(constrained_marginal[low:high], 1e-12, None))
+            self.store.release(self.mu, low, high)
+        self.residual = np.inf
+
+    @classmethod
+    def from_simulator(cls, simulator, fix_initpotential=False, store=None):
+        """engine of the graph :class:`~cbp.builder.HMMSimBuilder` builds
+        from ``simulator``, the potentials are tied
+
+        :param fix_initpotential: ``h_0`` has the hidden marginal of the
+            simulation as potential, see
+            :meth:`~cbp.builder.HMMSimBuilder.fix_initpotential`, defaults to
+            False
+        :type fix_initpotential: bool, optional
+        """
+        potential = simulator.get_hidden_margin(0) \
+            if fix_initpotential else None
+        return cls(simulator.get_transition_potential(),
+                   simulator.get_emission_potential(),
+                   simulator.get_fix_margin(), potential, store)
+
+    @classmethod
+    def from_graph(cls, graph, store=None):
+        """engine of an HMM chain graph, the chain starts at the end of
+        lower index in ``graph.varnode_recorder``
+
+        :raises ValueError: ``graph`` is not a chain of hidden variables with
+            one constrained observation each
+        """
+        hidden, emission, transition = cls.__chain(graph)
+        varnodes = graph.varnode_recorder
+        factors = graph.factornode_recorder
+        obser = [[name for name in factors[factor].connections
+                  if name != var][0]
+                 for var, factor in zip(hidden, emission)]
+        state_num = varnodes[hidden[0]].rv_dim
+        trans_pot = np.array(
+            [oriented(factors[name], prev, cur)
+             for name, prev, cur in zip(transition, hidden[:-1], hidden[1:])]
+        ).reshape((-1, state_num, state_num))
+        emit_pot = np.array([oriented(factors[name], var, item)
+                             for name, var, item in zip(emission, hidden,
+                                                        obser)])
+        potential = np.array([varnodes[name].potential for name in hidden])
+        if np.allclose(potential[1:], potential[1:, :1]):
+            potential = potential[0]
+
+        engine = cls(tied(trans_pot), tied(emit_pot),
+                     np.array([varnodes[name].constrained_marginal
+                               for name in obser]),
+                     potential, store)
+        engine.names = (hidden, obser)
+        return engine
+
+    @staticmethod
+    def __chain(graph):
+        """hidden variables in chain order, their emission factors and the
+        transition factors between them
+        """
+        varnodes = graph.varnode_recorder
+        emission, links = {}, {}
+        for factor in graph.factornode_recorder.values():
+            if len(factor.connections) != 2:
+                raise ValueError(f"{factor.name} is not a pairwise factor")
+            constrained = [varnodes[name].isconstrained
+                           for name in factor.connections]
+            if all(constrained):
+                raise ValueError(f"{factor.name} links two observations")
+            if any(constrained):
+                var = factor.connections[constrained.index(False)]
+                if var in emission:
+                    raise ValueError(f"{var} has two observations")
+                emission[var] = factor.name
+                continue
+            for var in factor.connections:
+                links.setdefault(var, []).append(factor)
+
+        free = [name for name, node in varnodes.items()
+                if not node.isconstrained]
+        for name in graph.constrained_names:
+            if len(varnodes[name].connections) != 1 or \
+                    np.ndim(varnodes[name].constrained_marginal) != 1:
+                raise ValueError(f"{name} is not an observation")
+        if set(emission) != set(free) or any(
+                len(links.get(name, [])) > 2 for name in free):
+            raise ValueError("graph is not an HMM chain")
+
+        ends = [name for name in free if len(links.get(name, [])) <= 1]
+        if not ends:
+            raise ValueError("graph is not an HMM chain")
+        hidden, transition = [ends[0]], []
+        while len(hidden) < len(free):
+            nexts = [factor for factor in links.get(hidden[-1], [])
+                     if not transition or factor.name != transition[-1]]
+            if not nexts:
+                raise ValueError("graph is not an HMM chain")
+            transition.append(nexts[0].name)
+            hidden.append([name for name in nexts[0].connections
+                           if name != hidden[-1]][0])
+        return hidden, [emission[name] for name in hidden], transition
+
+    def __transition(self, step):
+        """potential of ``(h_step, h_{step+1})``"""
+        if self.transition.ndim == 2:
+            return self.transition
+        return self.transition[step]
+
+    def __var_potential(self, step):
+        if step < len(self.potential):
+            return self.potential[step]
+        return 1.0
+
+    def __emission(self, step):
+        """potential of ``(h_step, o_step)``"""
+        if self.emission.ndim == 2:
+            return self.emission
+        return self.emission[step]
+
+    def __scale(self, step):
+        """scale ``o_step`` to its constrained marginal given the messages
+        the hidden chain sends to it
+        """
+        emission = self.__emission(step)
+        message = self.__var_potential(step) * self.fwd[step] * \
+            self.bwd[step]
+        message = np.clip(message @ emission, 1e-12, None)
+        message = self.mu[step] / (message / np.sum(message))
+        self.obser2emission[step] = message / np.sum(message)
+        message = emission @ self.obser2emission[step]
+        self.up[step] = message / np.sum(message)
+
+    def __forward(self, step):
+        message = (self.__var_potential(step - 1) * self.fwd[step - 1] *
+                   self.up[step - 1]) @ self.__transition(step - 1)
+        self.fwd[step] = message / np.sum(message)
+
+    def __backward(self, step):
+        message = self.__transition(step) @ (
+            self.__var_potential(step + 1) * self.bwd[step + 1] *
+            self.up[step + 1])
+        self.bwd[step] = message / np.sum(message)
+
+    def blocks(self):
+        """``(low, high)`` row windows of the store, in order"""
+        row_bytes = 8 * (5 * self.state_num + 3 * self.obser_num)
+        step = self.store.window(row_bytes) or max(self.length, 1)
+        return [(low, min(low + step, self.length))
+                for low in range(0, self.length, step)]
+
+    def __release(self, low, high):
+        for array in (self.mu, self.fwd, self.bwd, self.up,
+                      self.hidden_marginal, self.obser2emission):
+            self.store.release(array, low, high)
+
+    def __emit(self, messages, low, high):
+        """messages of the emission factors of rows ``[low, high)`` to the
+        observations
+        """
+        if self.emission.ndim == 2:
+            product = messages @ self.emission
+        else:
+            product = np.einsum("tdk,td->tk", self.emission[low:high],
+                                messages)
+        return normalize_rows(np.clip(product, 1e-12, None))
+
+    def __hidden2emission(self, low, high):
+        message = self.fwd[low:high] * self.bwd[low:high]
+        num = max(min(high, len(self.potential)) - low, 0)
+        message[:num] *= self.potential[low:low + num]
+        message /= np.sum(message, axis=1, keepdims=True)
+        return message
+
+    def __obser_marginal(self, low, high):
+        return normalize_rows(
+            self.__emit(self.__hidden2emission(low, high), low, high) *
+            self.obser2emission[low:high])
+
+    def obser_marginal(self):
+        """``(T, k)`` marginals of the observations"""
+        marginal = self.store.empty(self.mu.shape)
+        for low, high in self.blocks():
+            marginal[low:high] = self.__obser_marginal(low, high)
+            self.store.release(marginal, low, high)
+        return marginal
+
+    def __update_marginal(self):
+        """hidden marginals from the current messages, window by window
+
+        :return: max L1 change of a hidden marginal
+        :rtype: float
+        """
+        residual = 0
+        for low, high in self.blocks():
+            marginal = self.__hidden2emission(low, high)
+            marginal *= self.up[low:high]
+            marginal /= np.sum(marginal, axis=1, keepdims=True)
+            residual = max(residual, np.max(np.sum(
+                np.abs(marginal - self.hidden_marginal[low:high]), axis=1)))
+            self.hidden_marginal[low:high] = marginal
+            self.__release(low, high)
+        return residual
+
+    def __weight(self, steps):
+        """``potential * up`` of the hidden variables at ``steps``"""
+        weight = self.up[steps].copy()
+        inside = steps < len(self.potential)
+        weight[inside] *= self.potential[steps[inside]]
+        return weight
+
+    def __transitions(self, steps):
+        if self.transition.ndim == 2:
+            return self.transition[None]
+        return self.transition[steps]
+
+    def __forward_operator(self, low, high):
+        steps = np.arange(low, high)
+        return self.__weight(steps)[:, :, None] * self.__transitions(steps)
+
+    def __backward_operator(self, low, high):
+        steps = self.length - 2 - np.arange(low, high)
+        operators = self.__transitions(steps) * \
+            self.__weight(steps + 1)[:, None, :]
+        return np.swapaxes(operators, 1, 2)
+
+    def forward_backward(self, method="sequential", num_worker=1):
+        """send the transition messages of the whole chain again with the
+        emission messages fixed, the hidden marginals are recomputed
+
+        With ``"scan"`` message ``t`` of the forward pass is the first one
+        times the product of the ``t`` operators ``diag(potential * up)
+        @ transition`` before it, all of them are computed with
+        :func:`~cbp.graph.chain_scan.chunked_scan` on ``num_worker``
+        processes, the backward pass likewise. The depth is logarithmic in
+        ``T`` but the work is ``O(T d^3)`` instead of ``O(T d^2)``, it pays
+        off for small ``d`` and many cores.
+
+        :param method: ``"sequential"`` or ``"scan"``, defaults to
+            "sequential"
+        :type method: str, optional
+        :param num_worker: processes of the scan, defaults to 1
+        :type num_worker: int, optional
+        :return: ``(T, d)`` hidden marginals
+        :rtype: ndarray
+        """
+        if method == "sequential":
+            for step in range(1, self.length):
+                self.__forward(step)
+            for step in range(self.length - 2, -1, -1):
+                self.__backward(step)
+        elif method == "scan":
+            self.fwd[1:] = chunked_scan(self.fwd[0], self.__forward_operator,
+                                        self.length - 1, num_worker)
+            self.bwd[:-1] = chunked_scan(
+                self.bwd[-1], self.__backward_operator, self.length - 1,
+                num_worker)[::-1]
+        else:
+            raise ValueError(f"unknown forward backward method {method}")
+
+        self.__update_marginal()
+        return self.hidden_marginal
+
+    def sweep(self):
+        """scale the observations one after the other from the first to the
+        last time step and back, the messages between two observations are
+        sent right before the second one is scaled
+
+        :return: number of messages sent
+        :rtype: int
+        """
+        window = self.blocks()[0][1]
+        for step in range(self.length):
+            if step > 0:
+                self.__forward(step)
+            self.__scale(step)
+            if step % window == window - 1:
+                self.__release(step + 1 - window, step)
+        for step in range(self.length - 2, -1, -1):
+            self.__backward(step)
+            self.__scale(step)
+            if (self.length - 1 - step) % window == 0:
+                self.__release(step + 1, step + 1 + window)
+
+        self.residual = self.__update_marginal()
+        return 4 * (self.length - 1) + 4 * (2 * self.length - 1)
+
+    def append(self, constrained_marginal, transition=None, emission=None,  # pylint: disable=too-many-arguments
+               names=None):
+        """add one time step at the end of the chain, the messages of the
+        other steps are kept and warm start the next :meth:`run`
+
+        :param constrained_marginal: ``(k,)`` marginal of the new observation
+        :type constrained_marginal: ndarray
+        :param transition: ``(d, d)`` potential from the last hidden variable,
+            only with a stack of transitions, defaults to None
+        :type transition: ndarray, optional
+        :param emission: ``(d, k)`` emission of the new step, only with a
+            stack of emissions, defaults to None
+        :type emission: ndarray, optional
+        :param names: ``(hidden, observation)`` node names, only for an engine
+            built :meth:`from_graph`, defaults to None
+        :type names: tuple, optional
+        :raises ValueError: a potential or the names are missing
+        """
+        if (transition is None) != (self.transition.ndim == 2) or \
+                (emission is None) != (self.emission.ndim == 2) or \
+                (names is None) != (self.names is None):
+            raise ValueError("append needs a potential for every stacked "
+                             "potential and names for named nodes")
+        if transition is not None:
+            self.transition = np.concatenate(
+                [self.transition, np.asarray(transition)[None]])
+        if emission is not None:
+            self.emission = np.concatenate(
+                [self.emission, np.asarray(emission)[None]])
+        if names is not None:
+            self.names = (self.names[0] + [names[0]],
+                          self.names[1] + [names[1]])
+
+        message = (self.__var_potential(self.length - 1) * self.fwd[-1] *
+                   self.up[-1]) @ self.__transition(self.length - 1)
+        uniform = np.full((1, self.state_num), 1.0 / self.state_num)
+        mu = np.clip(constrained_marginal, 1e-12, None)
+        self.mu = np.concatenate([self.mu, [mu / np.sum(mu)]])
+        self.fwd = np.concatenate([self.fwd, [message / np.sum(message)]])
+        self.bwd = np.concatenate([self.bwd, uniform])
+        self.up = np.concatenate([self.up, uniform])
+        self.hidden_marginal = np.concatenate([self.hidden_marginal, uniform])
+        self.obser2emission = np.concatenate(
+            [self.obser2emission, np.full((1, len(mu)), 1.0 / len(mu))])
+        self.length += 1
+        self.residual = np.inf
+
+    def freeze(self, num):
+        """drop the ``num`` oldest time steps, the forward message into the
+        new first hidden variable is kept fixed and stands for them, the
+        messages back into them are not updated any more
+
+        :param num: number of time steps, less than ``T``
+        :type num: int
+        :return: ``(num, d)`` hidden and ``(num, k)`` observation marginals
+            of the dropped steps
+        :rtype: tuple
+        """
+        assert 0 <= num < self.length
+        frozen = (self.hidden_marginal[:num], self.__obser_marginal(0, num))
+        for attr in ["mu", "fwd", "bwd", "up", "hidden_marginal",
+                     "obser2emission", "potential"]:
+            setattr(self, attr, getattr(self, attr)[num:])
+        if self.transition.ndim == 3:
+            self.transition = self.transition[num:]
+        if self.emission.ndim == 3:
+            self.emission = self.emission[num:]
+        if self.names is not None:
+            self.names = (self.names[0][num:], self.names[1][num:])
+        self.length -= num
+        self.offset += num
+        return frozen
+
+    def run(self, max_iter=5000000, tolerance=1e-4, deadline=None,
+            silent=True):
+        """sweep until the hidden marginals move less than ``tolerance``
+
+        :return: max L1 change of a hidden marginal per sweep, num of sweeps
+        :rtype: ~cbp.utils.InferenceResult
+        """
+        rtn = engine_loop(self.sweep,
+                          max_iter=max_iter,
+                          monitor=ConvergenceMonitor(
+                              tolerance, residual_fun=lambda: self.residual),
+                          silent=silent,
+                          deadline=deadline)
+        violation = max(np.max(np.sum(np.abs(
+            self.__obser_marginal(low, high) - self.mu[low:high]), axis=1))
+            for low, high in self.blocks())
+        return rtn.replace(rtn[:2], marginals=self.export_marginals(),
+                           violation=violation)
+
+    def export_marginals(self):
+        """marginals keyed by node name when built :meth:`from_graph`,
+        otherwise ``(hidden, observation)`` arrays of shape ``(T, d)`` and
+        ``(T, k)``
+        """
+        if self.names is None:
+            return self.hidden_marginal, self.obser_marginal()
+        marginals = dict(zip(self.names[0], self.hidden_marginal))
+        marginals.update(zip(self.names[1], self.obser_marginal()))
+        return marginals
+
+
+def oriented(factor, first, second):
+    """potential of a pairwise factor with axes ``(first, second)``"""
+    if factor.connections == [first, second]:
+        return factor.dense_potential
+    return factor.dense_potential.T
+
+
+def tied(stack):
+    """one potential when all time steps share it, otherwise the stack"""
+    if len(stack) and all(np.array_equal(stack[0], item)
+                          for item in stack[1:]):
+        return stack[0]
+    return stack
@@ -0,0 +1,106 @@
+import multiprocessing
+
+import numpy as np
+
+_TASK = {}
+
+
+def prefix_product(operators):
+    """inclusive prefix products ``operators[0] @ ... @ operators[i]`` of a
+    ``(n, d, d)`` stack, each product scaled to sum one
+
+    Pairs of neighbours are multiplied as one batched ``matmul``, the prefix
+    of the half as long stack is computed recursively and fills the odd
+    positions, the even ones are one more batched ``matmul``. Work is
+    ``O(n d^3)`` and depth ``O(log n)``.
+
+    :param operators: stack of square matrices
+    :type operators: ndarray
+    :return: stack of prefix products
+    :rtype: ndarray
+    """
+    num = len(operators)
+    if num <= 1:
+        return operators / np.sum(operators, axis=(1, 2), keepdims=True)
+    pairs = operators[0:num - 1:2] @ operators[1:num:2]
+    pairs /= np.sum(pairs, axis=(1, 2), keepdims=True)
+    odd = prefix_product(pairs)
+
+    prefix = np.empty(operators.shape)
+    prefix[1::2] = odd
+    prefix[0] = operators[0] / np.sum(operators[0])
+    prefix[2::2] = odd[:(num - 1) // 2] @ operators[2::2]
+    prefix[2::2] /= np.sum(prefix[2::2], axis=(1, 2), keepdims=True)
+    return prefix
+
+
+def _total(bounds):
+    """scaled product of the operators in ``[lo, hi)``"""
+    low, high = bounds
+    total = np.eye(_TASK["dim"])
+    for start in range(low, high, _TASK["block"]):
+        product = prefix_product(
+            _TASK["operator"](start, min(start + _TASK["block"], high)))[-1]
+        total = total @ product
+        total /= np.sum(total)
+    return total
+
+
+def _rows(args):
+    """``carry @ prefix`` rows of the operators in ``[lo, hi)``"""
+    (low, high), carry = args
+    rows = np.empty((high - low, _TASK["dim"]))
+    for start in range(low, high, _TASK["block"]):
+        stop = min(start + _TASK["block"], high)
+        block = carry @ prefix_product(_TASK["operator"](start, stop))
+        rows[start - low:stop - low] = block / np.sum(block, axis=1,
+                                                      keepdims=True)
+        carry = rows[stop - low - 1]
+    return rows
+
+
+def chunked_scan(start, operator, num_operator,  # pylint: disable=too-many-arguments
+                 num_worker=1, block=256):
+    """rows ``start @ M_0 @ ... @ M_i`` for ``i < num_operator``, each
+    scaled to sum one
+
+    The operators are split into one chunk per worker. The workers multiply
+    the operators of their chunk, the chunk products carry ``start`` to the
+    first row of every chunk, then the workers scan their chunk again from
+    that row. Operators are built ``block`` at a time so memory is
+    ``O(block d^2)`` per worker, the workers are forked and read
+    ``operator`` without pickling it.
+
+    :param start: ``(d,)`` first row
+    :type start: ndarray
+    :param operator: ``operator(lo, hi)`` returns the ``(hi - lo, d, d)``
+        stack of ``M_lo ... M_{hi-1}``
+    :type operator: func
+    :param num_operator: number of operators
+    :type num_operator: int
+    :param num_worker: number of processes, defaults to 1
+    :type num_worker: int, optional
+    :param block: operators built at a time, defaults to 256
+    :type block: int, optional
+    :return: ``(num_operator, d)`` rows
+    :rtype: ndarray
+    """
+    if num_operator == 0:
+        return np.empty((0, len(start)))
+    num_worker = max(1, min(num_worker, num_operator))
+    edges = np.linspace(0, num_operator, num_worker + 1).astype(int)
+    chunks = list(zip(edges[:-1], edges[1:]))
+
+    _TASK.update(operator=operator, dim=len(start), block=block)
+    try:
+        if num_worker == 1:
+            return _rows((chunks[0], start))
+        with multiprocessing.get_context("fork").Pool(num_worker) as pool:
+            totals = pool.map(_total, chunks[:-1])
+            carries = [start]
+            for total in totals:
+                carry = carries[-1] @ total
+                carries.append(carry / np.sum(carry))
+            return np.concatenate(pool.map(_rows, zip(chunks, carries)))
+    finally:
+        _TASK.clear()
@@ -0,0 +1,86 @@
+import numpy as np
+
+
+class VarBatch():  # pylint: disable=too-many-instance-attributes,too-few-public-methods
+    """index data to send variable to factor messages on a set of edges of
+    equal dimension with one stacked NumPy operation
+
+    :param compiled: graph the edges belong to
+    :type compiled: CompiledGraph
+    :param edges: edge ids, all with the same ``edge_dim``
+    :type edges: ndarray
+    """
+
+    def __init__(self, compiled, edges):
+        arena = compiled.arena
+        self.edges = np.asarray(edges, dtype=int)
+        self.dim = int(compiled.edge_dim[self.edges[0]])
+        self.var, self.var_pos = np.unique(compiled.edge_var[self.edges],
+                                           return_inverse=True)
+
+        # all incoming edges of the senders, grouped per variable
+        in_edges = [compiled.var_edges(var) for var in self.var]
+        self.in_ptr = np.cumsum([0] + [len(item) for item in in_edges[:-1]])
+        self.in_index = arena.slot_index("f2v", np.concatenate(in_edges))
+
+        self.f2v_index = arena.slot_index("f2v", self.edges)
+        self.out_index = arena.slot_index("v2f", self.edges)
+        self.c_alpha = compiled.factor_coef[
+            compiled.edge_factor[self.edges]][:, None]
+        self.hat_c_ialpha = compiled.hat_c_ialpha[self.edges][:, None]
+        self.hat_c_i = compiled.hat_c_i[self.var][:, None]
+        self.constrained = compiled.var_constrained[self.var]
+        self.log_potential = np.array(
+            [compiled.log_var_potential[var] for var in self.var])
+        self.log_constrained = np.array(
+            [compiled.log_constrained[var]
+             for var in self.var[self.constrained]]).reshape(-1, self.dim)
+
+
+class FactorBatch():  # pylint: disable=too-many-instance-attributes,too-few-public-methods
+    """index data to send factor to variable messages on a set of edges whose
+    factors share the potential shape and whose recipients share the axis
+
+    :param compiled: graph the edges belong to
+    :type compiled: CompiledGraph
+    :param edges: edge ids
+    :type edges: ndarray
+    """
+
+    def __init__(self, compiled, edges):
+        arena = compiled.arena
+        self.edges = np.asarray(edges, dtype=int)
+        factors = compiled.edge_factor[self.edges]
+        self.shape = compiled.factor_potential[factors[0]].shape
+        self.axis = int(compiled.edge_axis[self.edges[0]])
+        self.rows = compiled.potential_row[factors]
+        self.unary = len(self.shape) == 1
+        self.sum_axes = tuple(j + 1 for j in range(len(self.shape))
+                              if j != self.axis)
+        self.out_index = arena.slot_index("f2v", self.edges)
+        self.hat_c_ialpha = compiled.hat_c_ialpha[self.edges].reshape(
+            (-1,) + (1,) * len(self.shape))
+
+        # messages of the other connections, one entry per axis
+        self.others = []
+        for j, dim in enumerate(self.shape):
+            if j == self.axis:
+                continue
+            other_edges = compiled.factor_ptr[factors] + j
+            term_shape = [-1] + [1] * len(self.shape)
+            term_shape[j + 1] = dim
+            extra = compiled.has_extra[other_edges]
+            self.others.append((
+                arena.slot_index("v2f", other_edges),
+                tuple(term_shape),
+                extra,
+                arena.slot_index(
+                    "inner", compiled.inner_slot[other_edges[extra]])
+                if extra.any() else None,
+                compiled.extra_exponent[other_edges[extra]].reshape(
+                    (-1,) + (1,) * len(self.shape))))
+
+        self.extra_out = compiled.has_extra[self.edges]
+        self.inner_index = arena.slot_index(
+            "inner", compiled.inner_slot[self.edges[self.extra_out]]) \
+            if self.extra_out.any() else None
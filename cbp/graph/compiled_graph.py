@@ -0,0 +1,598 @@
+import numpy as np
+from cbp.utils import Message
+from cbp.utils.message_arena import MessageArena
+
+from .compiled_batch import FactorBatch, VarBatch
+
+
+class CompiledGraph():  # pylint: disable=too-many-instance-attributes
+    """Array-backed topology of a baked graph
+
+    Nodes are replaced by integer indices: variables follow the order of
+    ``varnode_recorder`` and factors the order of ``factornode_recorder``.
+    Every (factor, variable) connection is one edge, edges are sorted by
+    factor and then by the axis of the variable in the factor potential, so
+    the edges of factor ``f`` are ``factor_ptr[f]:factor_ptr[f + 1]`` and the
+    edges of variable ``v`` are ``var_edge[var_ptr[v]:var_ptr[v + 1]]``.
+
+    Messages are kept per edge as 1-D vectors in both directions inside one
+    double buffered :class:`~cbp.utils.message_arena.MessageArena`, the dense
+    norm-product term of the factor side (``inner``) is only kept for edges
+    whose extra term is not constant one.
+    """
+    #: combines two message terms, a product for linear values
+    _combine = np.multiply
+
+    def __init__(self, graph):
+        varnodes = list(graph.varnode_recorder.values())
+        factors = list(graph.factornode_recorder.values())
+        if any(factor.issparse for factor in factors):
+            raise ValueError(
+                "sparse factor potentials only run on the node engine")
+        self.var_names = [node.name for node in varnodes]
+        self.factor_names = [node.name for node in factors]
+        var_index = {name: i for i, name in enumerate(self.var_names)}
+        self.num_var = len(varnodes)
+        self.num_factor = len(factors)
+
+        # variable attr
+        self.var_dim = np.array([node.rv_dim for node in varnodes], dtype=int)
+        self.var_coef = np.array([node.node_coef for node in varnodes],
+                                 dtype=float)
+        self.hat_c_i = np.array([node.hat_c_i for node in varnodes],
+                                dtype=float)
+        self.var_epsilon = np.array([node.epsilon for node in varnodes],
+                                    dtype=float)
+        self.var_constrained = np.array(
+            [node.isconstrained for node in varnodes], dtype=bool)
+        self.var_potential = [node.potential for node in varnodes]
+        self.constrained_marginal = [node.constrained_marginal
+                                     for node in varnodes]
+
+        # factor attr and edges in factor order
+        self.factor_coef = np.array([node.node_coef for node in factors],
+                                    dtype=float)
+        # potentials of equal shape are stacked, so batched kernels gather
+        # them with one fancy index, ``factor_potential`` holds views
+        self.potential_stack = {}
+        self.potential_row = np.zeros(self.num_factor, dtype=int)
+        for idx, factor in enumerate(factors):
+            rows = self.potential_stack.setdefault(factor.potential.shape, [])
+            self.potential_row[idx] = len(rows)
+            rows.append(factor.potential)
+        self.potential_stack = {shape: np.array(rows, dtype=float)
+                                for shape, rows in self.potential_stack.items()}
+        self.factor_potential = [
+            self.potential_stack[factor.potential.shape][row]
+            for factor, row in zip(factors, self.potential_row)]
+        self.factor_ptr = np.zeros(self.num_factor + 1, dtype=int)
+        edge_factor, edge_var, edge_axis = [], [], []
+        hat_c_ialpha, i_alpha = [], []
+        for idx, factor in enumerate(factors):
+            for axis, varnode_name in enumerate(factor.connections):
+                edge_factor.append(idx)
+                edge_var.append(var_index[varnode_name])
+                edge_axis.append(axis)
+                hat_c_ialpha.append(factor.hat_c_ialpha[varnode_name])
+                i_alpha.append(factor.i_alpha[varnode_name])
+            self.factor_ptr[idx + 1] = len(edge_factor)
+        self.num_edge = len(edge_factor)
+        self.edge_factor = np.array(edge_factor, dtype=int)
+        self.edge_var = np.array(edge_var, dtype=int)
+        self.edge_axis = np.array(edge_axis, dtype=int)
+        self.edge_dim = self.var_dim[self.edge_var]
+        self.hat_c_ialpha = np.array(hat_c_ialpha, dtype=float)
+        self.i_alpha = np.array(i_alpha, dtype=float)
+        self.extra_exponent = -1.0 * self.i_alpha / self.hat_c_ialpha
+        self.has_extra = ~((np.abs(self.i_alpha) < 1e-5)
+                           & (self.factor_coef[self.edge_factor] == 1))
+        self.edge_shape = []
+        for edge in range(self.num_edge):
+            shape = [1] * self.factor_potential[edge_factor[edge]].ndim
+            shape[edge_axis[edge]] = self.edge_dim[edge]
+            self.edge_shape.append(tuple(shape))
+
+        # edges in variable order
+        name_lookup = {(self.factor_names[f], self.var_names[v]): e
+                       for e, (f, v) in enumerate(zip(edge_factor, edge_var))}
+        self.var_ptr = np.zeros(self.num_var + 1, dtype=int)
+        var_edge = []
+        for idx, varnode in enumerate(varnodes):
+            for factor_name in varnode.connections:
+                var_edge.append(name_lookup[(factor_name, varnode.name)])
+            self.var_ptr[idx + 1] = len(var_edge)
+        self.var_edge = np.array(var_edge, dtype=int)
+
+        self.node_index = {name: (False, i)
+                           for i, name in enumerate(self.var_names)}
+        self.node_index.update({name: (True, i)
+                                for i, name in enumerate(self.factor_names)})
+        self.edge_lookup = {(f, v): e for e, (f, v) in
+                            enumerate(zip(edge_factor, edge_var))}
+
+        # precomputed logs and scratch buffers, nothing is allocated per
+        # message afterwards
+        self.log_var_potential = [np.log(potential)
+                                  for potential in self.var_potential]
+        self.log_constrained = [
+            eps * np.log(marginal) if marginal is not None else None
+            for eps, marginal in zip(self.var_epsilon,
+                                     self.constrained_marginal)]
+        self.factor_scratch = {}
+        for potential in self.factor_potential:
+            if potential.shape not in self.factor_scratch:
+                self.factor_scratch[potential.shape] = np.empty(
+                    potential.shape)
+        self.var_scratch = {dim: np.empty(dim) for dim in set(self.var_dim)}
+
+        self.inner_slot = np.full(self.num_edge, -1, dtype=int)
+        self.inner_slot[self.has_extra] = np.arange(np.sum(self.has_extra))
+        self.batch_shape = self._batch_shape(graph)
+        self.arena = MessageArena({
+            "f2v": [self.batch_shape + (dim,) for dim in self.edge_dim],
+            "v2f": [self.batch_shape + (dim,) for dim in self.edge_dim],
+            "inner": [self.batch_shape +
+                      self.factor_potential[self.edge_factor[edge]].shape
+                      for edge in np.flatnonzero(self.has_extra)]
+        }, store=getattr(graph.cfg, "message_store", None))
+        self.tree_schedules = {}
+        self.init_messages()
+
+    def _batch_shape(self, graph):  # pylint: disable=unused-argument
+        """leading shape of every message slot, empty without batch"""
+        return ()
+
+    def factor_edges(self, factor):
+        return range(self.factor_ptr[factor], self.factor_ptr[factor + 1])
+
+    def var_edges(self, var):
+        return self.var_edge[self.var_ptr[var]:self.var_ptr[var + 1]]
+
+    @property
+    def f2v(self):
+        return self.arena.front.f2v
+
+    @property
+    def v2f(self):
+        return self.arena.front.v2f
+
+    def last_inner(self, edge, bank=None):
+        if bank is None:
+            bank = self.arena.front
+        return bank.inner[self.inner_slot[edge]]
+
+    def init_messages(self):
+        """uniform messages on all edges, equivalent to
+        :meth:`~cbp.graph.BaseGraph.first_belief_propagation`
+        """
+        for bank in self.arena.banks:
+            for edge in range(self.num_edge):
+                bank.f2v[edge].fill(1.0 / self.edge_dim[edge])
+                bank.v2f[edge].fill(1.0 / self.edge_dim[edge])
+            for inner in bank.inner:
+                inner.fill(1.0)
+
+    def _potential(self, factor):
+        return self.factor_potential[factor]
+
+    def _v2f_term(self, edge, bank):
+        """variable message seen by the factor, broadcastable against the
+        factor potential
+        """
+        term = bank.v2f[edge].reshape(self.edge_shape[edge])
+        if self.has_extra[edge]:
+            return term * np.power(self.last_inner(edge, bank),
+                                   self.extra_exponent[edge])
+        return term
+
+    def _factor_message(self, edge, src, dst):
+        """factor to variable message on ``edge``, reads the ``src`` bank and
+        writes the ``dst`` bank, see
+        :meth:`~cbp.node.FactorNode.make_message`
+        """
+        factor = self.edge_factor[edge]
+        potential = self.factor_potential[factor]
+        edges = self.factor_edges(factor)
+        out = dst.f2v[edge]
+        if len(edges) == 1:
+            if self.has_extra[edge]:
+                np.copyto(self.last_inner(edge, dst), potential)
+            np.divide(potential, np.sum(potential), out=out)
+            return
+
+        work = self.factor_scratch[potential.shape]
+        product_out = self.last_inner(edge, dst) \
+            if self.has_extra[edge] else work
+        np.copyto(product_out, potential)
+        for other in edges:
+            if other != edge:
+                product_out *= self._v2f_term(other, src)
+        self._sum_inner(edge, product_out, work, out)
+
+    def _sum_inner(self, edge, product_out, work, out):
+        """reduce the inner parentheses ``product_out`` of ``edge`` to the
+        message ``out``, ``work`` may alias ``product_out``
+        """
+        hat_c_ialpha = self.hat_c_ialpha[edge]
+        axis = self.edge_axis[edge]
+        with np.errstate(divide='raise'):
+            np.clip(product_out, 1e-12, None, out=work)
+            np.log(work, out=work)
+            work *= 1.0 / hat_c_ialpha
+            np.exp(work, out=work)
+            np.sum(work, axis=tuple(j for j in range(work.ndim) if j != axis),
+                   out=out)
+            np.power(out, hat_c_ialpha, out=out)
+        out /= np.sum(out)
+
+    def _factor_messages(self, factor, src, dst):
+        """messages of ``factor`` to all its variables, the inner
+        parentheses come from prefix and suffix products of the incoming
+        terms, O(n) products instead of O(n^2). Needs ``src`` and ``dst`` to
+        be different banks, the stored ``inner`` terms of ``dst`` are not read
+        back.
+        """
+        edges = self.factor_edges(factor)
+        if len(edges) < 3:
+            for edge in edges:
+                self._factor_message(edge, src, dst)
+            return
+
+        potential = self._potential(factor)
+        work = self.factor_scratch[potential.shape]
+        terms = [self._v2f_term(edge, src) for edge in edges]
+        prefix = [potential]
+        for term in terms[:-1]:
+            prefix.append(self._combine(prefix[-1], term))
+        suffix = None
+        for idx in reversed(range(len(edges))):
+            edge = edges[idx]
+            product_out = self.last_inner(edge, dst) \
+                if self.has_extra[edge] else work
+            if suffix is None:
+                np.copyto(product_out, prefix[idx])
+            else:
+                self._combine(prefix[idx], suffix, out=product_out)
+            self._sum_inner(edge, product_out, work, dst.f2v[edge])
+            suffix = terms[idx] if suffix is None else \
+                self._combine(terms[idx], suffix)
+
+    def _log_numerator(self, var, bank):
+        if self.var_constrained[var]:
+            return self.log_constrained[var]
+        numerator = self.var_scratch[self.var_dim[var]]
+        numerator.fill(1.0)
+        for edge in self.var_edges(var):
+            numerator *= bank.f2v[edge]
+        with np.errstate(divide='raise'):
+            np.clip(numerator, 1e-12, None, out=numerator)
+            np.log(numerator, out=numerator)
+        numerator += self.log_var_potential[var]
+        numerator *= 1.0 / self.hat_c_i[var]
+        return numerator
+
+    def _var_message(self, edge, src, dst, log_numerator=None):
+        """variable to factor message on ``edge``, see
+        :meth:`~cbp.node.VarNode.make_message`, the numerator of the variable
+        is computed when not given
+        """
+        var = self.edge_var[edge]
+        c_alpha = self.factor_coef[self.edge_factor[edge]]
+        out = dst.v2f[edge]
+        if log_numerator is None:
+            log_numerator = self._log_numerator(var, src)
+        with np.errstate(divide='raise'):
+            np.clip(src.f2v[edge], 1e-12, None, out=out)
+            np.log(out, out=out)
+        out *= -1.0 / self.hat_c_ialpha[edge]
+        out += log_numerator
+        out *= c_alpha
+        np.exp(out, out=out)
+        out /= np.sum(out)
+
+    def _var_messages(self, var, src, dst):
+        """messages of ``var`` to all its factors, the product of the
+        incoming messages is computed once, O(n d) for n factors
+        """
+        log_numerator = self._log_numerator(var, src)
+        for edge in self.var_edges(var):
+            self._var_message(edge, src, dst, log_numerator)
+
+    def send_factor2var(self, edge):
+        front = self.arena.front
+        self._factor_message(edge, front, front)
+
+    def send_var2factor(self, edge):
+        front = self.arena.front
+        self._var_message(edge, front, front)
+
+    def send(self, sender, recipient):
+        """send one message between two node names, equivalent to
+        ``sender.send_message(recipient)``
+        """
+        is_factor, sender_idx = self.node_index[sender]
+        _, recipient_idx = self.node_index[recipient]
+        if is_factor:
+            self.send_factor2var(self.edge_lookup[(sender_idx, recipient_idx)])
+        else:
+            self.send_var2factor(self.edge_lookup[(recipient_idx, sender_idx)])
+
+    def send_ops(self, edges, from_factor):
+        """run a flat list of sends, e.g. one sweep of
+        :class:`~cbp.graph.itsbp_schedule.ItsbpSchedule`
+
+        :param edges: edge of every send
+        :type edges: ndarray
+        :param from_factor: whether the factor side sends
+        :type from_factor: ndarray
+        """
+        for edge, is_factor in zip(edges.tolist(), from_factor.tolist()):
+            if is_factor:
+                self.send_factor2var(edge)
+            else:
+                self.send_var2factor(edge)
+
+    def parallel_message(self, run_constrained=True):
+        """:return: number of messages sent"""
+        num_message = 0
+        for var in range(self.num_var):
+            edges = self.var_edges(var)
+            for edge in edges:
+                self.send_factor2var(edge)
+            num_message += len(edges)
+
+            if run_constrained or (not self.var_constrained[var]):
+                front = self.arena.front
+                self._var_messages(var, front, front)
+                num_message += len(edges)
+        return num_message
+
+    def flooding_message(self, run_constrained=True):
+        """synchronous sweep on the double buffer: every factor message is
+        computed from the previous variable messages, then every variable
+        message from the new factor messages, the banks are swapped at the end
+        so the back bank holds the previous sweep
+        """
+        front, back = self.arena.front, self.arena.back
+        for factor in range(self.num_factor):
+            self._factor_messages(factor, front, back)
+        for var in range(self.num_var):
+            if run_constrained or (not self.var_constrained[var]):
+                self._var_messages(var, back, back)
+            else:
+                for edge in self.var_edges(var):
+                    np.copyto(back.v2f[edge], front.v2f[edge])
+        self.arena.swap()
+
+    def flooding_vars(self, variables, run_constrained=True):
+        """the part of :meth:`flooding_message` owned by ``variables``: the
+        factor messages to them and the messages they send, read from the
+        front bank and written to the back bank, banks are not swapped.
+        Disjoint sets of variables write disjoint slots.
+
+        :return: number of messages sent
+        :rtype: int
+        """
+        front, back = self.arena.front, self.arena.back
+        num_message = 0
+        for var in variables:
+            edges = self.var_edges(var)
+            for edge in edges:
+                self._factor_message(edge, front, back)
+            num_message += len(edges)
+            if run_constrained or (not self.var_constrained[var]):
+                self._var_messages(var, back, back)
+                num_message += len(edges)
+            else:
+                for edge in edges:
+                    np.copyto(back.v2f[edge], front.v2f[edge])
+        return num_message
+
+    def tree_order(self, root):
+        """depth first (pre-order) list of ``(node, parent)`` pairs, nodes
+        are ``(is_factor, idx)`` tuples and the parent of ``root`` is None
+        """
+        order = []
+        stack = [(self.node_index[root], None)]
+        while stack:
+            node, parent = stack.pop()
+            order.append((node, parent))
+            for child in reversed(self.__neighbors(node)):
+                if child != parent:
+                    stack.append((child, node))
+        return order
+
+    def __neighbors(self, node):
+        is_factor, idx = node
+        if is_factor:
+            return [(False, self.edge_var[e]) for e in self.factor_edges(idx)]
+        return [(True, self.edge_factor[e]) for e in self.var_edges(idx)]
+
+    def _edge_between(self, sender, recipient):
+        if sender[0]:
+            return self.edge_lookup[(sender[1], recipient[1])]
+        return self.edge_lookup[(recipient[1], sender[1])]
+
+    def __make_batches(self, is_factor, edges, ranks):
+        groups = {}
+        for edge, rank in zip(edges, ranks):
+            if is_factor:
+                key = (rank, self.factor_potential[
+                    self.edge_factor[edge]].shape, self.edge_axis[edge])
+            else:
+                key = (rank, self.edge_dim[edge])
+            groups.setdefault(key, []).append(edge)
+        batch_class = FactorBatch if is_factor else VarBatch
+        return [(is_factor, batch_class(self, groups[key]))
+                for key in sorted(groups, key=lambda key: key[0])]
+
+    def tree_schedule(self, root):
+        """level synchronous schedule of :meth:`tree_bp`, cached per root
+
+        Nodes are grouped by their depth below ``root``. Leaves to root, every
+        level sends to its parents, root to leaves, every level sends to its
+        children. All sends of one level are independent and are grouped into
+        batches of equal shape, so one level costs a few NumPy calls instead
+        of one call per edge. A factor sending to several children reads the
+        ``inner`` terms it wrote for its earlier children, these sends are
+        split by the rank of the child to keep the sequential order.
+
+        :return: list of ``(is_factor, batch)`` in execution order
+        :rtype: list
+        """
+        if root in self.tree_schedules:
+            return self.tree_schedules[root]
+
+        levels = [[(self.node_index[root], None)]]
+        while True:
+            level = []
+            for node, parent in levels[-1]:
+                level.extend((child, node) for child in self.__neighbors(node)
+                             if child != parent)
+            if not level:
+                break
+            levels.append(level)
+
+        schedule = []
+        for level in reversed(levels[1:]):
+            edges = [self._edge_between(node, parent)
+                     for node, parent in level]
+            schedule.extend(self.__make_batches(
+                level[0][0][0], edges, [0] * len(edges)))
+        for level in levels[:-1]:
+            edges, ranks = [], []
+            for node, parent in level:
+                children = [child for child in self.__neighbors(node)
+                            if child != parent]
+                edges.extend(self._edge_between(node, child)
+                             for child in children)
+                ranks.extend(range(len(children)))
+            if edges:
+                schedule.extend(self.__make_batches(
+                    level[0][0][0], edges, ranks))
+        self.tree_schedules[root] = schedule
+        return schedule
+
+    def _var_batch(self, batch, src, dst):
+        """:meth:`_var_message` for all edges of a
+        :class:`~cbp.graph.compiled_batch.VarBatch`, every input is gathered
+        before the output is scattered
+        """
+        numerator = np.multiply.reduceat(src.flat[batch.in_index],
+                                         batch.in_ptr, axis=0)
+        with np.errstate(divide='raise'):
+            np.clip(numerator, 1e-12, None, out=numerator)
+            np.log(numerator, out=numerator)
+            numerator += batch.log_potential
+            numerator /= batch.hat_c_i
+            numerator[batch.constrained] = batch.log_constrained
+            own = np.log(np.clip(src.flat[batch.f2v_index], 1e-12, None))
+        out = numerator[batch.var_pos]
+        out -= own / batch.hat_c_ialpha
+        out *= batch.c_alpha
+        np.exp(out, out=out)
+        out /= np.sum(out, axis=1, keepdims=True)
+        dst.flat[batch.out_index] = out
+
+    def _factor_batch(self, batch, src, dst):
+        """:meth:`_factor_message` for all edges of a
+        :class:`~cbp.graph.compiled_batch.FactorBatch`
+        """
+        potential = self.potential_stack[batch.shape][batch.rows]
+        if batch.unary:
+            if batch.inner_index is not None:
+                dst.flat[batch.inner_index] = potential[batch.extra_out]
+            dst.flat[batch.out_index] = potential / \
+                np.sum(potential, axis=1, keepdims=True)
+            return
+
+        product_out = potential
+        for v2f_index, term_shape, extra, inner_index, exponent in \
+                batch.others:
+            product_out *= src.flat[v2f_index].reshape(term_shape)
+            if inner_index is not None:
+                inner = src.flat[inner_index].reshape(
+                    (-1,) + batch.shape)
+                product_out[extra] *= np.power(inner, exponent)
+        if batch.inner_index is not None:
+            dst.flat[batch.inner_index] = product_out[batch.extra_out].reshape(
+                len(batch.inner_index), -1)
+
+        with np.errstate(divide='raise'):
+            np.clip(product_out, 1e-12, None, out=product_out)
+            np.log(product_out, out=product_out)
+            product_out /= batch.hat_c_ialpha
+            np.exp(product_out, out=product_out)
+            out = np.sum(product_out, axis=batch.sum_axes)
+            np.power(out, batch.hat_c_ialpha.reshape(-1, 1), out=out)
+        out /= np.sum(out, axis=1, keepdims=True)
+        dst.flat[batch.out_index] = out
+
+    def tree_bp(self, root):
+        """leaves to root and root to leaves, see
+        :meth:`~cbp.graph.BaseGraph.tree_bp`, runs :meth:`tree_schedule`
+        level by level
+        """
+        front = self.arena.front
+        for is_factor, batch in self.tree_schedule(root):
+            if is_factor:
+                self._factor_batch(batch, front, front)
+            else:
+                self._var_batch(batch, front, front)
+
+    def var_marginal(self, var):
+        if self.var_constrained[var]:
+            return self.constrained_marginal[var]
+        vals = [self.f2v[edge] for edge in self.var_edges(var)]
+        prod = self.var_potential[var] * np.prod(vals, axis=0)
+        belief = np.power(prod, 1.0 / self.hat_c_i[var])
+        return belief / np.sum(belief)
+
+    def factor_marginal(self, factor):
+        front = self.arena.front
+        product_out = self.factor_potential[factor]
+        for edge in self.factor_edges(factor):
+            product_out = product_out * self._v2f_term(edge, front)
+        unormalized = np.power(product_out, 1.0 / self.factor_coef[factor])
+        return unormalized / np.sum(unormalized)
+
+    def export_marginals(self):
+        return {name: self.var_marginal(i)
+                for i, name in enumerate(self.var_names)}
+
+    def export_convergence_marginals(self):
+        marginals = {name: self.factor_marginal(i)
+                     for i, name in enumerate(self.factor_names)}
+        marginals.update(self.export_marginals())
+        return marginals
+
+    def linear_f2v(self, edge):
+        return self.f2v[edge]
+
+    def linear_v2f(self, edge):
+        return self.v2f[edge]
+
+    def linear_inner(self, edge):
+        return self.last_inner(edge).copy()
+
+    def writeback(self, graph):
+        """store the compiled messages into the node inboxes, so the node API
+        (``marginal``, ``cal_bethe``) reflects the compiled run
+        """
+        for var, name in enumerate(self.var_names):
+            varnode = graph.node_recorder[name]
+            varnode.reset()
+            for edge in self.var_edges(var):
+                sender = graph.node_recorder[
+                    self.factor_names[self.edge_factor[edge]]]
+                varnode.store_message(Message(sender, self.linear_f2v(edge)))
+        for factor, name in enumerate(self.factor_names):
+            factornode = graph.node_recorder[name]
+            factornode.reset()
+            for edge in self.factor_edges(factor):
+                sender = graph.node_recorder[
+                    self.var_names[self.edge_var[edge]]]
+                factornode.store_message(Message(sender, self.linear_v2f(edge)))
+                if self.has_extra[edge]:
+                    factornode.last_innerparenthese_msg[sender.name] = \
+                        self.linear_inner(edge)
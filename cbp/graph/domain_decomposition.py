@@ -0,0 +1,284 @@
+import multiprocessing
+
+import numpy as np
+from cbp.node import FactorNode, VarNode
+from cbp.utils import ConvergenceMonitor, engine_loop
+
+from .coef_policy import bp_policy
+from .graph_model import GraphModel
+
+
+def partition_tree(graph, num_part):
+    """cut a tree graph at separator variables into about ``num_part``
+    sub-trees of about the same number of nodes
+
+    The tree is rooted as in :meth:`~cbp.graph.BaseGraph.traversal_order`
+    and walked in post-order, an unconstrained variable whose uncut subtree
+    reaches an even share of the nodes not cut yet is cut from its parent
+    factor and starts a new part. Every cut removes one edge and at most ``num_part -
+    1`` cuts are made.
+
+    :param graph: tree graph
+    :type graph: BaseGraph
+    :param num_part: number of parts
+    :type num_part: int
+    :return: part index of every node name, ``(var_name, child_part,
+        parent_part)`` of every cut
+    :rtype: tuple
+    """
+    graph.init_node_recorder()
+    preorder, postorder = graph.traversal_order()
+    remaining = len(preorder)
+    size = {node.name: 1 for node, _ in preorder}
+    cuts = set()
+    for node, parent in postorder:
+        if parent is None:
+            continue
+        if len(cuts) < num_part - 1 and isinstance(node, VarNode) and \
+                not node.isconstrained and \
+                size[node.name] >= remaining / (num_part - len(cuts)):
+            cuts.add(node.name)
+            remaining -= size[node.name] - 1
+            size[parent.name] += 1
+        else:
+            size[parent.name] += size[node.name]
+
+    part_of, separators = {}, []
+    for node, parent in preorder:
+        if parent is None:
+            part_of[node.name] = 0
+        elif node.name in cuts:
+            part_of[node.name] = len(separators) + 1
+            separators.append((node.name, part_of[node.name],
+                               part_of[parent.name]))
+        else:
+            part_of[node.name] = part_of[parent.name]
+    return part_of, separators
+
+
+def _index(name):
+    return int(name.rsplit("_", 1)[1])
+
+
+def _worker(local, conn):
+    while True:
+        command = conn.recv()
+        if command is None:
+            break
+        try:
+            conn.send(local.solve(command) if isinstance(command, dict)
+                      else local.export_marginals())
+        except Exception as error:  # pylint: disable=broad-except
+            conn.send(error)
+    conn.close()
+
+
+class LocalTree():
+    """sub-tree of a part with copies of its separator variables
+
+    :param graph: whole graph
+    :type graph: BaseGraph
+    :param names: global names of the nodes in the part
+    :type names: list
+    :param boundary: global names of the separator variables of the part,
+        the ones not in ``names`` are added as copies without potential
+    :type boundary: list
+    :param tolerance: of the local ITS-BP
+    :type tolerance: float
+    """
+
+    def __init__(self, graph, names, boundary, tolerance):  # pylint: disable=too-many-locals
+        self.graph = GraphModel(True, coef_policy=bp_policy,
+                                config=graph.cfg)
+        self.tolerance = tolerance
+        self.global_name = {}
+        local_name = {}
+        nodes = graph.node_recorder
+        owned = set(names)
+        variables = [name for name in names
+                     if isinstance(nodes[name], VarNode)]
+        variables.extend(name for name in boundary if name not in owned)
+        for name in sorted(variables, key=_index):
+            node = nodes[name]
+            if name in owned:
+                copy = VarNode(node.rv_dim, node.potential,
+                               node.constrained_marginal)
+            else:
+                copy = VarNode(node.rv_dim)
+            local_name[name] = self.graph.add_varnode(copy)
+            self.global_name[local_name[name]] = name
+        for name in sorted((name for name in names
+                            if not isinstance(nodes[name], VarNode)),
+                           key=_index):
+            node = nodes[name]
+            self.graph.add_factornode(FactorNode(
+                [local_name[item] for item in node.connections],
+                node.potential))
+        self.boundary = {name: local_name[name] for name in boundary}
+        self.base = {name: nodes[name].potential if name in owned
+                     else np.ones(nodes[name].rv_dim) for name in boundary}
+
+    def solve(self, incoming):
+        """local ITS-BP with the incoming boundary messages as potentials of
+        the separator variables
+
+        :param incoming: global separator name -> message from the other part
+        :type incoming: dict
+        :return: global separator name -> message to the other part
+        :rtype: dict
+        """
+        varnodes = self.graph.varnode_recorder
+        for name, local in self.boundary.items():
+            varnodes[local].potential = self.base[name] * incoming[name]
+        self.graph.bake()
+        self.graph.itsbp(tolerance=self.tolerance)
+        marginals = self.graph.export_marginals()
+
+        outgoing = {}
+        for name, local in self.boundary.items():
+            message = marginals[local] / incoming[name]
+            outgoing[name] = message / np.sum(message)
+        return outgoing
+
+    def export_marginals(self):
+        return {self.global_name[name]: marginal for name, marginal
+                in self.graph.export_marginals().items()}
+
+
+class DomainDecomposition():  # pylint: disable=too-many-instance-attributes
+    """ITS-BP of a tree graph split by :func:`partition_tree` into sub-trees,
+    each one solved by a local :class:`~cbp.graph.GraphModel` in its own
+    forked process
+
+    A separator variable belongs to the part below the cut with its
+    potential, the part above keeps a copy of it as a leaf of the cut
+    factor. The only messages exchanged are the two messages of every cut:
+    the one into the separator from the part above and the one into the
+    copy from the part below, both are the marginal of the variable in the
+    part divided by the message it received. The parts are solved alternately
+    by the parity of their depth in the tree of parts, parts of the same
+    parity share no cut and run at the same time, an outer iteration is
+    both halves. At convergence the marginals are the ones of
+    :meth:`~cbp.graph.GraphModel.run_bp` on the whole graph.
+
+    :param graph: tree graph
+    :type graph: BaseGraph
+    :param num_part: number of parts and processes
+    :type num_part: int
+    :param local_tolerance: tolerance of the local ITS-BP, defaults to 1e-6
+    :type local_tolerance: float, optional
+    """
+
+    def __init__(self, graph, num_part, local_tolerance=1e-6):
+        self.part_of, self.separators = partition_tree(graph, num_part)
+        num_part = len(self.separators) + 1
+        names = [[] for _ in range(num_part)]
+        boundary = [[] for _ in range(num_part)]
+        for name, part in self.part_of.items():
+            names[part].append(name)
+        self.depth = [0] * num_part
+        for name, child, parent in self.separators:
+            boundary[child].append(name)
+            boundary[parent].append(name)
+            self.depth[child] = self.depth[parent] + 1
+
+        self.messages = {}
+        for name, child, parent in self.separators:
+            uniform = np.ones(graph.varnode_recorder[name].rv_dim)
+            self.messages[(name, child)] = uniform / len(uniform)
+            self.messages[(name, parent)] = uniform / len(uniform)
+        self.boundary = boundary
+        self.cuts = {name: (child, parent)
+                     for name, child, parent in self.separators}
+        self.residual = np.inf
+
+        context = multiprocessing.get_context("fork")
+        self.conns, self.workers = [], []
+        for part in range(num_part):
+            local = LocalTree(graph, names[part], boundary[part],
+                              local_tolerance)
+            conn, child_conn = context.Pipe()
+            worker = context.Process(target=_worker,
+                                     args=(local, child_conn),
+                                     daemon=True)
+            worker.start()
+            child_conn.close()
+            self.conns.append(conn)
+            self.workers.append(worker)
+
+    @property
+    def num_part(self):
+        return len(self.conns)
+
+    def __receive(self, part):
+        reply = self.conns[part].recv()
+        if isinstance(reply, Exception):
+            raise RuntimeError(f"domain decomposition worker {part} failed") \
+                from reply
+        return reply
+
+    def outer_loop(self):
+        """solve the even parts then the odd ones, each half at the same
+        time, with the boundary messages of the other half
+
+        :return: number of boundary messages exchanged
+        :rtype: int
+        """
+        residual = 0
+        for parity in (0, 1):
+            parts = [part for part in range(self.num_part)
+                     if self.depth[part] % 2 == parity]
+            for part in parts:
+                self.conns[part].send({
+                    name: self.messages[(name, part)]
+                    for name in self.boundary[part]})
+            for part in parts:
+                for name, message in self.__receive(part).items():
+                    child, parent = self.cuts[name]
+                    recipient = parent if part == child else child
+                    residual = max(residual, np.sum(np.abs(
+                        message - self.messages[(name, recipient)])))
+                    self.messages[(name, recipient)] = message
+        self.residual = residual
+        return 2 * len(self.separators)
+
+    def run(self, max_iter=1000, tolerance=1e-6, deadline=None,
+            silent=True):
+        """outer iterations until no boundary message moves more than
+        ``tolerance`` in L1
+
+        :return: max boundary message change per outer iteration, num of
+            outer iterations
+        :rtype: ~cbp.utils.InferenceResult
+        """
+        rtn = engine_loop(self.outer_loop,
+                          max_iter=max_iter,
+                          monitor=ConvergenceMonitor(
+                              tolerance, residual_fun=lambda: self.residual),
+                          silent=silent,
+                          deadline=deadline)
+        return rtn.replace(rtn[:2], marginals=self.export_marginals())
+
+    def export_marginals(self):
+        """marginals of the whole graph, a separator variable gets the one
+        of the part below its cut
+
+        :return: {node.name: marginal}
+        :rtype: dict
+        """
+        marginals = {}
+        for part in range(self.num_part):
+            self.conns[part].send("marginals")
+        for part in range(self.num_part):
+            for name, marginal in self.__receive(part).items():
+                if self.part_of[name] == part:
+                    marginals[name] = marginal
+        return marginals
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+            conn.close()
+        for worker in self.workers:
+            worker.join()
+        self.conns, self.workers = [], []
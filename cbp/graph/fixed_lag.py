@@ -0,0 +1,155 @@
+import warnings
+
+import numpy as np
+
+from .chain_engine import oriented
+
+
+class FixedLagSmoother():  # pylint: disable=too-many-instance-attributes
+    """online ITS-BP on an HMM chain whose observations arrive one time step
+    at a time, on top of :class:`~cbp.graph.chain_engine.ChainEngine`
+
+    A new time step is appended to the engine, the sweeps warm started from
+    the converged messages only run over the last ``lag`` steps and the new
+    one, then the oldest step is frozen: its marginals are final and only
+    the forward message it sends into the window is kept. The cost of a new
+    observation is ``O(lag d^2)`` per sweep whatever the length of the
+    chain. The frozen marginals are kept in :attr:`history` unless
+    ``keep_history`` is False.
+
+    :param engine: chain with the observations known so far
+    :type engine: ChainEngine
+    :param lag: number of time steps still updated by a new observation
+    :type lag: int
+    :param keep_history: keep the marginals of frozen steps, defaults to True
+    :type keep_history: bool, optional
+    :param tolerance: of the sweeps after every new step, defaults to 1e-4
+    :type tolerance: float, optional
+    :param max_iter: sweeps after every new step, defaults to 1000
+    :type max_iter: int, optional
+    """
+
+    def __init__(self, engine, lag, keep_history=True,  # pylint: disable=too-many-arguments
+                 tolerance=1e-4, max_iter=1000):
+        assert lag >= 1
+        self.engine = engine
+        self.lag = lag
+        self.keep_history = keep_history
+        self.tolerance = tolerance
+        self.max_iter = max_iter
+        self.history = ([], [])
+        self.last_transition = None
+        self.frozen_names = ([], [])
+        self.result = self.__settle()
+
+    def __settle(self, deadline=None):
+        result = self.engine.run(max_iter=self.max_iter,
+                                 tolerance=self.tolerance, deadline=deadline)
+        num = max(self.engine.length - self.lag, 0)
+        names = None if self.engine.names is None else \
+            (self.engine.names[0][:num], self.engine.names[1][:num])
+        frozen = self.engine.freeze(num)
+        if self.keep_history:
+            for idx in range(2):
+                self.history[idx].extend(
+                    frozen[idx] if names is None
+                    else zip(names[idx], frozen[idx]))
+        if names is not None:
+            for idx in range(2):
+                self.frozen_names[idx].extend(names[idx])
+        return result
+
+    def step(self, constrained_marginal, transition=None, emission=None,  # pylint: disable=too-many-arguments
+             names=None, deadline=None):
+        """append one time step, see
+        :meth:`~cbp.graph.chain_engine.ChainEngine.append`, and sweep the
+        window
+
+        :param deadline: wall-clock budget in seconds of the sweeps, defaults
+            to None
+        :type deadline: float, optional
+        :return: result of the sweeps over the window
+        :rtype: ~cbp.utils.InferenceResult
+        """
+        self.engine.append(constrained_marginal, transition, emission, names)
+        self.result = self.__settle(deadline)
+        return self.result
+
+    def step_graph(self, graph, evict=False, deadline=None):
+        """follow the time step :meth:`~cbp.builder.HMMBuilder.step` appended
+        to the graph of an engine built
+        :meth:`~cbp.graph.chain_engine.ChainEngine.from_graph`
+
+        :param graph: graph of the engine with one more time step
+        :type graph: BaseGraph
+        :param evict: delete the nodes of frozen steps from ``graph``,
+            defaults to False
+        :type evict: bool, optional
+        :raises ValueError: no new time step in ``graph``
+        :return: result of the sweeps over the window
+        :rtype: ~cbp.utils.InferenceResult
+        """
+        last = self.engine.names[0][-1]
+        varnodes = graph.varnode_recorder
+        factors = graph.factornode_recorder
+        links = [(name, [item for item in factors[name].connections
+                         if item != last][0])
+                 for name in graph.node_recorder[last].connections]
+        links = [(name, var) for name, var in links
+                 if not varnodes[var].isconstrained and
+                 var not in self.engine.names[0] and
+                 name != self.last_transition]
+        if not links:
+            raise ValueError(f"no time step after {last}")
+        trans_name, hidden = links[0]
+        emit_name, obser = [
+            (name, [item for item in factors[name].connections
+                    if item != hidden][0])
+            for name in varnodes[hidden].connections
+            if name != trans_name][0]
+
+        transition = oriented(factors[trans_name], last, hidden)
+        emission = oriented(factors[emit_name], hidden, obser)
+        if self.engine.transition.ndim == 2:
+            if not np.allclose(transition, self.engine.transition):
+                raise ValueError("transition of the new step is not tied")
+            transition = None
+        if self.engine.emission.ndim == 2:
+            if not np.allclose(emission, self.engine.emission):
+                raise ValueError("emission of the new step is not tied")
+            emission = None
+
+        self.last_transition = trans_name
+        result = self.step(varnodes[obser].constrained_marginal, transition,
+                           emission, (hidden, obser), deadline)
+        if evict:
+            self.__evict(graph)
+        return result
+
+    def __evict(self, graph):
+        """delete frozen hidden variables, their observations and the
+        factors between them
+        """
+        hidden, obser = self.frozen_names
+        self.frozen_names = ([], [])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for var, item in zip(hidden, obser):
+                for name in list(graph.node_recorder[var].connections):
+                    graph.delete_node(name)
+                for name in (item, var):
+                    if name in graph.node_recorder:
+                        graph.delete_node(name)
+
+    def hidden_marginals(self):
+        """frozen hidden marginals of :attr:`history` followed by the ones
+        of the window
+        """
+        window = self.engine.export_marginals()
+        if self.engine.names is None:
+            return np.concatenate([np.reshape(
+                self.history[0], (-1, self.engine.state_num)), window[0]])
+        marginals = dict(self.history[0])
+        marginals.update((name, window[name])
+                         for name in self.engine.names[0])
+        return marginals
@@ -1,10 +1,19 @@
-from cbp.utils import (compare_marginals, diff_max_marginals,
-                       engine_loop)
+import time
+
+import numpy as np
+from cbp.utils import (InferenceResult, compare_marginals,
+                       diff_max_marginals, engine_loop)
 from cbp.configs.base_config import baseconfig
 
 from .base_graph import BaseGraph
+from .batch_compiled_graph import BatchCompiledGraph, batch_size
 from .coef_policy import bp_policy
-from .graph_utils import itsbp_inner_loop, find_link
+from .compiled_graph import CompiledGraph
+from .log_compiled_graph import LogCompiledGraph
+from .parallel_flooding import ParallelFlooding
+from .graph_utils import find_link
+from .itsbp_schedule import ItsbpSchedule
+from .residual_schedule import ResidualScheduler
 
 
 class GraphModel(BaseGraph):
@@ -13,32 +22,136 @@ class GraphModel(BaseGraph):
         super().__init__(config=config, silent=silent,
                          epsilon=epsilon, coef_policy=coef_policy)
         self.itsbp_outer_cnt = 0
+        self.its_schedule = None
+        self.schedule_stats = {}
+        self.parallel_flooding = None
 
     def bake(self):
         super().bake()
         for node in self.nodes:
             node.cal_cnp_coef()
+        self.itsbp_outer_cnt = 0
+        self.its_schedule = None
+        self.release_workers()
+        if batch_size(self) is not None:
+            self.compiled_graph = BatchCompiledGraph(self)
+        elif self.cfg.log_domain:
+            self.compiled_graph = LogCompiledGraph(self)
+        elif self.cfg.compiled or self.cfg.num_worker > 1:
+            self.compiled_graph = CompiledGraph(self)
+        else:
+            self.compiled_graph = None
 
-    def run_cnp(self):
+    def run_cnp(self, schedule="parallel", deadline=None):
         self.bake()
-        return self.norm_product_bp()
+        return self.norm_product_bp(schedule=schedule, deadline=deadline)
 
-    def run_bp(self):
+    def run_bp(self, deadline=None):
         if self.coef_policy != bp_policy:  # pylint: disable=comparison-with-callable
             self.coef_policy = bp_policy
         self.bake()
-        return self.itsbp()
+        return self.itsbp(deadline=deadline)
 
-    def norm_product_bp(self, max_iter=5000000, tolerance=1e-5, error_fun=None):
+    def norm_product_bp(self, max_iter=5000000, tolerance=1e-5,  # pylint: disable=too-many-arguments
+                        error_fun=None, schedule="parallel", monitor=None,
+                        deadline=None):
+        """run norm-product belief propagation until the marginals converge
+
+        :param schedule: ``"parallel"`` sends every message once per step,
+            ``"residual"`` commits the messages of largest residual first,
+            see :class:`~cbp.graph.residual_schedule.ResidualScheduler`,
+            defaults to "parallel"
+        :type schedule: str, optional
+        :param monitor: convergence check, replaces ``tolerance`` and
+            ``error_fun``, defaults to None
+        :type monitor: ~cbp.utils.ConvergenceMonitor, optional
+        :param deadline: wall-clock budget in seconds, the marginals of the
+            last step are returned once it is hit, defaults to None
+        :type deadline: float, optional
+        :return: list of marginal distances, num of steps. The steps, the
+            number of messages sent and the wall-clock are also kept in
+            ``schedule_stats``
+        :rtype: ~cbp.utils.InferenceResult
+        """
         if error_fun is None:
             error_fun = diff_max_marginals
+        start = time.time()
         self.first_belief_propagation()
-        return self.engine_loop(
-            max_iter=max_iter,
-            engine_fun=self.parallel_message,
-            tolerance=tolerance,
-            error_fun=error_fun,
-            isoutput=False)
+        if schedule == "parallel":
+            try:
+                rtn = self.engine_loop(
+                    max_iter=max_iter,
+                    engine_fun=self.parallel_message,
+                    tolerance=tolerance,
+                    error_fun=error_fun,
+                    isoutput=False,
+                    monitor=monitor,
+                    deadline=deadline)
+            finally:
+                self.release_workers()
+            num_message = rtn[1] * 2 * sum(
+                len(factor.connections)
+                for factor in self.factornode_recorder.values())
+            self.sync_compiled()
+        elif schedule == "residual":
+            if isinstance(self.compiled_graph, BatchCompiledGraph):
+                raise NotImplementedError(
+                    "residual schedule does not support batched graphs")
+            compiled = self.compiled_graph
+            if compiled is None:
+                compiled = CompiledGraph(self)
+            scheduler = ResidualScheduler(compiled)
+            result = engine_loop(
+                engine_fun=scheduler.step,
+                max_iter=max_iter,
+                tolerance=tolerance,
+                error_fun=error_fun,
+                meassure_fun=compiled.export_convergence_marginals,
+                isoutput=False,
+                silent=self.silent,
+                monitor=monitor,
+                deadline=deadline)
+            rtn = result.replace(values=tuple(result[:2]))
+            num_message = scheduler.num_update
+            compiled.writeback(self)
+        else:
+            raise ValueError(f"unknown schedule {schedule}")
+
+        self.schedule_stats = {
+            "schedule": schedule,
+            "step": rtn[1],
+            "num_message": num_message,
+            "wall_clock": time.time() - start
+        }
+        return self.__finish(rtn)
+
+    def __finish(self, result):
+        return result.replace(marginals=self.export_marginals(),
+                              violation=self.constraint_violation())
+
+    def constraint_violation(self):
+        """max L1 distance between the fixed marginal of a constrained
+        variable and the marginal of a connected factor summed onto it
+
+        :return: None without constrained variable
+        :rtype: float
+        """
+        if not self.constrained_names:
+            return None
+        marginals = self.export_convergence_marginals()
+        violation = 0.0
+        for name in self.constrained_names:
+            node = self.varnode_recorder[name]
+            for factor_name in node.connections:
+                connections = self.node_recorder[factor_name].connections
+                marginal = marginals[factor_name]
+                first = marginal.ndim - len(connections)
+                axis = first + connections.index(name)
+                summed = np.sum(marginal, axis=tuple(
+                    j for j in range(first, marginal.ndim) if j != axis))
+                violation = max(violation, float(np.max(np.sum(
+                    np.abs(summed - node.constrained_marginal), axis=-1))))
+        return violation
 
     def engine_loop(  # pylint: disable= too-many-arguments
             self,
@@ -46,33 +159,98 @@ class GraphModel(BaseGraph):
             max_iter=5000000,
             tolerance=1e-2,
             error_fun=None,
-            isoutput=False):
+            isoutput=False,
+            monitor=None,
+            deadline=None):
+        if isinstance(self.compiled_graph, BatchCompiledGraph):
+            return self.batch_engine_loop(engine_fun, max_iter, tolerance,
+                                          deadline)
         if error_fun is None:
             error_fun = compare_marginals
 
-        epsilons, step, _ = engine_loop(
+        result = engine_loop(
             engine_fun=engine_fun,
             max_iter=max_iter,
             tolerance=tolerance,
             error_fun=error_fun,
             meassure_fun=self.export_convergence_marginals,
             isoutput=isoutput,
-            silent=self.silent
+            silent=self.silent,
+            monitor=monitor,
+            deadline=deadline
         )
 
-        return epsilons, step
+        return result.replace(values=tuple(result[:2]))
+
+    def batch_engine_loop(self, engine_fun, max_iter, tolerance,
+                          deadline=None):
+        """:meth:`engine_loop` of a batched graph, every problem stops on its
+        own: once its marginal distance is not above ``tolerance`` it is
+        masked out and its messages are frozen
 
-    def itsbp(self):
+        :return: list of per problem marginal distances, num of steps. The
+            steps of every problem are kept in ``compiled_graph.batch_step``
+        :rtype: ~cbp.utils.InferenceResult
+        """
+        start = time.time()
+        compiled = self.compiled_graph
+        compiled.set_active(np.ones(compiled.batch_size, dtype=bool))
+        batch_step = np.zeros(compiled.batch_size, dtype=int)
+        epsilons = []
+        step = 0
+        cur_marginals = self.export_convergence_marginals()
+        timed_out = False
+        while step < max_iter and compiled.active.any():
+            if deadline is not None and time.time() - start >= deadline:
+                timed_out = True
+                break
+            last_marginals = cur_marginals
+            engine_fun()
+            step += 1
+            batch_step[compiled.active] = step
+            cur_marginals = self.export_convergence_marginals()
+            epsilon = compiled.marginal_distance(cur_marginals, last_marginals)
+            epsilons.append(epsilon)
+            compiled.set_active(compiled.active & (epsilon > tolerance))
+        converged = not compiled.active.any()
+        compiled.set_active(np.ones(compiled.batch_size, dtype=bool))
+        compiled.batch_step = batch_step
+        return InferenceResult(
+            (epsilons, step), converged=converged, timed_out=timed_out,
+            residual=epsilons[-1] if epsilons else np.inf)
+
+    def itsbp(self, max_iter=5000000, tolerance=1e-4, deadline=None):
         """run sinkhorn or iterative scaling inference
 
-        :return: [description]
-        :rtype: [type]
+        :param deadline: wall-clock budget in seconds, the marginals of the
+            last sweep are returned once it is hit, defaults to None
+        :type deadline: float, optional
+        :return: list of marginal distances, num of steps
+        :rtype: ~cbp.utils.InferenceResult
         """
         self.first_belief_propagation()
-        return self.engine_loop(self.itsbp_outer_loop,
-                                tolerance=1e-4,
-                                error_fun=diff_max_marginals,
-                                isoutput=False)
+        self.get_its_schedule().cnt = 0
+        rtn = self.engine_loop(self.itsbp_outer_loop,
+                               max_iter=max_iter,
+                               tolerance=tolerance,
+                               error_fun=diff_max_marginals,
+                               isoutput=False,
+                               deadline=deadline)
+        self.sync_compiled()
+        return self.__finish(rtn)
+
+    def first_belief_propagation(self):
+        if self.compiled_graph is not None:
+            self.compiled_graph.init_messages()
+        else:
+            super().first_belief_propagation()
+
+    def sync_compiled(self):
+        """write the messages of the compiled graph back into the nodes,
+        no-op when the graph is not compiled
+        """
+        if self.compiled_graph is not None:
+            self.compiled_graph.writeback(self)
 
     def its_next_looplink(self):
         target_node = self.leaf_nodes[self.itsbp_outer_cnt]
@@ -84,15 +262,56 @@ class GraphModel(BaseGraph):
             self.itsbp_outer_cnt, self.leaf_nodes)
         return target_node, find_link(target_node, next_node)
 
+    def get_its_schedule(self):
+        """ITS-BP sweeps of ``cfg.itsbp_schedule``, compiled once per bake
+
+        :rtype: ItsbpSchedule
+        """
+        if self.its_schedule is None:
+            self.its_schedule = ItsbpSchedule(self)
+        return self.its_schedule
+
     def itsbp_outer_loop(self):
-        for _ in range(len(self.leaf_nodes)):
-            _, loop_link = self.its_next_looplink()
-            itsbp_inner_loop(loop_link, self.silent)
+        schedule = self.get_its_schedule()
+        sweep = schedule.next_sweep()
+        if self.compiled_graph is not None:
+            self.compiled_graph.send_ops(*schedule.compiled_sweeps[sweep])
+            return
+
+        for sender, recipient in schedule.sweeps[sweep]:
+            sender.send_message(recipient, self.silent)
 
     def parallel_message(self, run_constrained=True):
+        """send every message once, with ``cfg.num_worker > 1`` the
+        synchronous sweep of
+        :class:`~cbp.graph.parallel_flooding.ParallelFlooding` is run, the
+        workers are kept until :meth:`release_workers`
+
+        :return: number of messages sent
+        :rtype: int
+        """
+        if self.cfg.num_worker > 1 and self.compiled_graph is not None and \
+                not isinstance(self.compiled_graph, BatchCompiledGraph):
+            if self.parallel_flooding is None:
+                self.parallel_flooding = ParallelFlooding(
+                    self.compiled_graph, self.cfg.num_worker)
+            return self.parallel_flooding.sweep(run_constrained)
+        if self.compiled_graph is not None:
+            return self.compiled_graph.parallel_message(run_constrained)
+
+        num_message = 0
         for target_var in self.varnode_recorder.values():
             # sendind in messages from factors
             target_var.sendin_message(self.silent)
+            num_message += len(target_var.connections)
 
             if run_constrained or (not target_var.isconstrained):
                 target_var.sendout_message(self.silent)
+                num_message += len(target_var.connections)
+        return num_message
+
+    def release_workers(self):
+        """stop the workers of :meth:`parallel_message`, no-op without"""
+        if self.parallel_flooding is not None:
+            self.parallel_flooding.close()
+            self.parallel_flooding = None
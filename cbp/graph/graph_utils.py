@@ -1,4 +1,4 @@
-from cbp.utils.np_utils import reduction_ndarray
+from cbp.utils.np_utils import reduction_all
 
 
 def get_node2root(node):
@@ -29,6 +29,36 @@ def find_link(node_a, node_b):
     return a_2root[:-1] + b_2root[:]
 
 
+def dfs_order(root, node_map):
+    """depth first traversal from ``root`` with an explicit stack, children
+    follow the order of ``connections``
+
+    :param root: start node
+    :param node_map: node name -> node
+    :type node_map: dict
+    :return: pre-order and post-order lists of ``(node, parent)`` pairs, the
+        parent of ``root`` is None
+    :rtype: tuple
+    """
+    preorder, postorder = [(root, None)], []
+    visited = {root.name}
+    stack = [(root, None, iter(root.connections))]
+    while stack:
+        node, parent, children = stack[-1]
+        for name in children:
+            if name not in visited:
+                visited.add(name)
+                child = node_map[name]
+                preorder.append((child, node))
+                stack.append((child, node, iter(child.connections)))
+                break
+        else:
+            stack.pop()
+            postorder.append((node, parent))
+
+    return preorder, postorder
+
+
 def itsbp_inner_loop(loop_link, is_silent):
     if len(loop_link) == 2:
         return
@@ -38,7 +68,5 @@ def itsbp_inner_loop(loop_link, is_silent):
 
 
 def cal_marginal_from_tensor(prob_tensor, varnode_list):
-    rtn_marginal = []
-    for i, _ in enumerate(varnode_list):
-        rtn_marginal.append(reduction_ndarray(prob_tensor, i))
-    return rtn_marginal
+    assert prob_tensor.ndim == len(varnode_list)
+    return reduction_all(prob_tensor)
@@ -0,0 +1,149 @@
+import numpy as np
+from cbp.node import VarNode
+
+from .graph_utils import find_link
+
+
+def message_inputs(sender, recipient):
+    """messages read by ``sender.send_message(recipient)``
+
+    Messages are ``(sender_name, recipient_name)`` keys, the dense
+    norm-product term a factor keeps for a variable is ``("inner", factor,
+    var)``. The message coming back from the recipient cancels out when the
+    powers of both terms of the variable update agree, it is only an input
+    otherwise.
+
+    :return: input keys
+    :rtype: list
+    """
+    others = [name for name in sender.connections if name != recipient.name]
+    if not isinstance(sender, VarNode):
+        inputs = [(name, sender.name) for name in others]
+        inputs.extend(("inner", sender.name, name) for name in others
+                      if sender.has_extra_term(name))
+        return inputs
+
+    hat_c_ialpha = recipient.get_hat_c_ialpha(sender.name)
+    if sender.isconstrained:
+        return [(recipient.name, sender.name)]
+    inputs = [(name, sender.name) for name in others]
+    if not np.isclose(sender.hat_c_i, hat_c_ialpha):
+        inputs.append((recipient.name, sender.name))
+    return inputs
+
+
+def message_outputs(sender, recipient):
+    outputs = [(sender.name, recipient.name)]
+    if not isinstance(sender, VarNode) and \
+            sender.has_extra_term(recipient.name):
+        outputs.append(("inner", sender.name, recipient.name))
+    return outputs
+
+
+class ItsbpSchedule():  # pylint: disable=too-many-instance-attributes
+    """ITS-BP sweeps compiled into flat lists of sends
+
+    The walk of :meth:`~cbp.graph.GraphModel.its_next_looplink` over the leaf
+    nodes is simulated once on a copy of ``leaf_nodes``, every link between
+    two consecutive leaves is expanded into ``(sender, recipient)`` sends.
+    A send is dropped when none of its :func:`message_inputs` changed since
+    it was sent last, e.g. the sends leaving an unconstrained leaf after the
+    first sweep. Whether a send is dropped only depends on the leaf order and
+    on which sends are pending, so the sweeps become periodic: the schedule
+    is ``warmup`` sweeps followed by a repeated ``cycle``.
+
+    :param graph: baked graph
+    :type graph: GraphModel
+    :param max_sweep: simulated sweeps before giving up on dropping sends,
+        defaults to 1000
+    :type max_sweep: int, optional
+    """
+
+    def __init__(self, graph, max_sweep=1000):
+        self.graph = graph
+        self.links = {}
+        sweeps, num_warmup = self.__simulate(graph, True, max_sweep)
+        if sweeps is None:
+            sweeps, num_warmup = self.__simulate(graph, False, max_sweep)
+        self.sweeps = sweeps
+        self.num_warmup = num_warmup
+        self.cnt = 0
+
+        compiled = graph.compiled_graph
+        self.compiled_sweeps = None
+        if compiled is not None:
+            self.compiled_sweeps = [self.__compile(compiled, sweep)
+                                    for sweep in self.sweeps]
+
+    @staticmethod
+    def __compile(compiled, sweep):
+        edges = np.zeros(len(sweep), dtype=int)
+        from_factor = np.zeros(len(sweep), dtype=bool)
+        for idx, (sender, recipient) in enumerate(sweep):
+            is_factor, sender_idx = compiled.node_index[sender.name]
+            _, recipient_idx = compiled.node_index[recipient.name]
+            from_factor[idx] = is_factor
+            edges[idx] = compiled.edge_lookup[
+                (sender_idx, recipient_idx) if is_factor
+                else (recipient_idx, sender_idx)]
+        return edges, from_factor
+
+    def __link(self, node_a, node_b):
+        key = (node_a.name, node_b.name)
+        if key not in self.links:
+            link = find_link(node_a, node_b)
+            self.links[key] = [] if len(link) == 2 else \
+                list(zip(link[0:-1], link[1:]))
+        return self.links[key]
+
+    def __simulate(self, graph, eliminate, max_sweep):
+        leaf_nodes = list(graph.leaf_nodes)
+        cnt = 0
+        inputs, outputs = {}, {}
+        version, sent = {}, {}
+        seen, sweeps = {}, []
+        for _ in range(max_sweep):
+            state = (cnt, tuple(node.name for node in leaf_nodes))
+            if eliminate:
+                state += (len(sent), frozenset(
+                    key for key in sent
+                    if any(version.get(item, 0) != seen_version
+                           for item, seen_version in sent[key].items())),)
+            if state in seen:
+                return sweeps, seen[state]
+            seen[state] = len(sweeps)
+
+            sweep = []
+            for _ in range(len(leaf_nodes)):
+                target_node = leaf_nodes[cnt]
+                next_node = leaf_nodes[(cnt + 1) % len(leaf_nodes)]
+                cnt = graph.cfg.itsbp_schedule(cnt, leaf_nodes)
+                for sender, recipient in self.__link(target_node, next_node):
+                    key = (sender.name, recipient.name)
+                    if key not in inputs:
+                        inputs[key] = message_inputs(sender, recipient)
+                        outputs[key] = message_outputs(sender, recipient)
+                    if eliminate and key in sent and all(
+                            version.get(item, 0) == seen_version
+                            for item, seen_version in sent[key].items()):
+                        continue
+                    sweep.append((sender, recipient))
+                    sent[key] = {item: version.get(item, 0)
+                                 for item in inputs[key]}
+                    for item in outputs[key]:
+                        version[item] = version.get(item, 0) + 1
+            sweeps.append(sweep)
+
+        return None, None
+
+    def next_sweep(self):
+        """index of the sweep to run next, advances the schedule"""
+        idx = self.cnt
+        self.cnt += 1
+        if self.cnt == len(self.sweeps):
+            self.cnt = self.num_warmup
+        return idx
+
+    @property
+    def num_send(self):
+        return [len(sweep) for sweep in self.sweeps]
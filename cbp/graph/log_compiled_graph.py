@@ -0,0 +1,208 @@
+import numpy as np
+
+from .compiled_graph import CompiledGraph
+
+LOG_FLOOR = np.log(1e-12)
+
+
+def log_marginalize(log_tensor, axis, out, work):
+    """``out = log(sum(exp(log_tensor)))`` over all axes except ``axis``
+
+    :param log_tensor: log values, left unchanged
+    :param axis: kept axis
+    :type axis: int
+    :param out: 1-D output, length of the kept axis
+    :param work: scratch with the shape of ``log_tensor``
+    """
+    others = tuple(j for j in range(log_tensor.ndim) if j != axis)
+    shift = np.max(log_tensor)
+    np.subtract(log_tensor, shift, out=work)
+    np.exp(work, out=work)
+    np.sum(work, axis=others, out=out)
+    np.log(out, out=out)
+    out += shift
+
+
+def log_normalize(log_val):
+    """in place, make ``exp(log_val)`` sum to one"""
+    shift = np.max(log_val)
+    log_val -= shift + np.log(np.sum(np.exp(log_val - shift)))
+
+
+def log_normalize_rows(log_val):
+    """:func:`log_normalize` for every row of a 2-D array, in place"""
+    shift = np.max(log_val, axis=1, keepdims=True)
+    log_val -= shift + np.log(np.sum(np.exp(log_val - shift), axis=1,
+                                     keepdims=True))
+
+
+class LogCompiledGraph(CompiledGraph):
+    """:class:`~cbp.graph.compiled_graph.CompiledGraph` running in the log
+    domain
+
+    Messages, the dense ``inner`` terms and the potentials are stored as log
+    values. Products become sums, the powers of the norm-product updates
+    become scalings and factor summations use log-sum-exp, so an update is a
+    single pass without the clip/exp/log round trip of the linear engine. The
+    ``1e-12`` clips of the linear engine are kept as a floor at
+    ``log(1e-12)``, which makes both engines agree wherever the linear one is
+    finite.
+    """
+    _combine = np.add
+
+    def __init__(self, graph):
+        super().__init__(graph)
+        with np.errstate(divide='ignore'):
+            self.log_potential_stack = {
+                shape: np.log(stack)
+                for shape, stack in self.potential_stack.items()}
+        self.log_factor_potential = [
+            self.log_potential_stack[potential.shape][row]
+            for potential, row in zip(self.factor_potential,
+                                      self.potential_row)]
+
+    def init_messages(self):
+        for bank in self.arena.banks:
+            for edge in range(self.num_edge):
+                bank.f2v[edge].fill(-np.log(self.edge_dim[edge]))
+                bank.v2f[edge].fill(-np.log(self.edge_dim[edge]))
+            for inner in bank.inner:
+                inner.fill(0.0)
+
+    def _potential(self, factor):
+        return self.log_factor_potential[factor]
+
+    def _v2f_term(self, edge, bank):
+        term = bank.v2f[edge].reshape(self.edge_shape[edge])
+        if self.has_extra[edge]:
+            return term + self.extra_exponent[edge] * \
+                self.last_inner(edge, bank)
+        return term
+
+    def _factor_message(self, edge, src, dst):
+        factor = self.edge_factor[edge]
+        log_potential = self.log_factor_potential[factor]
+        edges = self.factor_edges(factor)
+        out = dst.f2v[edge]
+        if len(edges) == 1:
+            if self.has_extra[edge]:
+                np.copyto(self.last_inner(edge, dst), log_potential)
+            np.copyto(out, log_potential)
+            log_normalize(out)
+            return
+
+        work = self.factor_scratch[log_potential.shape]
+        product_out = self.last_inner(edge, dst) \
+            if self.has_extra[edge] else work
+        np.copyto(product_out, log_potential)
+        for other in edges:
+            if other != edge:
+                product_out += self._v2f_term(other, src)
+        self._sum_inner(edge, product_out, work, out)
+
+    def _sum_inner(self, edge, product_out, work, out):
+        # the floor is applied to the stored term as well, so zeros of the
+        # potential give a finite extra term instead of 0 ** -x
+        hat_c_ialpha = self.hat_c_ialpha[edge]
+        np.maximum(product_out, LOG_FLOOR, out=product_out)
+        np.multiply(product_out, 1.0 / hat_c_ialpha, out=work)
+        log_marginalize(work, self.edge_axis[edge], out, work)
+        out *= hat_c_ialpha
+        log_normalize(out)
+
+    def _log_numerator(self, var, bank):
+        if self.var_constrained[var]:
+            return self.log_constrained[var]
+        numerator = self.var_scratch[self.var_dim[var]]
+        numerator.fill(0.0)
+        for edge in self.var_edges(var):
+            numerator += bank.f2v[edge]
+        np.maximum(numerator, LOG_FLOOR, out=numerator)
+        numerator += self.log_var_potential[var]
+        numerator *= 1.0 / self.hat_c_i[var]
+        return numerator
+
+    def _var_message(self, edge, src, dst, log_numerator=None):
+        var = self.edge_var[edge]
+        c_alpha = self.factor_coef[self.edge_factor[edge]]
+        out = dst.v2f[edge]
+        if log_numerator is None:
+            log_numerator = self._log_numerator(var, src)
+        np.maximum(src.f2v[edge], LOG_FLOOR, out=out)
+        out *= -1.0 / self.hat_c_ialpha[edge]
+        out += log_numerator
+        out *= c_alpha
+        log_normalize(out)
+
+    def _var_batch(self, batch, src, dst):
+        numerator = np.add.reduceat(src.flat[batch.in_index],
+                                    batch.in_ptr, axis=0)
+        np.maximum(numerator, LOG_FLOOR, out=numerator)
+        numerator += batch.log_potential
+        numerator /= batch.hat_c_i
+        numerator[batch.constrained] = batch.log_constrained
+        out = numerator[batch.var_pos]
+        out -= np.maximum(src.flat[batch.f2v_index], LOG_FLOOR) / \
+            batch.hat_c_ialpha
+        out *= batch.c_alpha
+        log_normalize_rows(out)
+        dst.flat[batch.out_index] = out
+
+    def _factor_batch(self, batch, src, dst):
+        log_potential = self.log_potential_stack[batch.shape][batch.rows]
+        if batch.unary:
+            if batch.inner_index is not None:
+                dst.flat[batch.inner_index] = log_potential[batch.extra_out]
+            log_normalize_rows(log_potential)
+            dst.flat[batch.out_index] = log_potential
+            return
+
+        product_out = log_potential
+        for v2f_index, term_shape, extra, inner_index, exponent in \
+                batch.others:
+            product_out += src.flat[v2f_index].reshape(term_shape)
+            if inner_index is not None:
+                product_out[extra] += exponent * src.flat[inner_index].reshape(
+                    (-1,) + batch.shape)
+        np.maximum(product_out, LOG_FLOOR, out=product_out)
+        if batch.inner_index is not None:
+            dst.flat[batch.inner_index] = product_out[batch.extra_out].reshape(
+                len(batch.inner_index), -1)
+
+        product_out /= batch.hat_c_ialpha
+        shift = np.max(product_out, axis=batch.sum_axes, keepdims=True)
+        product_out -= shift
+        np.exp(product_out, out=product_out)
+        out = np.log(np.sum(product_out, axis=batch.sum_axes)) + \
+            shift.reshape(len(product_out), -1)
+        out *= batch.hat_c_ialpha.reshape(-1, 1)
+        log_normalize_rows(out)
+        dst.flat[batch.out_index] = out
+
+    def var_marginal(self, var):
+        if self.var_constrained[var]:
+            return self.constrained_marginal[var]
+        belief = self.log_var_potential[var].copy()
+        for edge in self.var_edges(var):
+            belief += self.f2v[edge]
+        belief *= 1.0 / self.hat_c_i[var]
+        log_normalize(belief)
+        return np.exp(belief)
+
+    def factor_marginal(self, factor):
+        front = self.arena.front
+        belief = self.log_factor_potential[factor]
+        for edge in self.factor_edges(factor):
+            belief = belief + self._v2f_term(edge, front)
+        belief *= 1.0 / self.factor_coef[factor]
+        log_normalize(belief)
+        return np.exp(belief)
+
+    def linear_f2v(self, edge):
+        return np.exp(self.f2v[edge])
+
+    def linear_v2f(self, edge):
+        return np.exp(self.v2f[edge])
+
+    def linear_inner(self, edge):
+        return np.exp(self.last_inner(edge))
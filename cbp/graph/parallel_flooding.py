@@ -0,0 +1,110 @@
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+from cbp.utils.message_arena import MessageArena
+
+
+def partition(compiled, num_worker):
+    """contiguous chunks of variables with about the same number of edges"""
+    num_edge = np.array([len(compiled.var_edges(var))
+                         for var in range(compiled.num_var)])
+    bounds = np.searchsorted(np.cumsum(num_edge),
+                             np.arange(1, num_worker) * np.sum(num_edge) /
+                             num_worker)
+    return [chunk for chunk in np.split(np.arange(compiled.num_var), bounds)
+            if len(chunk)]
+
+
+def _worker(compiled, variables, conn):
+    while True:
+        command = conn.recv()
+        if command is None:
+            break
+        front, run_constrained = command
+        if compiled.arena.front_index != front:
+            compiled.arena.swap()
+        try:
+            conn.send(compiled.flooding_vars(variables, run_constrained))
+        except Exception as error:  # pylint: disable=broad-except
+            conn.send(error)
+    conn.close()
+
+
+class ParallelFlooding():
+    """:meth:`~cbp.graph.compiled_graph.CompiledGraph.flooding_message` on a
+    pool of forked processes
+
+    The message arena of ``compiled`` is moved to a
+    ``multiprocessing.shared_memory`` buffer and the variables are split into
+    chunks of about the same number of edges, one per worker. In a sweep all
+    workers read the front bank and write the back bank slots of their own
+    variables, the only synchronisation is one message per worker and sweep.
+    :meth:`close` moves the arena back to private memory.
+
+    :param compiled: graph to run on
+    :type compiled: CompiledGraph
+    :param num_worker: number of processes
+    :type num_worker: int
+    """
+
+    def __init__(self, compiled, num_worker):
+        self.compiled = compiled
+        arena = compiled.arena
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=max(arena.nbytes, 1))
+        buffer = np.ndarray(arena.buffer.shape, dtype=arena.buffer.dtype,
+                            buffer=self.shm.buf)
+        np.copyto(buffer, arena.buffer)
+        compiled.arena = self.__move(arena, buffer)
+
+        context = multiprocessing.get_context("fork")
+        self.conns, self.workers = [], []
+        for variables in partition(compiled, num_worker):
+            conn, child_conn = context.Pipe()
+            worker = context.Process(target=_worker,
+                                     args=(compiled, variables, child_conn),
+                                     daemon=True)
+            worker.start()
+            child_conn.close()
+            self.conns.append(conn)
+            self.workers.append(worker)
+
+    @staticmethod
+    def __move(arena, buffer):
+        moved = MessageArena(arena.shapes, arena.num_bank, buffer)
+        if moved.front_index != arena.front_index:
+            moved.swap()
+        return moved
+
+    def sweep(self, run_constrained=True):
+        """one synchronous sweep, banks are swapped at the end
+
+        :return: number of messages sent
+        :rtype: int
+        """
+        command = (self.compiled.arena.front_index, run_constrained)
+        for conn in self.conns:
+            conn.send(command)
+        num_message = 0
+        for conn in self.conns:
+            reply = conn.recv()
+            if isinstance(reply, Exception):
+                raise RuntimeError("parallel flooding worker failed") \
+                    from reply
+            num_message += reply
+        self.compiled.arena.swap()
+        return num_message
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+            conn.close()
+        for worker in self.workers:
+            worker.join()
+        self.conns, self.workers = [], []
+        arena = self.compiled.arena
+        self.compiled.arena = self.__move(arena, np.array(arena.buffer))
+        del arena
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,119 @@
+import heapq
+
+import numpy as np
+
+F2V = 0
+V2F = 1
+
+
+class ResidualScheduler():  # pylint: disable=too-many-instance-attributes
+    """Residual belief propagation on a
+    :class:`~cbp.graph.compiled_graph.CompiledGraph`
+
+    Every message has a pending value in the back bank of the arena and a
+    residual, the max absolute change committing it would make. A priority
+    queue pops the largest residual first, commits the pending value to the
+    front bank and recomputes only the pending messages reading the committed
+    one: the messages leaving the recipient and, for factors keeping an
+    ``inner`` term, the other messages of the sending factor. Edges whose
+    inputs did not change are never recomputed.
+
+    :param compiled: graph to run on, messages are updated in place
+    :type compiled: CompiledGraph
+    :param run_constrained: update the messages leaving constrained
+        variables, defaults to True
+    :type run_constrained: bool, optional
+    """
+
+    def __init__(self, compiled, run_constrained=True):
+        self.compiled = compiled
+        self.run_constrained = run_constrained
+        self.residual = np.zeros((2, compiled.num_edge))
+        self.version = np.zeros((2, compiled.num_edge), dtype=int)
+        self.heap = []
+        self.num_update = 0
+        self.reset()
+
+    def reset(self):
+        """recompute every pending message from the current front bank"""
+        compiled = self.compiled
+        self.heap = []
+        for factor in range(compiled.num_factor):
+            for edge in compiled.factor_edges(factor):
+                self.__pending_f2v(edge)
+        for var in range(compiled.num_var):
+            self.__pending_v2f(var)
+
+    def __push(self, kind, edge, residual):
+        self.residual[kind, edge] = residual
+        self.version[kind, edge] += 1
+        if residual > 0:
+            heapq.heappush(self.heap, (-residual, self.version[kind, edge],
+                                       kind, edge))
+
+    def __pending_f2v(self, edge):
+        compiled = self.compiled
+        front, back = compiled.arena.front, compiled.arena.back
+        compiled._factor_message(edge, front, back)  # pylint: disable=protected-access
+        self.__push(F2V, edge,
+                    np.max(np.abs(back.f2v[edge] - front.f2v[edge])))
+
+    def __pending_v2f(self, var):
+        compiled = self.compiled
+        if not (self.run_constrained or not compiled.var_constrained[var]):
+            return
+        front, back = compiled.arena.front, compiled.arena.back
+        compiled._var_messages(var, front, back)  # pylint: disable=protected-access
+        for edge in compiled.var_edges(var):
+            self.__push(V2F, edge,
+                        np.max(np.abs(back.v2f[edge] - front.v2f[edge])))
+
+    def __commit(self, kind, edge):
+        compiled = self.compiled
+        front, back = compiled.arena.front, compiled.arena.back
+        factor = compiled.edge_factor[edge]
+        self.residual[kind, edge] = 0
+        self.num_update += 1
+        if kind == F2V:
+            np.copyto(front.f2v[edge], back.f2v[edge])
+            if compiled.has_extra[edge]:
+                np.copyto(front.inner[compiled.inner_slot[edge]],
+                          back.inner[compiled.inner_slot[edge]])
+                for other in compiled.factor_edges(factor):
+                    if other != edge:
+                        self.__pending_f2v(other)
+            self.__pending_v2f(compiled.edge_var[edge])
+        else:
+            np.copyto(front.v2f[edge], back.v2f[edge])
+            for other in compiled.factor_edges(factor):
+                if other != edge:
+                    self.__pending_f2v(other)
+
+    def step(self, num_update=None, tolerance=0.0):
+        """commit up to ``num_update`` messages, largest residual first
+
+        :param num_update: defaults to ``2 * num_edge``, the messages of one
+            flooding sweep
+        :type num_update: int, optional
+        :param tolerance: stop once the largest residual is not above it
+        :type tolerance: float, optional
+        :return: number of committed messages
+        :rtype: int
+        """
+        if num_update is None:
+            num_update = 2 * self.compiled.num_edge
+        cnt = 0
+        while cnt < num_update and self.heap:
+            neg_residual, version, kind, edge = heapq.heappop(self.heap)
+            if version != self.version[kind, edge]:
+                continue
+            if -neg_residual <= tolerance:
+                heapq.heappush(self.heap, (neg_residual, version, kind, edge))
+                break
+            self.__commit(kind, edge)
+            cnt += 1
+        return cnt
+
+    @property
+    def max_residual(self):
+        return np.max(self.residual)
@@ -0,0 +1,123 @@
+import numpy as np
+from cbp.node import VarNode
+
+
+class TreeSinkhorn():
+    """Sinkhorn iterations of :meth:`~cbp.graph.base_graph.BaseGraph.sinkhorn`
+    computed with message passing on a tree graph
+
+    The joint ``big_u * pmf`` is never built: its marginals are sum-product
+    marginals of the factor potentials with the scaling ``u`` of constrained
+    variables as variable potentials. Messages are kept for both directions
+    of every edge, memory is ``O(edges * d^k)`` for factors of k variables.
+    All messages directed to the constrained variable being scaled are up to
+    date, once its ``u`` changed only the messages on the path to the next
+    constrained variable are sent again.
+
+    :param graph: tree graph with constrained variables
+    :type graph: BaseGraph
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.preorder, self.postorder = graph.traversal_order()
+        self.parent = {node.name: parent for node, parent in self.preorder}
+        self.depth = {}
+        for node, parent in self.preorder:
+            self.depth[node.name] = 0 if parent is None else \
+                self.depth[parent.name] + 1
+        self.names = list(graph.constrained_names)
+        self.mu = {name: graph.varnode_recorder[name].constrained_marginal
+                   for name in self.names}
+        self.u = {name: np.ones(graph.varnode_recorder[name].rv_dim)
+                  for name in self.names}
+        self.messages = {}
+        self.__full_pass()
+
+    def __var2factor(self, var, factor):
+        message = self.u[var.name].copy() if var.name in self.u \
+            else np.ones(var.rv_dim)
+        for name in var.connections:
+            if name != factor.name:
+                message *= self.messages[(name, var.name)]
+        return message
+
+    def __factor2var(self, factor, var):
+        product_out = factor.dense_potential
+        for axis, name in enumerate(factor.connections):
+            if name != var.name:
+                shape = [1] * product_out.ndim
+                shape[axis] = -1
+                product_out = product_out * \
+                    self.messages[(name, factor.name)].reshape(shape)
+        axis = factor.connections.index(var.name)
+        return product_out.sum(
+            tuple(j for j in range(product_out.ndim) if j != axis))
+
+    def __send(self, sender, recipient):
+        if isinstance(sender, VarNode):
+            message = self.__var2factor(sender, recipient)
+        else:
+            message = self.__factor2var(sender, recipient)
+        self.messages[(sender.name, recipient.name)] = \
+            message / np.sum(message)
+
+    def __full_pass(self):
+        for node, parent in self.postorder:
+            if parent is not None:
+                self.__send(node, parent)
+        for node, parent in self.preorder:
+            if parent is not None:
+                self.__send(parent, node)
+
+    def path(self, name_a, name_b):
+        """nodes on the tree path from ``name_a`` to ``name_b``"""
+        node_map = self.graph.node_recorder
+        head, tail = [node_map[name_a]], [node_map[name_b]]
+        while head[-1] is not tail[-1]:
+            if self.depth[head[-1].name] >= self.depth[tail[-1].name]:
+                head.append(self.parent[head[-1].name])
+            else:
+                tail.append(self.parent[tail[-1].name])
+        return head + tail[-2::-1]
+
+    def marginal(self, var):
+        """marginal of ``var`` under the joint ``big_u * pmf``, only valid for
+        the constrained variable being scaled or after a full pass
+        """
+        prod = self.u[var.name].copy() if var.name in self.u \
+            else np.ones(var.rv_dim)
+        for name in var.connections:
+            prod *= self.messages[(name, var.name)]
+        return prod / np.sum(prod)
+
+    def update(self, jacobi=False):
+        """one sweep of scaling over all constrained variables, fills
+        ``node.sinkhorn`` like
+        :meth:`~cbp.graph.base_graph.BaseGraph.sinkhorn_update`
+
+        :param jacobi: scale all constrained variables from the marginals of
+            one full pass, defaults to False
+        :type jacobi: bool, optional
+        """
+        varnodes = self.graph.varnode_recorder
+        if jacobi:
+            self.__full_pass()
+            for node in varnodes.values():
+                node.sinkhorn = self.marginal(node)
+            for name in self.names:
+                denominator = np.clip(varnodes[name].sinkhorn, 1e-12, None)
+                self.u[name] = self.u[name] * self.mu[name] / denominator
+            return
+
+        for idx, name in enumerate(self.names):
+            if idx == len(self.names) - 1:
+                self.__full_pass()
+                for node in varnodes.values():
+                    node.sinkhorn = self.marginal(node)
+            denominator = np.clip(self.marginal(varnodes[name]), 1e-12, None)
+            self.u[name] = self.u[name] * self.mu[name] / denominator
+
+            link = self.path(name, self.names[(idx + 1) % len(self.names)])
+            for sender, recipient in zip(link[:-1], link[1:]):
+                self.__send(sender, recipient)
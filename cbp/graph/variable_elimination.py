@@ -0,0 +1,140 @@
+import numpy as np
+
+
+def elimination_order(num_var, scopes, heuristic="min_fill"):
+    """greedy elimination order of the interaction graph of ``scopes``
+
+    :param num_var: number of variables, indexed from 0
+    :type num_var: int
+    :param scopes: variables of every factor
+    :type scopes: list
+    :param heuristic: ``"min_fill"`` eliminates the variable adding the
+        fewest fill-in edges, ``"min_degree"`` the one with the fewest
+        neighbors, ties are broken by index, defaults to "min_fill"
+    :type heuristic: str, optional
+    :return: variables in elimination order, neighbors of every variable
+        when it is eliminated
+    :rtype: tuple
+    """
+    if heuristic not in ("min_fill", "min_degree"):
+        raise ValueError(f"unknown elimination heuristic {heuristic}")
+    adjacency = [set() for _ in range(num_var)]
+    for scope in scopes:
+        for var in scope:
+            adjacency[var].update(scope)
+    for var in range(num_var):
+        adjacency[var].discard(var)
+
+    def cost(var):
+        if heuristic == "min_degree":
+            return len(adjacency[var])
+        nbrs = sorted(adjacency[var])
+        return sum(1 for i, var_a in enumerate(nbrs) for var_b in nbrs[i + 1:]
+                   if var_b not in adjacency[var_a])
+
+    remaining = set(range(num_var))
+    order, separators = [], []
+    while remaining:
+        var = min(remaining, key=lambda item: (cost(item), item))
+        nbrs = adjacency[var]
+        for nbr in nbrs:
+            adjacency[nbr].update(nbrs)
+            adjacency[nbr].discard(nbr)
+            adjacency[nbr].discard(var)
+        order.append(var)
+        separators.append(tuple(sorted(nbrs)))
+        remaining.remove(var)
+    return order, separators
+
+
+class JunctionTree():
+    """junction tree of a factor graph built from a variable elimination
+    order, calibrated once with two passes of sum-product between cliques
+
+    Eliminating a variable gives the clique of the variable and its
+    neighbors, its parent is the clique of the separator variable eliminated
+    next. Every factor is put in the clique of the first eliminated variable
+    of its scope. Cost and memory are exponential in the largest clique,
+    i.e. the treewidth of the order, instead of the number of variables.
+
+    :param var_dims: dimension of every variable
+    :type var_dims: list
+    :param factors: ``(scope, potential)`` pairs, axis i of the potential is
+        variable ``scope[i]``
+    :type factors: list
+    :param heuristic: see :func:`elimination_order`, defaults to "min_fill"
+    :type heuristic: str, optional
+    """
+
+    def __init__(self, var_dims, factors, heuristic="min_fill"):
+        self.var_dims = list(var_dims)
+        self.order, self.separators = elimination_order(
+            len(var_dims), [scope for scope, _ in factors], heuristic)
+        self.position = np.argsort(self.order)
+
+        self.cliques = [(var,) + sep
+                        for var, sep in zip(self.order, self.separators)]
+        self.parent = [min(self.position[item] for item in sep) if sep else None
+                       for sep in self.separators]
+        self.children = [[] for _ in self.cliques]
+        for clique, parent in enumerate(self.parent):
+            if parent is not None:
+                self.children[parent].append(clique)
+
+        assigned = [[] for _ in self.cliques]
+        for scope, potential in factors:
+            assigned[min(self.position[var] for var in scope)].append(
+                (potential, tuple(scope)))
+        self.clique_potential = [self.__product(clique, assigned[idx])
+                                 for idx, clique in enumerate(self.cliques)]
+        self.inbox = [{} for _ in self.cliques]
+        self.calibrated = False
+
+    @property
+    def width(self):
+        """size of the largest clique minus one"""
+        return max(len(clique) for clique in self.cliques) - 1
+
+    def __product(self, out_scope, terms):
+        """``einsum`` of ``(array, scope)`` terms summed down to
+        ``out_scope``, the labels are local to the call
+        """
+        labels = {}
+        for _, scope in terms:
+            for var in scope:
+                labels.setdefault(var, len(labels))
+        for var in out_scope:
+            labels.setdefault(var, len(labels))
+        operands = [np.ones([self.var_dims[var] for var in out_scope])]
+        operands.append([labels[var] for var in out_scope])
+        for array, scope in terms:
+            operands.extend((array, [labels[var] for var in scope]))
+        operands.append([labels[var] for var in out_scope])
+        return np.einsum(*operands, optimize=True)
+
+    def __send(self, sender, recipient, scope):
+        terms = [(self.clique_potential[sender], self.cliques[sender])]
+        terms.extend(message for src, message in self.inbox[sender].items()
+                     if src != recipient)
+        message = self.__product(scope, terms)
+        self.inbox[recipient][sender] = (message / np.sum(message), scope)
+
+    def calibrate(self):
+        """upward pass in elimination order, downward pass in reverse"""
+        for clique, parent in enumerate(self.parent):
+            if parent is not None:
+                self.__send(clique, parent, self.separators[clique])
+        for clique in reversed(range(len(self.cliques))):
+            for child in self.children[clique]:
+                self.__send(clique, child, self.separators[child])
+        self.calibrated = True
+
+    def marginal(self, var):
+        """exact marginal of ``var`` from the clique it is eliminated in"""
+        if not self.calibrated:
+            self.calibrate()
+        clique = self.position[var]
+        terms = [(self.clique_potential[clique], self.cliques[clique])]
+        terms.extend(self.inbox[clique].values())
+        marginal = self.__product((var,), terms)
+        return marginal / np.sum(marginal)
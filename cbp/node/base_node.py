@@ -27,12 +27,12 @@ class BaseNode(ABC):
         self.potential = potential
         self.epsilon = 1
         self.coef_ready = False
-        self.is_traversed = False
         self.parent = None
         self.node_degree = 0
         self.connections = []
         self.message_inbox = {}
         self.latest_message = []
+        self.message_index = {}
         self.connected_nodes = {}
 
     def __str__(self):
@@ -98,10 +98,17 @@ class BaseNode(ABC):
         sender_name = message.sender.name
         self.message_inbox[sender_name] = message
 
-        self.latest_message = list(self.message_inbox.values())
+        # latest_message keeps the order of the inbox, update it in place
+        if sender_name in self.message_index:
+            self.latest_message[self.message_index[sender_name]] = message
+        else:
+            self.message_index[sender_name] = len(self.latest_message)
+            self.latest_message.append(message)
 
     def reset(self):
         self.message_inbox.clear()
+        self.latest_message = []
+        self.message_index = {}
 
     # TODO: FIXAPI NAME
     @abstractmethod
@@ -122,8 +129,21 @@ class BaseNode(ABC):
         :rtype: float
         """
 
+    def make_messages(self):
+        """messages to all connected nodes, subclasses share the work between
+        the recipients
+
+        :return: recipient name -> content of the message
+        :rtype: dict
+        """
+        return {name: self.make_message(node)
+                for name, node in self.connected_nodes.items()}
+
     def send_message(self, recipient_node, is_silent=True):
-        val = self.make_message(recipient_node)
+        self._deliver(recipient_node, self.make_message(recipient_node),
+                      is_silent)
+
+    def _deliver(self, recipient_node, val, is_silent=True):
         message = Message(self, val)
         recipient_node.store_message(message)
         if not is_silent:
@@ -135,8 +155,9 @@ class BaseNode(ABC):
             connected_node.send_message(self, is_silent)
 
     def sendout_message(self, is_silent=True):
-        for connected_node in self.connected_nodes.values():
-            self.send_message(connected_node, is_silent)
+        messages = self.make_messages()
+        for name, connected_node in self.connected_nodes.items():
+            self._deliver(connected_node, messages[name], is_silent)
 
     def register_connection(self, node_name):
         self.node_degree += 1
@@ -1,20 +1,44 @@
 import numpy as np
 from cbp.utils.np_utils import nd_expand
+from scipy import sparse
 
 from .base_node import BaseNode
 
 
+def _clip_power(product, exponent):
+    """``product ** exponent`` with entries clipped at 1e-12"""
+    return np.exp(exponent * np.log(np.clip(product, 1e-12, None)))
+
+
 class FactorNode(BaseNode):
     """Factor Node in factor graph
 
       Add new attr:
         * ``isconstrained`` Fixed marginal or not
         * ``hat_c_ialpha`` See Norm-Product paper
-        * ``last_innerparenthese_msg`` See Norm-Product paper
+        * ``last_innerparenthese_msg`` See Norm-Product paper, only kept for
+          connections with a non-trivial extra term
+
+    A pairwise factor accepts a ``scipy.sparse`` potential, kept as CSR with
+    the row and column of every stored entry in ``pattern``. The products of
+    messages and extra terms are kept on the stored entries only and a
+    message is their sum by row or column, a sparse mat-vec, plus the 1e-12
+    clip of the ``missing`` entries, so the messages equal the ones of the
+    dense potential. The marginal is a CSR matrix with the pattern of the
+    potential: time and memory scale with the number of nonzeros.
+
+    :param threshold: entries of the normalized potential below it are
+        dropped and the potential is kept sparse, defaults to None
+    :type threshold: float, optional
     """
 
-    def __init__(self, connections, potential, coef=1):
+    def __init__(self, connections, potential, coef=1, threshold=None):
+        self.threshold = threshold
+        self.pattern = None
+        self.missing = None
         super().__init__(coef, potential)
+        if self.issparse and len(connections) != 2:
+            raise ValueError("sparse potentials need a pairwise factor")
         self.connections = connections
         self.last_innerparenthese_msg = {}
         self.hat_c_ialpha = {}
@@ -40,11 +64,44 @@ class FactorNode(BaseNode):
                 f"Dimention mismatch! At {i:02d} axis in Factor:{self.name} \
                     rv_dim:{varnode.rv_dim:02d}, \
                     potential: {self.potential.shape[i]}"
-            self.last_innerparenthese_msg[varnode_name] = np.ones(
-                self.potential.shape)
 
     def _check_potential(self, potential):
-        return potential / np.sum(potential)
+        if not (sparse.issparse(potential) or self.threshold is not None):
+            self.pattern = None
+            return potential / np.sum(potential)
+        potential = sparse.csr_matrix(potential, dtype=float, copy=True)
+        potential.sum_duplicates()
+        potential.data /= np.sum(potential.data)
+        if self.threshold is not None:
+            potential.data[potential.data < self.threshold] = 0
+        potential.eliminate_zeros()
+        potential.data /= np.sum(potential.data)
+        self.pattern = (np.repeat(np.arange(potential.shape[0]),
+                                  np.diff(potential.indptr)),
+                        potential.indices)
+        self.missing = [potential.shape[1 - axis] - np.bincount(
+            self.pattern[axis], minlength=potential.shape[axis])
+            for axis in range(2)]
+        return potential
+
+    @property
+    def issparse(self):
+        return sparse.issparse(self.potential)
+
+    @property
+    def dense_potential(self):
+        """potential as an ndarray, for the engines of dense tensors"""
+        return self.potential.toarray() if self.issparse else self.potential
+
+    def _values(self):
+        """the potential, only its stored entries when sparse"""
+        return self.potential.data if self.issparse else self.potential
+
+    def _on_pattern(self, values):
+        """CSR matrix with the pattern of the potential"""
+        return sparse.csr_matrix(
+            (values, self.potential.indices, self.potential.indptr),
+            shape=self.potential.shape)
 
     def auto_coef(self, node_map, assign_policy=None):
         super().auto_coef(node_map, assign_policy)
@@ -80,18 +137,28 @@ class FactorNode(BaseNode):
             return self.hat_c_ialpha[node_name]
         return None
 
+    def has_extra_term(self, node_name):
+        """whether the norm-product extra term of ``node_name`` differs from
+        one, it is always one in standard bp
+        """
+        return not (abs(self.i_alpha[node_name]) < 1e-5
+                    and self.node_coef == 1)
+
     def get_varnode_extra_term(self, node_name):
         """
         Norm-Product Belief Propagation, n_{i -> alpha} second term
         This term is always 1 in stardard bp
+
+        The dense term is only kept for edges with :meth:`has_extra_term`,
+        otherwise the scalar one is returned and broadcasting does the rest
         """
-        if node_name not in self.last_innerparenthese_msg:
+        if node_name not in self.i_alpha:
             raise RuntimeError(
-                f"{node_name} do not have previous msg sent by {self.name}")
+                f"{node_name} is not connected to {self.name}")
 
-        if abs(self.i_alpha[node_name]) < 1e-5 and self.node_coef == 1:
-            return np.ones_like(
-                self.last_innerparenthese_msg[node_name])
+        if not self.has_extra_term(node_name) or \
+                node_name not in self.last_innerparenthese_msg:
+            return 1.0
 
         # TODO when the a^x, a = 0, it has some problem
         coef_exp = -1.0 * \
@@ -100,53 +167,113 @@ class FactorNode(BaseNode):
         value = np.power(base, coef_exp)
         return value
 
+    def message_term(self, message):
+        """rank-1 message of a variable node times its extra term,
+        broadcastable against the potential, or gathered on the stored
+        entries of a sparse potential
+        """
+        sender_name = message.sender.name
+        axis = self.connections.index(sender_name)
+        if self.issparse:
+            val = message.val[self.pattern[axis]]
+        else:
+            shape = [1] * self.potential.ndim
+            shape[axis] = message.val.shape[0]
+            val = message.val.reshape(shape)
+        return val * self.get_varnode_extra_term(sender_name)
+
     def make_message(self, recipient_node):
         assert recipient_node.name in self.connections
         if len(self.connections) == 1:
-            self.last_innerparenthese_msg[recipient_node.name] = self.potential
+            if self.has_extra_term(recipient_node.name):
+                self.last_innerparenthese_msg[recipient_node.name] = \
+                    self.potential
             return self.summation(self.potential, recipient_node)
 
         product_out = self.cal_inner_parentheses(recipient_node)
+        return self._sum_inner_parentheses(product_out, recipient_node)
 
+    def _sum_inner_parentheses(self, product_out, recipient_node):
         with np.errstate(divide='raise'):
             hat_c_ialpha = self.hat_c_ialpha[recipient_node.name]
-            log_media = 1.0 / hat_c_ialpha * \
-                np.log(np.clip(product_out, 1e-12, None))
-            product_out_power = np.exp(log_media)
-            return np.power(
-                self.summation(
-                    product_out_power,
-                    recipient_node),
-                hat_c_ialpha)
+            product_out_power = _clip_power(product_out, 1.0 / hat_c_ialpha)
+            if self.issparse:
+                axis = self.connections.index(recipient_node.name)
+                summation = np.bincount(
+                    self.pattern[axis], weights=product_out_power,
+                    minlength=recipient_node.rv_dim) + \
+                    self.missing[axis] * _clip_power(0.0, 1.0 / hat_c_ialpha)
+            else:
+                summation = self.summation(product_out_power, recipient_node)
+            return np.power(summation, hat_c_ialpha)
+
+    def make_messages(self):
+        """prefix and suffix products of the incoming messages give the inner
+        parentheses of every recipient with O(n) products instead of O(n^2)
+
+        Only used when no connection has an extra term, otherwise the
+        message of a recipient depends on the inner parentheses stored for
+        the previous ones and the messages are made one by one.
+        """
+        num_connection = len(self.connections)
+        if num_connection < 3 or any(self.has_extra_term(name)
+                                     for name in self.connections):
+            return super().make_messages()
+
+        terms = [1.0] * num_connection
+        for message in self.latest_message:
+            terms[self.connections.index(message.sender.name)] = \
+                self.message_term(message)
+        prefix = [self.potential]
+        for term in terms[:-1]:
+            prefix.append(prefix[-1] * term)
+
+        messages = {}
+        suffix = 1.0
+        for idx in reversed(range(num_connection)):
+            recipient_node = self.connected_nodes[self.connections[idx]]
+            messages[recipient_node.name] = self._sum_inner_parentheses(
+                prefix[idx] * suffix, recipient_node)
+            suffix = terms[idx] * suffix
+        return messages
 
     def cal_bethe(self, margin):
+        if self.issparse:
+            margin = sparse.csr_matrix(margin)
+            margin.eliminate_zeros()
+            log_potential = self.potential.copy()
+            log_potential.data = np.log(
+                np.clip(log_potential.data, 1e-12, None))
+            return np.sum(margin.data * np.log(margin.data)) - \
+                margin.multiply(log_potential).sum()
         clip_potential = np.clip(self.potential, 1e-12, None)
         return np.sum(margin * np.log(margin / clip_potential))
 
     def marginal(self):
-        message_val = np.array([message.val for message in self.latest_message])
-        prod_messages = np.prod(message_val, axis=0)
-        product_out = np.multiply(self.potential, prod_messages)
+        product_out = self._values()
+        for message in self.latest_message:
+            product_out = product_out * self.message_term(message)
         unormalized = np.power(product_out, 1.0 / self.node_coef)
+        if self.issparse:
+            return self._on_pattern(unormalized / np.sum(unormalized))
         return unormalized / np.sum(unormalized)
 
     def cal_inner_parentheses(self, recipient_node):
-        latest_message = self.latest_message
-        filtered_message = [message for message in latest_message
-                            if not message.sender.name == recipient_node.name]
+        product_out = self._values()
+        for message in self.latest_message:
+            if message.sender.name != recipient_node.name:
+                product_out = product_out * self.message_term(message)
 
-        message_val = np.array([message.val for message in filtered_message])
-
-        prod_messages = np.prod(message_val, axis=0)
-
-        product_out = np.multiply(self.potential, prod_messages)
-        self.last_innerparenthese_msg[recipient_node.name] = product_out
+        if self.has_extra_term(recipient_node.name):
+            self.last_innerparenthese_msg[recipient_node.name] = product_out
         return product_out
 
     def store_message(self, message):
-        assert message.val.shape == self.potential.shape, \
+        which_dim = self.connections.index(message.sender.name)
+        expected_shape = (self.potential.shape[which_dim],)
+        assert message.val.shape == expected_shape, \
             f"From {message.sender.name} to {self.name} shape mismatch, \
-                expected {self.potential.shape}, received {message.val.shape}"
+                expected {expected_shape}, received {message.val.shape}"
         super().store_message(message)
 
     def reformat_message(self, message):
@@ -160,5 +287,7 @@ class FactorNode(BaseNode):
         potential_dim = potential.shape
         node_index = self.connections.index(node.name)
         assert potential_dim[node_index] == node.rv_dim
+        if sparse.issparse(potential):
+            return np.asarray(potential.sum(axis=1 - node_index)).ravel()
         return potential.sum(
             tuple(j for j in range(potential.ndim) if j != node_index))
@@ -1,5 +1,4 @@
 import numpy as np
-from cbp.utils.np_utils import nd_expand
 
 from .base_node import BaseNode
 
@@ -18,14 +17,26 @@ class VarNode(BaseNode):
         self.hat_c_i = None
         super().__init__(node_coef, potential)
 
-        if constrained_marginal is None:
-            self.isconstrained = False
-        else:
-            assert constrained_marginal.shape[0] == rv_dim
-            assert abs(np.sum(constrained_marginal) - 1) < 1e-6
-            self.isconstrained = True
-            constrained_marginal = np.clip(constrained_marginal, 1e-12, None)
-        self.constrained_marginal = constrained_marginal
+        self.isconstrained = False
+        self.constrained_marginal = None
+        if constrained_marginal is not None:
+            self.set_constrained_marginal(constrained_marginal)
+
+    def set_constrained_marginal(self, constrained_marginal):
+        """fix the marginal of the node
+
+        :param constrained_marginal: shape ``(rv_dim,)``, or ``(B, rv_dim)``
+            for ``B`` evidence sets solved at once, see
+            :class:`~cbp.graph.batch_compiled_graph.BatchCompiledGraph`
+        :type constrained_marginal: ndarray
+        """
+        assert constrained_marginal.ndim in (1, 2)
+        assert constrained_marginal.shape[-1] == self.rv_dim
+        assert np.all(
+            np.abs(np.sum(constrained_marginal, axis=-1) - 1) < 1e-6)
+        self.isconstrained = True
+        self.constrained_marginal = np.clip(
+            constrained_marginal, 1e-12, None)
 
     def _check_potential(self, potential):
         if potential is None:
@@ -57,47 +68,64 @@ class VarNode(BaseNode):
         for item in self.connections:
             self.hat_c_i += self.connected_nodes[item].node_coef
 
-    def _make_message_first_term(self, recipient_node):
-        recipient_index_in_var = self.search_msg_index(self.latest_message,
-                                                       recipient_node.name)
+    def _log_numerator(self):
+        """log of the numerator shared by the messages to all factors"""
+        with np.errstate(divide='raise'):
+            if self.isconstrained:
+                return self.epsilon * np.log(self.constrained_marginal)
+            vals = [message.val for message in self.latest_message]
+            potential_part = 1.0 / self.hat_c_i * np.log(self.potential)
+            message_part = 1.0 / self.hat_c_i * \
+                np.log(np.clip(np.prod(vals, axis=0), 1e-12, None))
+            return potential_part + message_part
+
+    def _make_message_first_term(self, recipient_node, log_numerator=None):
+        if log_numerator is None:
+            log_numerator = self._log_numerator()
         hat_c_ialpha = recipient_node.get_hat_c_ialpha(self.name)
         c_alpha = recipient_node.node_coef
-        vals = [message.val for message in self.latest_message]
+        if recipient_node.name not in self.message_inbox:
+            raise RuntimeError(
+                f"{recipient_node.name} do not appear in {self.name} message")
 
         with np.errstate(divide='raise'):
-            if self.isconstrained:
-                log_numerator = self.epsilon * np.log(self.constrained_marginal)
-            else:
-                potential_part = 1.0 / self.hat_c_i * np.log(self.potential)
-                message_part = 1.0 / self.hat_c_i * \
-                    np.log(np.clip(np.prod(vals, axis=0), 1e-12, None))
-                log_numerator = potential_part + message_part
-            clip_base = np.clip(vals[recipient_index_in_var], 1e-12, None)
+            clip_base = np.clip(self.message_inbox[recipient_node.name].val,
+                                1e-12, None)
             log_denominator = 1.0 / hat_c_ialpha * np.log(clip_base)
 
             log_base = c_alpha * (log_numerator - log_denominator)
             return np.exp(log_base)
 
-    def make_message_bp(self, recipient_node):
+    def make_init_message(self, recipient_node_name):
+        if self.coef_ready:
+            return np.ones(self.rv_dim)
+
+        raise RuntimeError(
+            f"Need to call cal_cnp_coef first for {self.name}")
+
+    def make_message_bp(self, recipient_node, log_numerator=None):
+        """variable to factor message, kept as a rank-1 vector of length
+        ``rv_dim``. The norm-product extra term lives in the recipient factor,
+        see :meth:`~cbp.node.FactorNode.get_varnode_extra_term`
+        """
         assert self.coef_ready,\
             f"{self.name} need to cal_cnp_coef by graph firstly"
-        # first_term.shape equals (self.rv_dim,)
-        first_term = self._make_message_first_term(recipient_node)
+        first_term = self._make_message_first_term(recipient_node,
+                                                   log_numerator)
         assert first_term.shape[0] == self.rv_dim
-        # second_term shape equals shape of recipient_node
-        second_term = recipient_node.get_varnode_extra_term(self.name)
-        assert second_term.shape == self.connected_nodes[recipient_node.name].potential.shape
-
-        var_index_in_recipient = recipient_node.search_node_index(self.name)
-
-        expanded_first_term = nd_expand(
-            first_term, second_term.shape, var_index_in_recipient)
-
-        return np.multiply(expanded_first_term, second_term)
+        return first_term
 
     def make_message(self, recipient_node):
         return self.make_message_bp(recipient_node)
 
+    def make_messages(self):
+        """the product of all incoming messages is computed once and the
+        message of every recipient is divided out, O(n d) for n factors
+        """
+        log_numerator = self._log_numerator()
+        return {name: self.make_message_bp(node, log_numerator)
+                for name, node in self.connected_nodes.items()}
+
     def cal_bethe(self, margin):
         clip_margin = np.clip(margin, 1e-12, None)
         log_margin = np.log(clip_margin)
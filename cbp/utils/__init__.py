@@ -1,9 +1,18 @@
 from . import np_utils
+from .convergence_monitor import ConvergenceMonitor
 from .event_utils import compare_marginals, diff_max_marginals, engine_loop
+from .inference_result import InferenceResult
 from .message import Message
+from .message_arena import MessageArena
+from .message_store import MemmapStore, MemoryStore
 
 __all__ = [
     "Message",
+    "MessageArena",
+    "MemoryStore",
+    "MemmapStore",
+    "ConvergenceMonitor",
+    "InferenceResult",
     "np_utils",
     "engine_loop",
     "compare_marginals",
@@ -0,0 +1,138 @@
+import json
+import time
+
+import numpy as np
+from scipy import sparse
+
+
+class ConvergenceMonitor():  # pylint: disable=too-many-instance-attributes
+    """convergence check of an inference loop, see
+    :func:`~cbp.utils.event_utils.engine_loop`
+
+    The marginal dicts are stacked into one flat array and the distance of
+    two measurements is a segmented reduction of their absolute difference,
+    one L1 distance per key. Sparse marginals, e.g. of a factor with a sparse
+    potential, are stacked by their stored entries. The epsilons and the wall-clock of the last
+    ``history`` checks are kept in a ring buffer, every check can also be
+    streamed as one JSON line to ``telemetry``.
+
+    :param tolerance: converged once the epsilon is not above it, defaults to
+        1e-2
+    :type tolerance: float, optional
+    :param error_fun: ``"max"`` or ``"sum"`` of the L1 distance per key, or a
+        function of two marginal dicts, defaults to "max"
+    :type error_fun: str or func, optional
+    :param check_every: check every k steps, the epsilon is the distance
+        since the last check, defaults to 1
+    :type check_every: int, optional
+    :param history: size of the ring buffer, defaults to 10000
+    :type history: int, optional
+    :param telemetry: path of the JSONL file, defaults to None
+    :type telemetry: str, optional
+    :param residual_fun: when set, its return value is the epsilon and no
+        marginal is measured, e.g. the max message residual of
+        :class:`~cbp.graph.residual_schedule.ResidualScheduler`, defaults to
+        None
+    :type residual_fun: func, optional
+    """
+
+    def __init__(self, tolerance=1e-2, error_fun="max",  # pylint: disable=too-many-arguments
+                 check_every=1, history=10000, telemetry=None,
+                 residual_fun=None):
+        assert error_fun in ("max", "sum") or callable(error_fun)
+        self.tolerance = tolerance
+        self.error_fun = error_fun
+        self.check_every = check_every
+        self.history = np.zeros((history, 2))
+        self.num_check = 0
+        self.telemetry = telemetry
+        self.residual_fun = residual_fun
+        self.num_message = 0
+        self.__keys = None
+        self.__offsets = None
+        self.__last = None
+        self.__start = None
+        self.__file = None
+
+    def __stack(self, marginals):
+        if callable(self.error_fun):
+            return marginals
+        values = {key: marginal.data if sparse.issparse(marginal)
+                  else marginal for key, marginal in marginals.items()}
+        if self.__keys is None:
+            self.__keys = list(values)
+            sizes = [np.size(values[key]) for key in self.__keys]
+            self.__offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        assert values.keys() == set(self.__keys), \
+            "marginals of two checks have different keys"
+        return np.concatenate([np.ravel(values[key])
+                               for key in self.__keys])
+
+    def distance(self, cur, last):
+        if callable(self.error_fun):
+            return self.error_fun(cur, last)
+        per_key = np.add.reduceat(np.abs(cur - last), self.__offsets)
+        return np.max(per_key) if self.error_fun == "max" else np.sum(per_key)
+
+    def start(self, marginals=None):
+        """reset the history and measure the initial marginals"""
+        self.num_check = 0
+        self.num_message = 0
+        self.__keys = None
+        self.__start = time.time()
+        self.__last = None
+        if self.residual_fun is None:
+            self.__last = self.__stack(marginals)
+        if self.telemetry is not None:
+            self.__file = open(self.telemetry, "w")  # pylint: disable=consider-using-with
+
+    def due(self, step):
+        return step % self.check_every == 0
+
+    def check(self, step, marginals=None, num_message=None):
+        """record the epsilon of ``step``
+
+        :param marginals: measured marginals, not used with ``residual_fun``
+        :type marginals: dict, optional
+        :param num_message: messages sent since the last check
+        :type num_message: int, optional
+        :return: converged or not
+        :rtype: bool
+        """
+        if self.residual_fun is not None:
+            epsilon = float(self.residual_fun())
+        else:
+            cur = self.__stack(marginals)
+            epsilon = float(self.distance(cur, self.__last))
+            self.__last = cur
+        wall_time = time.time() - self.__start
+        self.history[self.num_check % len(self.history)] = epsilon, wall_time
+        self.num_check += 1
+        if num_message is not None:
+            self.num_message += num_message
+        if self.__file is not None:
+            self.__file.write(json.dumps({
+                "step": step, "epsilon": epsilon, "wall_time": wall_time,
+                "num_message": self.num_message}) + "\n")
+        return epsilon <= self.tolerance
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def __ordered(self, column):
+        num = min(self.num_check, len(self.history))
+        idx = np.arange(self.num_check - num, self.num_check) % \
+            len(self.history)
+        return list(self.history[idx, column])
+
+    @property
+    def epsilons(self):
+        """epsilons of the last ``history`` checks, oldest first"""
+        return self.__ordered(0)
+
+    @property
+    def timer_record(self):
+        """wall-clock of the last ``history`` checks, oldest first"""
+        return self.__ordered(1)
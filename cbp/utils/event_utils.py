@@ -2,6 +2,9 @@ import time
 
 import numpy as np
 
+from .convergence_monitor import ConvergenceMonitor
+from .inference_result import InferenceResult
+
 
 def engine_loop(  # pylint: disable=too-many-arguments
         engine_fun,
@@ -10,10 +13,13 @@ def engine_loop(  # pylint: disable=too-many-arguments
         error_fun=None,
         meassure_fun=None,
         isoutput=False,
-        silent=False):
+        silent=False,
+        monitor=None,
+        deadline=None):
     """work engine for loop
 
-    :param engine_fun: work function
+    :param engine_fun: work function, an int it returns is counted as the
+        number of messages sent
     :param max_iter: max iteration, defaults to 5000000
     :type max_iter: int, optional
     :param tolerance: less than tolerance, stop, defaults to 1e-2
@@ -26,43 +32,59 @@ def engine_loop(  # pylint: disable=too-many-arguments
     :type isoutput: bool, optional
     :param silent: output details, defaults to False
     :type silent: bool, optional
+    :param monitor: convergence check, ``tolerance`` and ``error_fun`` are
+        ignored when given, defaults to None
+    :type monitor: ConvergenceMonitor, optional
+    :param deadline: wall-clock budget in seconds, checked after every step,
+        defaults to None
+    :type deadline: float, optional
     :return: list of relative distance, num of running iteration, timers
+    :rtype: InferenceResult
     """
-    check_step = 1
-    epsilons = [np.inf] * check_step
+    if monitor is None:
+        monitor = ConvergenceMonitor(
+            tolerance=tolerance,
+            error_fun={diff_max_marginals: "max", compare_marginals: "sum",
+                       None: "max"}.get(error_fun, error_fun))
     start = time.time()
-    timer_record = []
-    step = 0
-    cur_marginals = meassure_fun()
-
-    while (step < max_iter) and any(
-            tolerance < np.array(epsilons[-check_step:])):
-        last_marginals = cur_marginals
-        step += 1
-
-        engine_fun()
-        cur_marginals = meassure_fun()
-        epsilons.append(error_fun(cur_marginals, last_marginals))
-
-        timer_record.append(time.time() - start)
-        if not silent:
-            print(
-                f"epsilon: {epsilons[-1]:5.4f} | step: {step:5d} {'-'*10}")
-            print(cur_marginals)
-            print(last_marginals)
-            print(epsilons)
-        if isoutput:
-            print(f'step: {step:5d} | verobose output {epsilons[-1]}')
+    step, num_message = 0, 0
+    converged, timed_out = False, False
+    monitor.start(None if monitor.residual_fun else meassure_fun())
+    try:
+        while step < max_iter:
+            step += 1
+            sent = engine_fun()
+            if isinstance(sent, int):
+                num_message += sent
+            if monitor.due(step):
+                converged = monitor.check(
+                    step,
+                    None if monitor.residual_fun else meassure_fun(),
+                    num_message)
+                num_message = 0
+                if not silent or isoutput:
+                    print(f"epsilon: {monitor.epsilons[-1]:5.4f} | "
+                          f"step: {step:5d} {'-'*10}")
+                if converged:
+                    break
+            if deadline is not None and time.time() - start >= deadline:
+                timed_out = True
+                break
+    finally:
+        monitor.close()
 
-    return epsilons[check_step:], step, timer_record
+    residual = monitor.epsilons[-1] if monitor.num_check else np.inf
+    return InferenceResult((monitor.epsilons, step, monitor.timer_record),
+                           converged=converged, timed_out=timed_out,
+                           residual=residual)
 
 
 def compare_marginals(mar_1, mar_2):
-    assert np.setdiff1d(mar_1.keys(), mar_2.keys()).size == 0
+    assert mar_1.keys() == mar_2.keys()
     return sum([np.sum(np.absolute(mar_1[k] - mar_2[k])) for k in mar_1.keys()])
 
 
 def diff_max_marginals(mar_1, mar_2):
-    assert np.setdiff1d(mar_1.keys(), mar_2.keys()).size == 0
+    assert mar_1.keys() == mar_2.keys()
     return np.max([np.sum(np.absolute(mar_1[k] - mar_2[k]))
                    for k in mar_1.keys()])
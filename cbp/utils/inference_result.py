@@ -0,0 +1,43 @@
+import numpy as np
+
+
+class InferenceResult(tuple):
+    """result of an inference loop, unpacks like the plain tuple the loops
+    returned before, e.g. ``epsilons, step = graph.run_bp()``
+
+    Add new attr:
+        * ``converged`` the last epsilon is not above the tolerance
+        * ``timed_out`` stopped by the wall-clock ``deadline``
+        * ``residual`` last epsilon, inf if never checked
+        * ``marginals`` marginals at return, the latest are the best so far
+        * ``violation`` max L1 distance between a constrained marginal and
+          the marginal the inference gives it, None without constraint
+    """
+
+    def __new__(cls, values, converged=False,  # pylint: disable=too-many-arguments
+                timed_out=False, residual=np.inf, marginals=None,
+                violation=None):
+        obj = super().__new__(cls, values)
+        obj.converged = converged
+        obj.timed_out = timed_out
+        obj.residual = residual
+        obj.marginals = marginals
+        obj.violation = violation
+        return obj
+
+    @property
+    def epsilons(self):
+        return self[0]
+
+    @property
+    def step(self):
+        return self[1]
+
+    def replace(self, values=None, **kwargs):
+        """copy with other values or attributes"""
+        attrs = {"converged": self.converged, "timed_out": self.timed_out,
+                 "residual": self.residual, "marginals": self.marginals,
+                 "violation": self.violation}
+        attrs.update(kwargs)
+        return InferenceResult(tuple(self) if values is None else values,
+                               **attrs)
@@ -0,0 +1,120 @@
+import numpy as np
+
+
+class MessageBank():  # pylint: disable=too-few-public-methods
+    """one bank of the arena, every group is a list of views, one per slot,
+    ``flat`` is the whole bank for gathers with absolute slot offsets
+    """
+
+    def __init__(self, flat, views):
+        self.flat = flat
+        self.groups = views
+        for name, group in views.items():
+            setattr(self, name, group)
+
+
+class MessageArena():
+    """Preallocated contiguous storage for all messages of a graph
+
+    All slots of all groups live in a single float buffer of shape
+    ``(num_bank, size)``. The messages are exposed as views, updates are done
+    in place and no memory is allocated after construction. With two banks
+    the arena is double buffered: schedules read the ``front`` bank, write
+    the ``back`` bank and call :meth:`swap` once per sweep.
+
+    :param groups: group name -> list of slot shapes
+    :type groups: dict
+    :param num_bank: number of banks, defaults to 2
+    :type num_bank: int, optional
+    :param buffer: storage of shape ``(num_bank, size)``, allocated when None
+    :type buffer: ndarray, optional
+    :param store: allocates the buffer, e.g. a
+        :class:`~cbp.utils.message_store.MemmapStore`, the buffer is released
+        at every :meth:`swap` when a bank is larger than its memory budget,
+        defaults to None
+    :type store: ~cbp.utils.message_store.MemoryStore, optional
+    """
+
+    def __init__(self, groups, num_bank=2, buffer=None, store=None):
+        self.shapes = {name: [tuple(shape) for shape in shapes]
+                       for name, shapes in groups.items()}
+        self.offsets = {}
+        size = 0
+        for name, shapes in self.shapes.items():
+            ptr = np.zeros(len(shapes) + 1, dtype=int)
+            ptr[1:] = np.cumsum([int(np.prod(shape)) for shape in shapes])
+            self.offsets[name] = ptr + size
+            size += int(ptr[-1])
+        self.size = size
+        self.num_bank = num_bank
+
+        self.store = store
+        if buffer is None:
+            buffer = np.empty((num_bank, size)) if store is None \
+                else store.empty((num_bank, size))
+        assert buffer.shape == (num_bank, size), \
+            f"arena buffer needs shape {(num_bank, size)}, got {buffer.shape}"
+        self.buffer = buffer
+        self.banks = [self.__make_bank(self.buffer[i])
+                      for i in range(num_bank)]
+        self._front = 0
+
+    def __make_bank(self, flat):
+        views = {}
+        for name, shapes in self.shapes.items():
+            ptr = self.offsets[name]
+            views[name] = [flat[begin:end].reshape(shape) for begin, end, shape
+                           in zip(ptr[:-1], ptr[1:], shapes)]
+        return MessageBank(flat, views)
+
+    @property
+    def front(self):
+        return self.banks[self._front]
+
+    @property
+    def back(self):
+        return self.banks[(self._front + 1) % self.num_bank]
+
+    @property
+    def front_index(self):
+        return self._front
+
+    def swap(self):
+        """exchange front and back bank, O(1)"""
+        self._front = (self._front + 1) % self.num_bank
+        if self.store is not None:
+            window = self.store.window(self.buffer[0].nbytes)
+            if window is not None and window < self.num_bank:
+                self.store.release(self.buffer)
+
+    def fill(self, value, bank=None):
+        if bank is None:
+            self.buffer.fill(value)
+        else:
+            self.buffer[bank].fill(value)
+
+    def copy_front_to_back(self):
+        back = (self._front + 1) % self.num_bank
+        np.copyto(self.buffer[back], self.buffer[self._front])
+
+    def slot_index(self, name, slots):
+        """absolute indices of equally sized ``slots`` of group ``name``,
+        shape ``(len(slots), slot_size)``, for gathers/scatters on
+        ``bank.flat``
+        """
+        ptr = self.offsets[name]
+        slots = np.asarray(slots, dtype=int)
+        size = ptr[slots + 1] - ptr[slots]
+        assert np.all(size == size[0]), "slots need the same size"
+        return ptr[slots][:, None] + np.arange(size[0])
+
+    def group(self, name, bank=None):
+        """flat view of one group, e.g. for residuals over all slots"""
+        if bank is None:
+            bank = self._front
+        ptr = self.offsets[name]
+        return self.buffer[bank, ptr[0]:ptr[-1]]
+
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes
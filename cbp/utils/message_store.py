@@ -0,0 +1,114 @@
+import mmap
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class MemoryStore():
+    """in-memory storage of message arrays, the default of
+    :class:`~cbp.graph.chain_engine.ChainEngine` and
+    :class:`~cbp.utils.message_arena.MessageArena`
+    """
+
+    def empty(self, shape):
+        return np.empty(shape)
+
+    def full(self, shape, value):
+        return np.full(shape, value, dtype=float)
+
+    def window(self, row_bytes):  # pylint: disable=unused-argument
+        """rows of ``row_bytes`` to keep resident at a time, None for all"""
+        return None
+
+    def release(self, array, low=0, high=None):
+        """rows ``[low, high)`` of ``array`` may leave memory"""
+
+    def close(self):
+        pass
+
+
+class MemmapStore(MemoryStore):
+    """message arrays backed by files mapped with ``mmap``, for chains
+    whose messages do not fit in memory
+
+    The sweeps of the chain engine go through the rows in order and release
+    the rows they are done with: the dirty pages are written back and
+    dropped with ``madvise(MADV_DONTNEED)``, so only a window of about
+    ``memory_budget`` bytes stays resident. A compiled graph with its arena
+    in the store releases the whole arena after every sweep when the arena
+    is larger than the budget.
+
+    :param directory: where the files live, a temporary directory removed by
+        :meth:`close` when None, defaults to None
+    :type directory: str, optional
+    :param memory_budget: bytes of messages to keep resident, defaults to
+        256 MiB
+    :type memory_budget: int, optional
+    """
+
+    def __init__(self, directory=None, memory_budget=256 * 2 ** 20):
+        self.owned = directory is None
+        self.directory = tempfile.mkdtemp(prefix="cbp_messages_") \
+            if directory is None else directory
+        self.memory_budget = memory_budget
+        self.maps = {}
+        self.cnt = 0
+
+    def empty(self, shape):
+        size = max(int(np.prod(shape)) * 8, 1)
+        path = os.path.join(self.directory, f"messages_{self.cnt:04d}.bin")
+        self.cnt += 1
+        with open(path, "w+b") as file:
+            file.truncate(size)
+            buffer = mmap.mmap(file.fileno(), size)
+        array = np.ndarray(shape, dtype=float, buffer=buffer)
+        self.maps[id(array)] = (buffer, path)
+        return array
+
+    def full(self, shape, value):
+        array = self.empty(shape)
+        step = self.window(array[0].nbytes if len(shape) > 1 else 8) or \
+            len(array)
+        for low in range(0, len(array), step):
+            array[low:low + step] = value
+            self.release(array, low, low + step)
+        return array
+
+    def window(self, row_bytes):
+        return max(1, self.memory_budget // max(row_bytes, 1))
+
+    def release(self, array, low=0, high=None):
+        if id(array) not in self.maps:
+            return
+        buffer, _ = self.maps[id(array)]
+        row_bytes = array.nbytes // max(len(array), 1)
+        high = len(array) if high is None else min(high, len(array))
+        begin = low * row_bytes // mmap.PAGESIZE * mmap.PAGESIZE
+        end = high * row_bytes
+        if end <= begin:
+            return
+        buffer.flush(begin, end - begin)
+        if hasattr(buffer, "madvise"):
+            buffer.madvise(mmap.MADV_DONTNEED, begin, end - begin)
+
+    @property
+    def nbytes(self):
+        """bytes of all files"""
+        return sum(os.path.getsize(path) for _, path in self.maps.values())
+
+    def close(self):
+        """unmap and delete the files, arrays of the store must not be used
+        any more
+        """
+        for buffer, path in self.maps.values():
+            try:
+                buffer.close()
+            except BufferError:
+                pass
+            if os.path.exists(path):
+                os.remove(path)
+        self.maps = {}
+        if self.owned:
+            shutil.rmtree(self.directory, ignore_errors=True)
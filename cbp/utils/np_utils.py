@@ -3,20 +3,24 @@ from numba import njit
 
 
 def nd_multiexpand(input_data, target_shape, which_dims):
+    """broadcast ``input_data`` to ``target_shape``, its i-th axis becomes the
+    ``which_dims[i]`` axis of the output
+
+    :return: read-only broadcasting view, nothing is copied
+    :rtype: ndarray
+    """
     init_shape = [1] * len(target_shape)
-    expand_shape = list(target_shape)
     for i, cur_dim in enumerate(which_dims):
         assert input_data.shape[i] == target_shape[cur_dim]
         init_shape[cur_dim] = target_shape[cur_dim]
-        expand_shape[cur_dim] = 1
 
-    out = input_data.reshape(tuple(init_shape))
-    return np.tile(out, tuple(expand_shape))
+    out = np.transpose(input_data, np.argsort(which_dims))
+    return np.broadcast_to(out.reshape(init_shape), tuple(target_shape))
 
 
-@njit
 def nd_expand(inputdata, target_shape, expand_dim):
-    """expand ndarray to target shape
+    """expand ndarray to target shape, a read-only broadcasting view of
+    ``inputdata``, nothing is copied
 
     :param inputdata:
     :type inputdata: list or 1d ndarray
@@ -35,14 +39,13 @@ def nd_expand(inputdata, target_shape, expand_dim):
                 [2,2,2]
             ])
     """
+    inputdata = np.asarray(inputdata)
     assert inputdata.ndim == 1
-    rtn = np.zeros(target_shape)
-    for idx in np.ndindex(target_shape):
-        rtn[idx] = inputdata[idx[expand_dim]]
-    return rtn
+    shape = [1] * len(target_shape)
+    shape[expand_dim] = -1
+    return np.broadcast_to(inputdata.reshape(shape), tuple(target_shape))
 
 
-@njit
 def reduction_ndarray(ndarray, reduction_index):
     """reduct ndarray according to one index
 
@@ -53,10 +56,57 @@ def reduction_ndarray(ndarray, reduction_index):
     :return: [description]
     :rtype: ndarray
     """
-    rtn = np.zeros(ndarray.shape[reduction_index])
-    for idx, value in np.ndenumerate(ndarray):
-        rtn[idx[reduction_index]] += value
-    return rtn
+    return np.sum(ndarray, axis=tuple(
+        j for j in range(ndarray.ndim) if j != reduction_index))
+
+
+def reduction_all(ndarray, scopes=()):
+    """every single axis marginal of ``ndarray`` with an axis-sum tree
+
+    The axes are split in two halves, the tensor is summed over each half and
+    both halves are reduced recursively, so only the first split reads the
+    whole tensor, twice, instead of once per axis.
+
+    :param ndarray: [description]
+    :type ndarray: ndarray
+    :param scopes: tuples of axes, their marginals are kept as well with the
+        axes in the given order, defaults to ()
+    :type scopes: list, optional
+    :return: one marginal per axis, or the axis marginals and one marginal
+        per scope when ``scopes`` is given
+    :rtype: list or tuple
+    """
+    marginals = [None] * ndarray.ndim
+    scope_marginals = [None] * len(scopes)
+    stack = [(ndarray, tuple(range(ndarray.ndim)),
+              [(idx, scope) for idx, scope in enumerate(scopes)
+               if len(scope) > 1])]
+    while stack:
+        tensor, axes, todo = stack.pop()
+        if len(axes) == 1:
+            marginals[axes[0]] = tensor
+            continue
+        halves = (axes[:len(axes) // 2], axes[len(axes) // 2:])
+        for half, other in (halves, halves[::-1]):
+            stack.append((
+                np.sum(tensor, axis=tuple(axes.index(axis) for axis in other)),
+                half,
+                [(idx, scope) for idx, scope in todo
+                 if set(scope) <= set(half)]))
+        for idx, scope in todo:
+            if not any(set(scope) <= set(half) for half in halves):
+                kept = [axis for axis in axes if axis in scope]
+                scope_marginals[idx] = np.transpose(
+                    np.sum(tensor, axis=tuple(
+                        j for j, axis in enumerate(axes) if axis not in scope)),
+                    [kept.index(axis) for axis in scope])
+
+    if not scopes:
+        return marginals
+    for idx, scope in enumerate(scopes):
+        if len(scope) == 1:
+            scope_marginals[idx] = marginals[scope[0]]
+    return marginals, scope_marginals
 
 
 @njit
@@ -67,10 +117,17 @@ def batch_normal_angle(angle):
 
 
 def empirical_marginal(traj, num_bins):
-    marginal = []
-    for i in range(traj.shape[1]):
-        bins, _ = np.histogram(
-            traj[:, i], np.arange(num_bins + 1))
-        marginal.append(bins / np.sum(bins))
+    """frequency of every integer state in every column of ``traj``, counted
+    in one pass with ``np.bincount``, states outside ``[0, num_bins)`` are
+    dropped
 
-    return np.array(marginal).reshape(traj.shape[1], num_bins)
+    :return: shape ``(traj.shape[1], num_bins)``
+    :rtype: ndarray
+    """
+    traj = np.asarray(traj, dtype=int)
+    offset = np.arange(traj.shape[1]) * num_bins
+    valid = (traj >= 0) & (traj < num_bins)
+    bins = np.bincount((traj + offset)[valid],
+                       minlength=traj.shape[1] * num_bins)
+    bins = bins.reshape(traj.shape[1], num_bins)
+    return bins / np.sum(bins, axis=1, keepdims=True)
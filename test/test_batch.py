@@ -0,0 +1,54 @@
+import unittest
+
+import numpy as np
+from cbp.builder import HMMBuilder
+from cbp.graph.coef_policy import bp_policy
+
+
+def constrained_names(graph):
+    return [name for name, node in graph.varnode_recorder.items()
+            if node.isconstrained]
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.graph = HMMBuilder(4, 3, bp_policy)()
+        self.mus = {name: rng.dirichlet(np.ones(3), size=5)
+                    for name in constrained_names(self.graph)}
+
+    def set_evidence(self, idx=None):
+        for name, mu in self.mus.items():
+            self.graph.set_node(
+                name, constrained_marginal=mu if idx is None else mu[idx])
+
+    def test_batch_equal_separate(self):
+        for method in ["run_bp", "run_cnp"]:
+            self.set_evidence()
+            getattr(self.graph, method)()
+            batch = self.graph.export_marginals()
+            batch_step = self.graph.compiled_graph.batch_step
+            self.assertEqual(batch["VarNode_000"].shape, (5, 3))
+            self.assertTrue(np.all(batch_step > 0))
+            for idx in range(5):
+                self.set_evidence(idx)
+                getattr(self.graph, method)()
+                for name, marginal in self.graph.export_marginals().items():
+                    self.assertTrue(np.allclose(
+                        batch[name][idx], marginal, atol=1e-4))
+
+    def test_masked_rows_frozen(self):
+        self.set_evidence()
+        self.graph.bake()
+        compiled = self.graph.compiled_graph
+        compiled.init_messages()
+        compiled.parallel_message()
+        before = self.graph.export_marginals()
+        compiled.set_active(np.array([True, False, True, False, False]))
+        compiled.parallel_message()
+        after = self.graph.export_marginals()
+        for name in before:
+            self.assertTrue(np.array_equal(before[name][1], after[name][1]))
+            self.assertTrue(np.array_equal(before[name][3:], after[name][3:]))
+        self.assertFalse(all(np.array_equal(before[name][0], after[name][0])
+                             for name in before))
@@ -0,0 +1,78 @@
+import unittest
+
+import numpy as np
+from cbp.builder import HMMBuilder, HMMSimBuilder, MigrSimulator
+from cbp.graph.chain_engine import ChainEngine
+from cbp.graph.chain_scan import prefix_product
+from cbp.graph.coef_policy import bp_policy
+
+from .utils import random_tree
+
+
+def max_diff(mar_1, mar_2):
+    assert mar_1.keys() == mar_2.keys()
+    return max(np.max(np.abs(mar_1[k] - mar_2[k])) for k in mar_1)
+
+
+class TestChainEngine(unittest.TestCase):
+    def test_equal_generic(self):
+        graph = HMMBuilder(20, 3, bp_policy)()
+        rtn = ChainEngine.from_graph(graph).run(tolerance=1e-10)
+        self.assertTrue(rtn.converged)
+        self.assertLess(rtn.violation, 1e-8)
+        graph.bake()
+        graph.itsbp(tolerance=1e-10)
+        self.assertLess(max_diff(graph.export_marginals(), rtn.marginals),
+                        1e-8)
+
+    def test_simulator(self):
+        sim = MigrSimulator(12, 3, 3, 1)
+        sim.compile()
+        sim.sample(100)
+        builder = HMMSimBuilder(12, sim, bp_policy)
+        graph = builder()
+        builder.fix_initpotential()
+
+        engine = ChainEngine.from_graph(graph)
+        self.assertEqual(engine.transition.shape, (9, 9))
+        self.assertEqual(engine.emission.shape, (9, 9))
+        rtn = engine.run(tolerance=1e-10)
+        graph.run_bp()
+        self.assertLess(max_diff(graph.export_marginals(), rtn.marginals),
+                        1e-6)
+
+        hidden, _ = ChainEngine.from_simulator(
+            sim, fix_initpotential=True).run(tolerance=1e-10).marginals
+        self.assertTrue(np.allclose(
+            hidden, [rtn.marginals[name] for name in engine.names[0]]))
+
+    def test_not_chain(self):
+        with self.assertRaises(ValueError):
+            ChainEngine.from_graph(random_tree(10, seed=1))
+
+    def test_prefix_product(self):
+        operators = np.random.RandomState(1).rand(7, 3, 3)
+        product = np.eye(3)
+        for operator, prefix in zip(operators, prefix_product(operators)):
+            product = product @ operator
+            self.assertTrue(np.allclose(prefix, product / np.sum(product)))
+
+    def test_scan(self):
+        graph = HMMBuilder(40, 4, bp_policy)()
+        graph.varnode_recorder["VarNode_000"].potential = np.arange(1., 5.)
+        engine = ChainEngine.from_graph(graph)
+        engine.run(max_iter=3)
+        expected = engine.forward_backward().copy()
+        for num_worker in [1, 3]:
+            self.assertTrue(np.allclose(
+                engine.forward_backward("scan", num_worker), expected))
+
+        rng = np.random.RandomState(2)
+        engine = ChainEngine(rng.rand(3, 3), rng.rand(3, 2),
+                             rng.dirichlet(np.ones(2), size=600))
+        engine.sweep()
+        expected = engine.forward_backward().copy()
+        self.assertTrue(np.allclose(engine.forward_backward("scan", 2),
+                                    expected))
+        with self.assertRaises(ValueError):
+            engine.forward_backward("random")
@@ -33,3 +33,20 @@ class TestGraph(unittest.TestCase):
                 self.graph.run_cnp()
                 self.graph.sinkhorn()
                 self.assertTrue(all(sinkhorn_bp_equal(self.graph, num_node)))
+
+    def test_residual_schedule(self):
+        marginals = []
+        for schedule in ["parallel", "residual"]:
+            self.graph = HMMBuilder(4, 4, bp_policy)()
+            self.graph.run_cnp(schedule=schedule)
+            stats = self.graph.schedule_stats
+            self.assertEqual(stats["schedule"], schedule)
+            self.assertGreater(stats["num_message"], 0)
+            marginals.append(np.concatenate(
+                list(self.graph.export_marginals().values())))
+        self.assertTrue(np.allclose(marginals[0], marginals[1], atol=1e-3))
+        self.graph.sinkhorn()
+        self.assertTrue(all(sinkhorn_bp_equal(self.graph, 4)))
+
+        with self.assertRaises(ValueError):
+            self.graph.run_cnp(schedule="random")
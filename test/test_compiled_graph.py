@@ -0,0 +1,100 @@
+import unittest
+
+import numpy as np
+from cbp.builder import HMMBuilder, StarBuilder
+from cbp.configs import BaseConfig
+from cbp.graph.coef_policy import avg_policy, bp_policy
+
+from .utils import random_tree, six_node_graph, two_node_tree
+
+
+def all_marginals(graph):
+    return np.concatenate([node.marginal().ravel() for node in graph.nodes])
+
+
+class TestCompiledGraph(unittest.TestCase):
+    def test_topology(self):
+        graph = six_node_graph()
+        graph.cfg = BaseConfig(compiled=True)
+        graph.bake()
+        compiled = graph.compiled_graph
+        self.assertEqual(compiled.num_edge, 10)
+        self.assertEqual(list(compiled.factor_ptr), [0, 2, 4, 6, 8, 10])
+        self.assertEqual(list(compiled.edge_var),
+                         [0, 1, 1, 2, 1, 3, 3, 4, 3, 5])
+        self.assertEqual(list(compiled.edge_axis), [0, 1] * 5)
+        self.assertEqual(list(compiled.var_edges(1)), [1, 2, 4])
+        self.assertEqual(list(compiled.hat_c_i), [1.0] * 6)
+        self.assertFalse(compiled.has_extra.any())
+
+    def test_not_compiled(self):
+        graph = two_node_tree()
+        graph.bake()
+        self.assertIsNone(graph.compiled_graph)
+
+    def test_tree_bp(self):
+        graph = six_node_graph()
+        graph.cfg = BaseConfig(compiled=True)
+        graph.tree_bp()
+        graph.exact_marginal()
+        for node in graph.varnode_recorder.values():
+            self.assertTrue(np.allclose(node.bfmarginal, node.marginal()))
+
+    def test_tree_bp_batched(self):
+        for policy in [bp_policy, avg_policy]:
+            rtn = []
+            for cfg in [BaseConfig(), BaseConfig(compiled=True),
+                        BaseConfig(log_domain=True)]:
+                graph = random_tree(30)
+                graph.cfg = cfg
+                graph.coef_policy = policy
+                graph.tree_bp()
+                rtn.append(all_marginals(graph))
+            self.assertTrue(np.allclose(rtn[0], rtn[1]))
+            self.assertTrue(np.allclose(rtn[0], rtn[2]))
+
+    def test_tree_schedule(self):
+        graph = six_node_graph()
+        graph.cfg = BaseConfig(compiled=True)
+        graph.bake()
+        schedule = graph.compiled_graph.tree_schedule("VarNode_005")
+        # every edge is sent once per direction
+        num_send = sum(len(batch.edges) for _, batch in schedule)
+        self.assertEqual(num_send, 2 * graph.compiled_graph.num_edge)
+        self.assertLess(len(schedule), num_send)
+        self.assertIs(schedule,
+                      graph.compiled_graph.tree_schedule("VarNode_005"))
+
+    def test_tree_bp_chain(self):
+        rtn = []
+        for compiled in [False, True]:
+            # deeper than the default recursion limit
+            graph = HMMBuilder(1500, 2, bp_policy)()
+            for name in list(graph.constrained_names):
+                graph.set_node(name, isconstrained=False)
+            graph.cfg = BaseConfig(compiled=compiled)
+            graph.tree_bp()
+            rtn.append(all_marginals(graph))
+        self.assertTrue(np.allclose(rtn[0], rtn[1]))
+
+    def _compare_engine(self, builder, method, policy):
+        rtn = []
+        for compiled in [False, True]:
+            graph = builder()
+            graph.cfg = BaseConfig(compiled=compiled)
+            graph.coef_policy = policy
+            getattr(graph, method)()
+            rtn.append(all_marginals(graph))
+        self.assertTrue(np.allclose(rtn[0], rtn[1]))
+
+    def test_same_as_nodes(self):
+        for policy in [bp_policy, avg_policy]:
+            for method in ["run_bp", "run_cnp"]:
+                self._compare_engine(
+                    lambda: HMMBuilder(4, 3, bp_policy)(), method, policy)
+            self._compare_engine(
+                lambda: StarBuilder(5, 3, bp_policy, 1)(), "run_bp", policy)
+
+
+if __name__ == '__main__':
+    unittest.main()
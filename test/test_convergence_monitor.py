@@ -0,0 +1,84 @@
+import json
+import time
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+from cbp.builder import HMMBuilder
+from cbp.graph.coef_policy import bp_policy
+from cbp.utils import (ConvergenceMonitor, compare_marginals,
+                       diff_max_marginals, engine_loop)
+
+
+class TestConvergenceMonitor(unittest.TestCase):
+    def test_stacked_distance(self):
+        mar_1 = {"a": np.array([0.5, 0.5]), "b": np.ones((2, 2)) / 4}
+        mar_2 = {"a": np.array([0.2, 0.8]), "b": np.eye(2) / 2}
+        for error_fun, expected in [("max", diff_max_marginals),
+                                    ("sum", compare_marginals)]:
+            monitor = ConvergenceMonitor(error_fun=error_fun)
+            monitor.start(mar_1)
+            monitor.check(1, mar_2)
+            self.assertAlmostEqual(monitor.epsilons[-1],
+                                   expected(mar_2, mar_1))
+        with self.assertRaises(AssertionError):
+            monitor.check(2, {"a": mar_1["a"], "c": mar_1["b"]})
+        with self.assertRaises(AssertionError):
+            compare_marginals(mar_1, {"a": mar_1["a"], "c": mar_1["b"]})
+
+    def test_history_and_telemetry(self):
+        values = iter(np.linspace(1, 0, 30))
+        with tempfile.TemporaryDirectory() as folder:
+            path = Path(folder) / "telemetry.jsonl"
+            monitor = ConvergenceMonitor(
+                tolerance=0.1, check_every=2, history=4, telemetry=path,
+                residual_fun=lambda: next(values))
+            epsilons, step, timer = engine_loop(
+                engine_fun=lambda: 3, max_iter=100, monitor=monitor,
+                silent=True)
+            lines = [json.loads(line)
+                     for line in path.read_text().splitlines()]
+        self.assertEqual(len(epsilons), 4)
+        self.assertEqual(len(timer), 4)
+        self.assertLessEqual(epsilons[-1], 0.1)
+        self.assertEqual(step, 2 * len(lines))
+        self.assertEqual([line["step"] for line in lines[:2]], [2, 4])
+        self.assertEqual(lines[-1]["num_message"], 3 * step)
+        self.assertEqual(epsilons, [line["epsilon"] for line in lines[-4:]])
+
+    def test_run_cnp(self):
+        rtn = []
+        for monitor in [None, ConvergenceMonitor(tolerance=1e-5)]:
+            graph = HMMBuilder(4, 3, bp_policy)()
+            graph.bake()
+            graph.norm_product_bp(monitor=monitor)
+            rtn.append(np.concatenate(list(graph.export_marginals().values())))
+        self.assertTrue(np.allclose(rtn[0], rtn[1]))
+
+    def test_deadline(self):
+        result = engine_loop(engine_fun=lambda: time.sleep(0.01),
+                             meassure_fun=lambda: {"a": np.random.rand(2)},
+                             tolerance=0, deadline=0.1, silent=True)
+        self.assertTrue(result.timed_out)
+        self.assertFalse(result.converged)
+        self.assertLess(result.step, 50)
+        epsilons, step, _ = result
+        self.assertEqual(step, result.step)
+        self.assertEqual(result.residual, epsilons[-1])
+
+        graph = HMMBuilder(20, 3, bp_policy)()
+        epsilons, step = result = graph.run_bp()
+        self.assertTrue(result.converged)
+        self.assertFalse(result.timed_out)
+        self.assertLess(result.violation, 1e-3)
+        self.assertEqual(set(result.marginals),
+                         set(graph.varnode_recorder))
+
+        result = graph.run_cnp(deadline=0.0)
+        self.assertTrue(result.timed_out)
+        self.assertEqual(result.step, 1)
+
+        result = graph.sinkhorn(method="tree", max_iter=2)
+        self.assertFalse(result.converged or result.timed_out)
+        self.assertGreater(result.violation, 0)
@@ -0,0 +1,54 @@
+import unittest
+
+import numpy as np
+from cbp.builder import HMMBuilder
+from cbp.graph.coef_policy import bp_policy
+from cbp.graph.domain_decomposition import DomainDecomposition, partition_tree
+
+from .utils import random_tree
+
+
+def max_diff(mar_1, mar_2):
+    assert mar_1.keys() == mar_2.keys()
+    return max(np.max(np.abs(mar_1[k] - mar_2[k])) for k in mar_1)
+
+
+def decomposition_marginals(graph, num_part):
+    decomposition = DomainDecomposition(graph, num_part)
+    try:
+        rtn = decomposition.run(tolerance=1e-8)
+    finally:
+        decomposition.close()
+    return rtn.marginals
+
+
+class TestDomainDecomposition(unittest.TestCase):
+    def test_partition(self):
+        graph = HMMBuilder(20, 3, bp_policy)()
+        part_of, separators = partition_tree(graph, 4)
+        self.assertEqual(set(part_of), set(graph.node_recorder))
+        self.assertEqual(len(separators), 3)
+        for name, child, parent in separators:
+            self.assertFalse(graph.varnode_recorder[name].isconstrained)
+            self.assertEqual(part_of[name], child)
+            self.assertNotEqual(child, parent)
+        sizes = np.bincount(list(part_of.values()))
+        self.assertLessEqual(np.max(sizes), 1.25 * len(part_of) / 4)
+
+    def test_equal_run_bp(self):
+        graph = HMMBuilder(12, 3, bp_policy)()
+        marginals = decomposition_marginals(graph, 3)
+        graph.bake()
+        graph.itsbp(tolerance=1e-10)
+        self.assertLess(max_diff(graph.export_marginals(), marginals), 1e-5)
+
+        graph = random_tree(40, seed=4)
+        rng = np.random.RandomState(4)
+        for name in ["VarNode_005", "VarNode_020", "VarNode_031"]:
+            dim = graph.varnode_recorder[name].rv_dim
+            graph.set_node(name, constrained_marginal=rng.dirichlet(
+                np.ones(dim)))
+        marginals = decomposition_marginals(graph, 3)
+        graph.bake()
+        graph.itsbp(tolerance=1e-10)
+        self.assertLess(max_diff(graph.export_marginals(), marginals), 1e-5)
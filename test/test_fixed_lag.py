@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+from cbp.builder import HMMBuilder
+from cbp.graph.chain_engine import ChainEngine
+from cbp.graph.coef_policy import bp_policy
+from cbp.graph.fixed_lag import FixedLagSmoother
+
+
+class TestFixedLag(unittest.TestCase):
+    def test_stream(self):
+        rng = np.random.RandomState(0)
+        transition, emission = rng.rand(4, 4) ** 3, rng.rand(4, 3) ** 3
+        mu = rng.dirichlet(np.ones(3), size=30)
+        potential = rng.rand(4)
+        engine = ChainEngine(transition, emission, mu, potential)
+        engine.run(tolerance=1e-10)
+
+        errors = []
+        for lag in [50, 10, 2]:
+            smoother = FixedLagSmoother(
+                ChainEngine(transition, emission, mu[:1], potential), lag,
+                tolerance=1e-10)
+            for step in range(1, 30):
+                smoother.step(mu[step])
+            self.assertEqual(smoother.engine.length, min(lag, 30))
+            marginals = smoother.hidden_marginals()
+            self.assertEqual(marginals.shape, (30, 4))
+            errors.append(np.max(np.abs(marginals - engine.hidden_marginal)))
+        self.assertLess(errors[0], 1e-8)
+        self.assertLess(errors[1], errors[2])
+
+        smoother = FixedLagSmoother(
+            ChainEngine(transition, emission, mu[:1]), 3, keep_history=False)
+        for step in range(1, 30):
+            smoother.step(mu[step])
+        self.assertEqual(len(smoother.history[0]), 0)
+        self.assertEqual(smoother.engine.offset, 27)
+
+    def test_graph(self):
+        graph = HMMBuilder(12, 3, bp_policy)()
+        engine = ChainEngine.from_graph(graph)
+        engine.run(tolerance=1e-10)
+        expected = engine.export_marginals()
+
+        builder = HMMBuilder(4, 3, bp_policy)
+        graph = builder()
+        smoother = FixedLagSmoother(ChainEngine.from_graph(graph), 20,
+                                    tolerance=1e-10)
+        for step in range(4, 12):
+            builder.step(step)
+            smoother.step_graph(graph, evict=True)
+        marginals = smoother.hidden_marginals()
+        self.assertEqual(len(marginals), 12)
+        for name, marginal in marginals.items():
+            self.assertTrue(np.allclose(marginal, expected[name]))
+        with self.assertRaises(ValueError):
+            smoother.step_graph(graph)
+
+        builder = HMMBuilder(4, 3, bp_policy)
+        graph = builder()
+        smoother = FixedLagSmoother(ChainEngine.from_graph(graph), 2)
+        for step in range(4, 12):
+            builder.step(step)
+            smoother.step_graph(graph, evict=True)
+        self.assertEqual(len(graph.varnode_recorder), 4)
+        self.assertEqual(len(smoother.hidden_marginals()), 12)
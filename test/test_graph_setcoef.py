@@ -1,6 +1,9 @@
 import unittest
 
+import numpy as np
+from cbp.builder import HMMBuilder
 from cbp.graph.coef_policy import avg_policy, bp_policy
+from cbp.node import FactorNode, VarNode
 
 from .utils import six_node_graph
 
@@ -47,3 +50,43 @@ class TestSetCNPCoef(unittest.TestCase):
             "FactorNode_002").get_hat_c_ialpha("VarNode_001"), 1)
         self.assertAlmostEqual(self.graph.get_node(
             "FactorNode_004").get_hat_c_ialpha("VarNode_005"), 1)
+
+    def test_factorised_messages(self):
+        self.graph.coef_policy = bp_policy
+        self.graph.run_bp()
+        for factor in self.graph.factornode_recorder.values():
+            self.assertEqual(factor.last_innerparenthese_msg, {})
+            for message in factor.latest_message:
+                self.assertEqual(message.val.shape,
+                                 (message.sender.rv_dim,))
+
+        graph = six_node_graph()
+        graph.coef_policy = avg_policy
+        graph.run_cnp()
+        factor = graph.get_node("FactorNode_000")
+        self.assertEqual(set(factor.last_innerparenthese_msg),
+                         {"VarNode_000", "VarNode_001"})
+        for message in factor.latest_message:
+            self.assertEqual(message.val.ndim, 1)
+
+    def test_traversal_cached(self):
+        self.graph.bake()
+        preorder, postorder = self.graph.traversal_order()
+        self.assertEqual(preorder[0][0].name, "VarNode_005")
+        self.assertEqual(postorder[-1][0].name, "VarNode_005")
+        self.assertEqual(len(preorder), len(self.graph.nodes))
+        self.graph.bake()
+        self.assertIs(self.graph.traversal_order()[0], preorder)
+
+        self.graph.add_varnode(VarNode(2))
+        self.graph.add_factornode(
+            FactorNode(["VarNode_005", "VarNode_006"], np.ones([2, 2])))
+        self.graph.bake()
+        preorder, _ = self.graph.traversal_order()
+        self.assertEqual(preorder[0][0].name, "VarNode_006")
+
+    def test_bake_long_chain(self):
+        graph = HMMBuilder(3000, 2, bp_policy)()
+        graph.bake()
+        self.assertAlmostEqual(
+            graph.get_node("VarNode_3000").node_coef, -2)
@@ -4,7 +4,8 @@ import timeit
 import numpy as np
 from cbp.builder import HMMBuilder, HMMZeroBuilder, LineBuilder
 from cbp.graph.coef_policy import bp_policy
-from cbp.configs import TestConfig
+from cbp.configs import BaseConfig, TestConfig
+from cbp.node import FactorNode, VarNode
 
 from test.utils import sinkhorn_bp_equal, two_node_tree
 
@@ -73,6 +74,37 @@ class TestITSbp(unittest.TestCase):
         self.assertEqual(list(reversed(next_links(graph))), TestITSbp.zero2one)
         self.assertEqual(next_links(graph), TestITSbp.zero2one)
 
+    def test_schedule_cycle(self):
+        graph = HMMBuilder(3, 2, bp_policy)()
+        graph.bake()
+        schedule = graph.get_its_schedule()
+        link_sends = sum(len(link) - 1 for link in [
+            TestITSbp.zero2one, TestITSbp.one2two, TestITSbp.two2zero])
+        self.assertEqual(schedule.num_send, [link_sends, link_sends])
+        self.assertEqual([schedule.next_sweep() for _ in range(4)],
+                         [0, 1, 1, 1])
+        # compiling leaves the live walk untouched
+        self.assertEqual(next_links(graph), TestITSbp.zero2one)
+
+        graph.cfg = TestConfig()
+        graph.bake()
+        self.assertGreater(len(graph.get_its_schedule().sweeps), 2)
+
+    def test_schedule_drop_sends(self):
+        results = []
+        for cfg in [BaseConfig(), BaseConfig(compiled=True)]:
+            graph = HMMBuilder(4, 3, bp_policy)()
+            graph.add_varnode(VarNode(3))
+            graph.add_factornode(FactorNode(
+                ["VarNode_002", "VarNode_008"], np.ones([3, 3])))
+            graph.cfg = cfg
+            graph.run_bp()
+            num_send = graph.its_schedule.num_send
+            # the sends leaving the unconstrained leaf are done once
+            self.assertLess(num_send[-1], num_send[0])
+            results.append(graph.get_node("VarNode_008").marginal())
+        self.assertTrue(np.allclose(results[0], results[1]))
+
     def _profile_hmm_schedule(self, cfg=None):
         rng = np.random.RandomState(1)
         for _ in range(10):
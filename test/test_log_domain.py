@@ -0,0 +1,56 @@
+import unittest
+
+import numpy as np
+from cbp.builder import HMMBuilder, HMMZeroBuilder
+from cbp.configs import BaseConfig
+from cbp.graph import LogCompiledGraph
+from cbp.graph.coef_policy import avg_policy, bp_policy
+
+from .utils import sinkhorn_bp_equal, six_node_graph
+
+
+def all_marginals(graph):
+    return np.concatenate([node.marginal().ravel() for node in graph.nodes])
+
+
+class TestLogDomain(unittest.TestCase):
+    def test_bake(self):
+        graph = six_node_graph()
+        graph.cfg = BaseConfig(log_domain=True)
+        graph.bake()
+        self.assertIsInstance(graph.compiled_graph, LogCompiledGraph)
+        self.assertTrue(np.allclose(graph.compiled_graph.f2v[0],
+                                    np.log(0.5)))
+
+    def test_tree_bp(self):
+        graph = six_node_graph()
+        graph.cfg = BaseConfig(log_domain=True)
+        graph.tree_bp()
+        graph.exact_marginal()
+        for node in graph.varnode_recorder.values():
+            self.assertTrue(np.allclose(node.bfmarginal, node.marginal()))
+
+    def test_same_as_linear(self):
+        for policy in [bp_policy, avg_policy]:
+            for method in ["run_bp", "run_cnp"]:
+                rtn = []
+                for cfg in [BaseConfig(compiled=True),
+                            BaseConfig(log_domain=True)]:
+                    graph = HMMBuilder(4, 3, bp_policy)()
+                    graph.cfg = cfg
+                    graph.coef_policy = policy
+                    getattr(graph, method)()
+                    rtn.append(all_marginals(graph))
+                self.assertTrue(np.allclose(rtn[0], rtn[1]))
+
+    def test_zero_potential(self):
+        graph = HMMZeroBuilder(3, 3, bp_policy)()
+        graph.cfg = BaseConfig(log_domain=True)
+        graph.coef_policy = avg_policy
+        graph.run_cnp()
+        graph.sinkhorn()
+        self.assertTrue(all(sinkhorn_bp_equal(graph, 3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
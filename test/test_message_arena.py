@@ -0,0 +1,70 @@
+import unittest
+
+import numpy as np
+from cbp.builder import HMMBuilder
+from cbp.configs import BaseConfig
+from cbp.graph.coef_policy import bp_policy
+from cbp.utils.message_arena import MessageArena
+
+
+class TestMessageArena(unittest.TestCase):
+    def setUp(self):
+        self.arena = MessageArena({"f2v": [(2,), (3,)], "inner": [(2, 3)]})
+
+    def test_layout(self):
+        self.assertEqual(self.arena.size, 11)
+        self.assertEqual(self.arena.buffer.shape, (2, 11))
+        self.assertEqual(list(self.arena.offsets["f2v"]), [0, 2, 5])
+        self.assertEqual(list(self.arena.offsets["inner"]), [5, 11])
+        self.assertEqual(self.arena.front.inner[0].shape, (2, 3))
+
+    def test_views_in_place(self):
+        self.arena.fill(0)
+        self.arena.front.f2v[1][:] = [1, 2, 3]
+        self.assertTrue(np.allclose(self.arena.buffer[0, 2:5], [1, 2, 3]))
+        self.assertTrue(np.allclose(self.arena.group("f2v"), [0, 0, 1, 2, 3]))
+        self.assertTrue(np.shares_memory(self.arena.front.f2v[1],
+                                         self.arena.buffer))
+
+    def test_swap(self):
+        self.arena.fill(0)
+        self.arena.front.f2v[0][:] = 1
+        front = self.arena.front
+        self.arena.swap()
+        self.assertIs(self.arena.back, front)
+        self.assertTrue(np.allclose(self.arena.front.f2v[0], 0))
+        self.arena.swap()
+        self.arena.copy_front_to_back()
+        self.assertTrue(np.allclose(self.arena.back.f2v[0], 1))
+
+    def test_compiled_no_reallocation(self):
+        graph = HMMBuilder(3, 3, bp_policy)()
+        graph.cfg = BaseConfig(compiled=True)
+        graph.bake()
+        compiled = graph.compiled_graph
+        buffer = compiled.arena.buffer
+        views = [id(view) for view in compiled.f2v]
+        compiled.parallel_message()
+        compiled.parallel_message()
+        self.assertIs(compiled.arena.buffer, buffer)
+        self.assertEqual([id(view) for view in compiled.f2v], views)
+
+    def test_flooding_same_fixed_point(self):
+        rtn = []
+        for flooding in [False, True]:
+            graph = HMMBuilder(4, 3, bp_policy)()
+            graph.cfg = BaseConfig(compiled=True)
+            graph.bake()
+            compiled = graph.compiled_graph
+            for _ in range(100):
+                if flooding:
+                    compiled.flooding_message()
+                else:
+                    compiled.parallel_message()
+            rtn.append(np.concatenate(
+                list(compiled.export_marginals().values())))
+        self.assertTrue(np.allclose(rtn[0], rtn[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import unittest
+
+import numpy as np
+from cbp.builder import HMMBuilder
+from cbp.configs import BaseConfig
+from cbp.graph.chain_engine import ChainEngine
+from cbp.graph.coef_policy import bp_policy
+from cbp.utils import MemmapStore
+
+from .utils import six_node_graph
+
+
+class TestMessageStore(unittest.TestCase):
+    def test_chain_engine(self):
+        rng = np.random.RandomState(1)
+        transition, emission = rng.rand(4, 4), rng.rand(4, 3)
+        observation = rng.dirichlet(np.ones(3), size=300)
+        expected = ChainEngine(transition, emission,
+                               observation).run(tolerance=1e-8)
+
+        store = MemmapStore(memory_budget=2048)
+        rtn = ChainEngine(transition, emission, observation,
+                          store=store).run(tolerance=1e-8)
+        self.assertGreater(store.nbytes, 0)
+        self.assertEqual(rtn[1], expected[1])
+        for memmap, memory in zip(rtn.marginals, expected.marginals):
+            self.assertTrue(np.allclose(memmap, memory))
+        directory = store.directory
+        store.close()
+        self.assertFalse(os.path.exists(directory))
+
+    def test_compiled_graph(self):
+        graph = six_node_graph()
+        graph.cfg = BaseConfig(compiled=True)
+        graph.bake()
+        graph.itsbp()
+        expected = graph.export_marginals()
+
+        store = MemmapStore(memory_budget=64)
+        graph = six_node_graph()
+        graph.cfg = BaseConfig(compiled=True, message_store=store)
+        graph.bake()
+        self.assertIn(id(graph.compiled_graph.arena.buffer), store.maps)
+        graph.itsbp()
+        for name, marginal in graph.export_marginals().items():
+            self.assertTrue(np.allclose(marginal, expected[name]))
+        store.close()
+
+    def test_hmm_parallel(self):
+        store = MemmapStore(memory_budget=64)
+        graph = HMMBuilder(15, 3, bp_policy)()
+        graph.cfg = BaseConfig(compiled=True, message_store=store)
+        graph.bake()
+        graph.parallel_message(run_constrained=False)
+        self.assertTrue(all(np.isfinite(marginal).all() for marginal
+                            in graph.export_marginals().values()))
+        store.close()
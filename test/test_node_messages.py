@@ -0,0 +1,66 @@
+import unittest
+
+import numpy as np
+from cbp.builder import StarBuilder
+from cbp.configs import BaseConfig
+from cbp.graph.coef_policy import avg_policy, bp_policy
+
+from .utils import random_tree
+
+
+class TestNodeMessages(unittest.TestCase):
+    def _check_node(self, node):
+        messages = node.make_messages()
+        for name, recipient in node.connected_nodes.items():
+            self.assertTrue(np.allclose(messages[name],
+                                        node.make_message(recipient)))
+
+    def test_var_messages(self):
+        graph = StarBuilder(20, 3, bp_policy, 1)()
+        graph.bake()
+        graph.first_belief_propagation()
+        graph.parallel_message()
+        hub = max(graph.varnode_recorder.values(),
+                  key=lambda node: len(node.connections))
+        self.assertEqual(len(hub.connections), 19)
+        self._check_node(hub)
+
+    def test_factor_messages(self):
+        graph = random_tree(12, 2)
+        graph.bake()
+        graph.first_belief_propagation()
+        for _ in range(2):
+            graph.parallel_message()
+        factors = [node for node in graph.factornode_recorder.values()
+                   if len(node.connections) == 3]
+        self.assertTrue(factors)
+        for node in factors:
+            self._check_node(node)
+
+    def test_compiled_factor_messages(self):
+        for cfg in [BaseConfig(compiled=True), BaseConfig(log_domain=True)]:
+            for policy in [bp_policy, avg_policy]:
+                graph = random_tree(25, 4)
+                graph.coef_policy = policy
+                graph.cfg = cfg
+                graph.bake()
+                compiled = graph.compiled_graph
+                for _ in range(3):
+                    compiled.parallel_message()
+
+                rtn = []
+                front, back = compiled.arena.front, compiled.arena.back
+                for per_factor in [True, False]:
+                    compiled.arena.copy_front_to_back()
+                    if per_factor:
+                        for factor in range(compiled.num_factor):
+                            compiled._factor_messages(factor, front, back)
+                    else:
+                        for edge in range(compiled.num_edge):
+                            compiled._factor_message(edge, front, back)
+                    rtn.append(back.flat.copy())
+                self.assertTrue(np.allclose(rtn[0], rtn[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
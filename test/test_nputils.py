@@ -1,7 +1,8 @@
 import unittest
 
 import numpy as np
-from cbp.utils.np_utils import nd_expand, nd_multiexpand
+from cbp.utils.np_utils import (empirical_marginal, nd_expand,
+                                nd_multiexpand, reduction_all)
 
 
 class TestNpUtils(unittest.TestCase):
@@ -28,3 +29,38 @@ class TestNpUtils(unittest.TestCase):
         ])
         equal = np.isclose(out_, target)
         self.assertTrue(equal.all())
+
+    def test_nd_multiexpand_view(self):
+        in_ = np.arange(6).reshape(2, 3)
+        out_ = nd_multiexpand(in_, (3, 4, 2), (2, 0))
+        self.assertEqual(out_.shape, (3, 4, 2))
+        self.assertTrue(np.shares_memory(out_, in_))
+        for i in range(2):
+            for j in range(3):
+                self.assertTrue(np.all(out_[j, :, i] == in_[i, j]))
+
+    def test_reduction_all(self):
+        rng = np.random.RandomState(0)
+        tensor = rng.rand(3, 2, 4, 2, 5)
+        marginals, scope_marginals = reduction_all(
+            tensor, [(2, 0), (4,), (1, 3)])
+        for i, marginal in enumerate(marginals):
+            self.assertTrue(np.allclose(marginal, tensor.sum(
+                axis=tuple(j for j in range(5) if j != i))))
+        self.assertTrue(np.allclose(scope_marginals[0],
+                                    tensor.sum(axis=(1, 3, 4)).T))
+        self.assertTrue(np.allclose(scope_marginals[1], marginals[4]))
+        self.assertTrue(np.allclose(scope_marginals[2],
+                                    tensor.sum(axis=(0, 2, 4))))
+
+    def test_empirical_marginal(self):
+        traj = np.array([[0, 1], [2, 1], [0, 0], [0, 1]])
+        target = np.array([[0.75, 0, 0.25], [0.25, 0.75, 0]])
+        self.assertTrue(np.allclose(empirical_marginal(traj, 3), target))
+
+    def test_nd_expand_view(self):
+        inputdata = np.array([1., 2., 3.])
+        output = nd_expand(inputdata, (2, 3, 4), 1)
+        self.assertEqual(output.shape, (2, 3, 4))
+        self.assertTrue(np.shares_memory(output, inputdata))
+        self.assertTrue(np.all(output[1, :, 2] == inputdata))
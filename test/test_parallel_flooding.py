@@ -0,0 +1,50 @@
+import unittest
+
+import numpy as np
+from cbp.builder import HMMBuilder
+from cbp.configs import BaseConfig
+from cbp.graph.coef_policy import avg_policy, bp_policy
+from cbp.graph.parallel_flooding import ParallelFlooding, partition
+
+
+class TestParallelFlooding(unittest.TestCase):
+    def test_same_as_flooding(self):
+        for log_domain in [False, True]:
+            graph = HMMBuilder(30, 3, avg_policy)()
+            graph.coef_policy = avg_policy
+            graph.cfg = BaseConfig(compiled=True, log_domain=log_domain)
+            graph.bake()
+            compiled = graph.compiled_graph
+            self.assertTrue(compiled.has_extra.any())
+
+            compiled.init_messages()
+            for _ in range(4):
+                compiled.flooding_message(run_constrained=False)
+            expected = np.array(compiled.arena.front.flat)
+
+            compiled.init_messages()
+            engine = ParallelFlooding(compiled, 3)
+            for _ in range(4):
+                num_message = engine.sweep(run_constrained=False)
+            engine.close()
+            self.assertTrue(np.allclose(compiled.arena.front.flat, expected))
+            self.assertLess(num_message, 2 * compiled.num_edge)
+
+    def test_partition(self):
+        graph = HMMBuilder(30, 3, bp_policy)()
+        graph.cfg = BaseConfig(compiled=True)
+        graph.bake()
+        chunks = partition(graph.compiled_graph, 4)
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(list(np.concatenate(chunks)),
+                         list(range(graph.compiled_graph.num_var)))
+
+    def test_run_cnp(self):
+        rtn = []
+        for num_worker in [1, 2]:
+            graph = HMMBuilder(10, 3, bp_policy)()
+            graph.cfg = BaseConfig(compiled=True, num_worker=num_worker)
+            graph.run_cnp()
+            self.assertIsNone(graph.parallel_flooding)
+            rtn.append(np.concatenate(list(graph.export_marginals().values())))
+        self.assertTrue(np.allclose(rtn[0], rtn[1], atol=1e-3))
@@ -0,0 +1,82 @@
+import unittest
+
+import numpy as np
+from cbp.builder import HMMSimBuilder, MigrSimulator
+from cbp.configs import BaseConfig
+from cbp.graph import GraphModel
+from cbp.graph.coef_policy import avg_policy, bp_policy
+from cbp.node import FactorNode, VarNode
+from scipy import sparse
+
+
+def sparse_tree(is_sparse, policy):
+    rng = np.random.RandomState(1)
+    graph = GraphModel(coef_policy=policy)
+    for idx in range(5):
+        marginal = rng.dirichlet(np.ones(4)) if idx in (2, 4) else None
+        graph.add_varnode(VarNode(4, constrained_marginal=marginal))
+    for first, second in [(0, 1), (1, 2), (1, 3), (3, 4)]:
+        potential = rng.rand(4, 4) + 0.1
+        graph.add_factornode(FactorNode(
+            [f"VarNode_{first:03d}", f"VarNode_{second:03d}"],
+            sparse.csr_matrix(potential) if is_sparse else potential))
+    return graph
+
+
+def dense(marginals):
+    return {name: marginal.toarray() if sparse.issparse(marginal)
+            else marginal for name, marginal in marginals.items()}
+
+
+class TestSparseFactor(unittest.TestCase):
+    def test_equal_dense(self):
+        for policy in [bp_policy, avg_policy]:
+            results = []
+            for is_sparse in [False, True]:
+                graph = sparse_tree(is_sparse, policy)
+                graph.bake()
+                rtn = graph.itsbp(tolerance=1e-10)
+                results.append((rtn[1], dense(
+                    graph.export_convergence_marginals())))
+            self.assertEqual(results[0][0], results[1][0])
+            for name, marginal in results[0][1].items():
+                self.assertTrue(np.allclose(marginal, results[1][1][name]))
+
+        factor = graph.factornode_recorder["FactorNode_000"]
+        self.assertTrue(factor.issparse)
+        self.assertEqual(factor.marginal().nnz, factor.potential.nnz)
+        margin = factor.marginal()
+        self.assertAlmostEqual(
+            factor.cal_bethe(margin),
+            np.sum(margin.data * np.log(margin.data /
+                                        factor.potential.data)))
+
+    def test_threshold(self):
+        factor = FactorNode(["VarNode_000", "VarNode_001"],
+                            np.array([[1e-9, 1.0], [2.0, 1.0]]),
+                            threshold=1e-6)
+        self.assertEqual(factor.potential.nnz, 3)
+        self.assertAlmostEqual(factor.potential.sum(), 1.0)
+        self.assertEqual(list(factor.missing[0]), [1, 0])
+        with self.assertRaises(ValueError):
+            FactorNode(["VarNode_000", "VarNode_001", "VarNode_002"],
+                       np.ones((2, 2, 2)), threshold=1e-6)
+
+    def test_hmm(self):
+        sim = MigrSimulator(8, 4, 4, 1)
+        sim.compile()
+        sim.sample(100)
+        marginals = []
+        for threshold in [None, 0.0]:
+            builder = HMMSimBuilder(8, sim, bp_policy, threshold=threshold)
+            graph = builder()
+            builder.fix_initpotential()
+            graph.bake()
+            graph.run_bp()
+            marginals.append(graph.export_marginals())
+        for name, marginal in marginals[0].items():
+            self.assertTrue(np.allclose(marginal, marginals[1][name]))
+
+        graph.cfg = BaseConfig(compiled=True)
+        with self.assertRaises(ValueError):
+            graph.bake()
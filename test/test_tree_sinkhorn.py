@@ -0,0 +1,47 @@
+import unittest
+
+import numpy as np
+from cbp.builder import HMMBuilder
+from cbp.graph.coef_policy import bp_policy
+
+from .utils import random_tree, sinkhorn_bp_equal
+
+
+def sinkhorn_marginals(graph, method):
+    graph.sinkhorn(method=method)
+    return np.concatenate(list(graph.export_sinkhorn().values()))
+
+
+class TestTreeSinkhorn(unittest.TestCase):
+    def test_equal_dense(self):
+        graph = HMMBuilder(5, 3, bp_policy)()
+        graph.bake()
+        self.assertTrue(np.allclose(sinkhorn_marginals(graph, "dense"),
+                                    sinkhorn_marginals(graph, "tree")))
+
+        graph = random_tree(12, seed=3)
+        rng = np.random.RandomState(3)
+        for name in ["VarNode_002", "VarNode_007", "VarNode_011"]:
+            dim = graph.varnode_recorder[name].rv_dim
+            graph.set_node(name, constrained_marginal=rng.dirichlet(
+                np.ones(dim)))
+        graph.bake()
+        self.assertTrue(np.allclose(sinkhorn_marginals(graph, "dense"),
+                                    sinkhorn_marginals(graph, "tree")))
+
+    def test_long_chain(self):
+        graph = HMMBuilder(100, 3, bp_policy)()
+        graph.run_bp()
+        graph.sinkhorn(method="tree")
+        self.assertTrue(all(sinkhorn_bp_equal(graph, 200)))
+
+        with self.assertRaises(ValueError):
+            graph.sinkhorn(method="random")
+
+    def test_jacobi(self):
+        graph = HMMBuilder(4, 3, bp_policy)()
+        expected = sinkhorn_marginals(graph, "tree")
+        for method in ["dense", "tree"]:
+            graph.sinkhorn(method=method, jacobi=True)
+            marginals = np.concatenate(list(graph.export_sinkhorn().values()))
+            self.assertTrue(np.allclose(marginals, expected, atol=1e-4))
@@ -0,0 +1,71 @@
+import unittest
+
+import numpy as np
+from cbp.builder import HMMBuilder
+from cbp.graph.coef_policy import bp_policy
+from cbp.graph.variable_elimination import JunctionTree, elimination_order
+
+from .utils import random_tree
+
+
+def bfmarginals(graph):
+    return np.concatenate([node.bfmarginal
+                           for node in graph.varnode_recorder.values()])
+
+
+class TestVariableElimination(unittest.TestCase):
+    def test_same_as_brute_force(self):
+        graph = random_tree(12, seed=2)
+        rtn = []
+        for method in ["brute_force", "elimination"]:
+            graph.exact_marginal(method=method)
+            rtn.append(bfmarginals(graph))
+        self.assertTrue(np.allclose(rtn[0], rtn[1]))
+
+        with self.assertRaises(ValueError):
+            graph.exact_marginal(method="random")
+
+    def test_grid(self):
+        rng = np.random.RandomState(0)
+        dims = [2, 3] * 6
+        factors = []
+        for var in range(12):
+            if var % 4 < 3:
+                factors.append(([var, var + 1], np.exp(
+                    rng.normal(size=(dims[var], dims[var + 1])))))
+            if var < 8:
+                factors.append(([var + 4, var], np.exp(
+                    rng.normal(size=(dims[var + 4], dims[var])))))
+        joint = np.ones(dims)
+        for scope, potential in factors:
+            shape = [1] * 12
+            for var, dim in zip(scope, potential.shape):
+                shape[var] = dim
+            joint = joint * np.moveaxis(
+                potential, [0, 1], np.argsort(np.argsort(scope))).reshape(
+                    shape)
+        joint /= np.sum(joint)
+
+        for heuristic in ["min_fill", "min_degree"]:
+            junction_tree = JunctionTree(dims, factors, heuristic)
+            self.assertEqual(junction_tree.width, 3)
+            for var in range(12):
+                expected = joint.sum(
+                    axis=tuple(j for j in range(12) if j != var))
+                self.assertTrue(np.allclose(junction_tree.marginal(var),
+                                            expected))
+
+    def test_chain_order(self):
+        order, separators = elimination_order(
+            4, [[0, 1], [1, 2], [2, 3]])
+        self.assertEqual(order, [0, 1, 2, 3])
+        self.assertEqual(separators, [(1,), (2,), (3,), ()])
+
+    def test_long_chain(self):
+        graph = HMMBuilder(200, 2, bp_policy)()
+        for name in list(graph.constrained_names):
+            graph.set_node(name, isconstrained=False)
+        graph.exact_marginal()
+        graph.tree_bp()
+        for node in graph.varnode_recorder.values():
+            self.assertTrue(np.allclose(node.bfmarginal, node.marginal()))
@@ -84,3 +84,28 @@ def sinkhorn_bp_equal(graph, len_node, is_debug=False):
             print(graph.get_node(f'VarNode_{i:03d}').sinkhorn)
         result.append(all(node_equal))
     return result
+
+
+def random_tree(num_var, seed=1):
+    """tree with mixed variable dims, pairwise, triple and unary factors"""
+    rng = RandomState(seed)
+    graph = GraphModel()
+    dims = rng.choice([2, 3], size=num_var)
+    for dim in dims:
+        graph.add_varnode(VarNode(dim, np.exp(rng.normal(size=dim))))
+    names = list(graph.varnode_recorder)
+
+    cnt = 1
+    while cnt < num_var:
+        num_child = min(rng.choice([1, 2]), num_var - cnt)
+        connect_var = [names[rng.randint(cnt)]] + \
+            names[cnt:cnt + num_child]
+        cnt += num_child
+        shape = [dims[names.index(name)] for name in connect_var]
+        graph.add_factornode(
+            FactorNode(connect_var, np.exp(rng.normal(size=shape))))
+    for idx in rng.choice(num_var, 3, replace=False):
+        graph.add_factornode(
+            FactorNode([names[idx]], np.exp(rng.normal(size=dims[idx]))))
+
+    return graph